@@ -0,0 +1,296 @@
+"""
+Throughput and latency of the emission paths of the OrsaySTEM and OrsayCamera viewers, on the simulated libraries.
+
+For each case the viewer is run headless for a given duration and the report gives the sustained rate of frames (or
+spectra) acquired and emitted, and the percentiles of the latency between the dll callback of a frame and its emission
+(from the acquisition_time attribute of the emitted data). The simulated libraries deliver the data as fast as
+possible unless --time-scale is given.
+
+Cases:
+    * stem: DAQ_2DViewer_OrsaySTEM in live and capture modes, for each of --sizes
+    * camera: DAQ_2DViewer_OrsayCamera in Camera (2D frames), spectrum (Camera mode, full vertical binning) and SPIM
+      modes
+    * inputs: the Scan.dll callbacks alone (locker and unlockerA through orsayscan) for 1 to 8 video inputs, the STEM
+      viewer itself acquiring two of them
+
+Usage::
+
+    python benchmarks/bench_viewers.py --output report.json
+    python benchmarks/bench_viewers.py --cases stem --sizes 64 256 --duration 5 --baseline previous_report.json
+"""
+import argparse
+from contextlib import redirect_stdout
+from datetime import datetime
+import io
+import json
+import os
+from pathlib import Path
+import platform
+import sys
+import time
+
+import numpy as np
+
+DEFAULT_SIZES = [64, 256, 1024, 4096]
+CASES = ['stem', 'camera', 'inputs']
+
+
+def setup_environment(time_scale=0.):
+    """ Select the simulated libraries, to be called before importing the plugins """
+    os.environ.setdefault('ORSAY_SCAN_BACKEND', 'simulator')
+    os.environ.setdefault('ORSAY_CAMERA_BACKEND', 'simulator')
+    os.environ['ORSAY_SIMULATOR_TIME_SCALE'] = str(time_scale)
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+
+def percentile_ms(values, percent):
+    return float(np.percentile(values, percent) * 1e3) if len(values) else None
+
+
+class EmissionRecorder:
+    """ Slot connected to the data signals of a viewer, records the emission latency of the stamped data """
+
+    def __init__(self):
+        self.emissions = 0
+        self.latencies = []
+
+    def __call__(self, data):
+        now = time.perf_counter()
+        self.emissions += 1
+        for dwa in getattr(data, 'data', data):  # DataToExport or list of DataFromPlugins
+            acquisition_time = getattr(dwa, 'acquisition_time', None)
+            if acquisition_time is not None:
+                self.latencies.append(now - acquisition_time)
+                break
+
+    def result(self, elapsed, frames, **kwargs):
+        return dict(duration_s=elapsed, frames=frames, frames_per_s=frames / elapsed if elapsed > 0 else None,
+                    emissions=self.emissions, emissions_per_s=self.emissions / elapsed if elapsed > 0 else None,
+                    latency_p50_ms=percentile_ms(self.latencies, 50),
+                    latency_p99_ms=percentile_ms(self.latencies, 99),
+                    latency_max_ms=float(max(self.latencies) * 1e3) if self.latencies else None, **kwargs)
+
+
+def wait(app, condition, timeout):
+    """ Process the Qt events until condition() is True or timeout (s), returns condition() """
+    deadline = time.perf_counter() + timeout
+    while not condition() and time.perf_counter() < deadline:
+        app.processEvents()
+        time.sleep(0.001)
+    return condition()
+
+
+def silence(viewer):
+    """ The settings and status updates are printed when the viewer has no DAQ_Viewer parent """
+    viewer.emit_status = lambda status: None
+
+
+def bench_stem(app, mode, size, duration):
+    from pymodaq_plugins_orsay.daq_viewer_plugins.plugins_2D.daq_2Dviewer_OrsaySTEM import DAQ_2DViewer_OrsaySTEM
+
+    viewer = DAQ_2DViewer_OrsaySTEM()
+    silence(viewer)
+    recorder = EmissionRecorder()
+    finals = []
+    viewer.data_grabed_signal.connect(recorder)
+    viewer.data_grabed_signal.connect(lambda data: finals.append(None))
+    viewer.data_grabed_signal_temp.connect(recorder)
+    viewer.ini_detector()
+    viewer.settings.child('stem_settings', 'pixels_settings', 'Nx').setValue(size)
+    viewer.settings.child('stem_settings', 'pixels_settings', 'Ny').setValue(size)
+    viewer.commit_settings(viewer.settings.child('stem_settings', 'pixels_settings', 'Nx'))
+    for name in ('pixel_time_live', 'pixel_time_capture'):
+        viewer.settings.child('stem_settings', 'times', name).setValue(1)
+    try:
+        start = time.perf_counter()
+        if mode == 'live':
+            viewer.grab_data(live=True)
+            wait(app, lambda: False, duration)
+            viewer.stop()
+            elapsed = time.perf_counter() - start
+            frames = viewer.frame_counter.sequence
+        else:
+            frames = 0
+            while time.perf_counter() - start < duration or frames == 0:
+                count = len(finals)
+                viewer.grab_data()
+                if not wait(app, lambda: len(finals) > count, 60 + 10 * duration):
+                    break
+                frames += 1
+            elapsed = time.perf_counter() - start
+        return recorder.result(elapsed, frames, skipped=viewer.frame_counter.skipped, late=viewer.frame_counter.late,
+                               dropped=viewer.callback_queue.dropped, coalesced=viewer.callback_queue.coalesced)
+    finally:
+        viewer.close()
+
+
+def bench_camera(app, mode, duration, spim_size=64):
+    from pymodaq_plugins_orsay.daq_viewer_plugins.plugins_2D.daq_2Dviewer_OrsayCamera import DAQ_2DViewer_OrsayCamera
+
+    viewer = DAQ_2DViewer_OrsayCamera()
+    silence(viewer)
+    recorder = EmissionRecorder()
+    finals = []
+    viewer.dte_signal.connect(recorder)
+    viewer.dte_signal.connect(lambda data: finals.append(None))
+    viewer.dte_signal_temp.connect(recorder)
+    viewer.ini_detector()
+    viewer.controller.setCurrentPort(1)  # fastest readout of the simulated cameras
+    viewer.settings.child('exposure').setValue(0.)
+    viewer.commit_settings(viewer.settings.child('exposure'))
+    if mode == 'spectrum':  # full vertical binning
+        bin_y = viewer.settings['image_size', 'Ny'] * viewer.settings['binning_settings', 'bin_y']
+        viewer.settings.child('binning_settings', 'bin_y').setValue(bin_y)
+        viewer.commit_settings(viewer.settings.child('binning_settings', 'bin_y'))
+    elif mode == 'spim':
+        viewer.settings.child('camera_mode_settings', 'spim_x').setValue(spim_size)
+        viewer.settings.child('camera_mode_settings', 'spim_y').setValue(spim_size)
+        viewer.settings.child('camera_mode_settings', 'camera_mode').setValue('SPIM')
+        viewer.commit_settings(viewer.settings.child('camera_mode_settings', 'camera_mode'))
+    size = [spim_size, spim_size] if mode == 'spim' else \
+        [viewer.settings['image_size', 'Nx'], viewer.settings['image_size', 'Ny']]
+    try:
+        frames = 0
+        skipped = late = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration or frames == 0:
+            count = len(finals)
+            viewer.grab_data(1)
+            if not wait(app, lambda: len(finals) > count, 60 + 10 * duration):
+                break
+            frames += viewer.frame_counter.sequence  # spectra of the SPIM
+            skipped += viewer.frame_counter.skipped
+            late += viewer.frame_counter.late
+        elapsed = time.perf_counter() - start
+        return recorder.result(elapsed, frames, size=size, skipped=skipped, late=late,
+                               dropped=viewer.callback_queue.dropped,
+                               coalesced=viewer.callback_queue.coalesced)
+    finally:
+        viewer.close()
+
+
+def bench_inputs(inputs, size, duration):
+    from pymodaq_plugins_orsay.hardware.STEM import orsayscan
+
+    scan = orsayscan.orsayScan(1)
+    scan.setImageSize(size, size)
+    scan.SetInputs(list(range(inputs)))
+    scan.pixelTime = 1e-6
+    buffer = np.zeros((inputs, size, size), dtype=np.int16)
+    frames = []
+    unlocks = []
+
+    def locker(gene, datatype, sx, sy, sz):
+        datatype[0], sx[0], sy[0], sz[0] = 2, size, size, inputs
+        return buffer.ctypes.data
+
+    def unlocker(gene, newdata, imagenb, rect):
+        unlocks.append(None)
+        if newdata and rect[1] + rect[3] == size:
+            frames.append(None)
+
+    fnlock = orsayscan.LOCKERFUNC(locker)
+    fnunlock = orsayscan.UNLOCKERFUNCA(unlocker)
+    scan.registerLocker(fnlock)
+    scan.registerUnlockerA(fnunlock)
+    try:
+        start = time.perf_counter()
+        scan.startImaging(0, 1)
+        while time.perf_counter() - start < duration or not frames:
+            time.sleep(0.01)
+        scan.stopImaging(True)
+        elapsed = time.perf_counter() - start
+    finally:
+        scan.close()
+    return dict(duration_s=elapsed, frames=len(frames), frames_per_s=len(frames) / elapsed,
+                unlocks_per_s=len(unlocks) / elapsed, pixels_per_s=len(frames) * inputs * size ** 2 / elapsed)
+
+
+def run(cases=CASES, sizes=DEFAULT_SIZES, inputs_size=256, duration=2., time_scale=0., log=print):
+    """ Run the benchmark cases, returns the report as a dict """
+    setup_environment(time_scale)
+    from qtpy import QtWidgets
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+    results = []
+
+    def add(function, *args, **case):
+        with redirect_stdout(io.StringIO()):  # the plugins print their status and settings updates
+            result = dict(case, **function(*args))
+        results.append(result)
+        log(format_result(result))
+
+    if 'stem' in cases:
+        for mode in ('live', 'capture'):
+            for size in sizes:
+                add(bench_stem, app, mode, size, duration, bench='stem', mode=mode, size=[size, size], inputs=2)
+    if 'camera' in cases:
+        for mode in ('camera', 'spectrum', 'spim'):
+            add(bench_camera, app, mode, duration, bench='camera', mode=mode)
+    if 'inputs' in cases:
+        for inputs in range(1, 9):
+            add(bench_inputs, inputs, inputs_size, duration, bench='inputs', mode='scan',
+                size=[inputs_size, inputs_size], inputs=inputs)
+    return dict(metadata=metadata(time_scale, duration), results=results)
+
+
+def metadata(time_scale, duration):
+    import pymodaq
+    import pymodaq_plugins_orsay
+    version_file = Path(pymodaq_plugins_orsay.__file__).parent.joinpath('resources', 'VERSION')
+    return dict(date=datetime.now().isoformat(), version=version_file.read_text().strip(),
+                pymodaq=getattr(pymodaq, '__version__', ''), numpy=np.__version__, python=sys.version.split()[0],
+                platform=platform.platform(), processor=platform.processor(), time_scale=time_scale,
+                duration_s=duration, scan_backend=os.environ['ORSAY_SCAN_BACKEND'],
+                camera_backend=os.environ['ORSAY_CAMERA_BACKEND'])
+
+
+def case_key(result):
+    return result['bench'], result['mode'], tuple(result.get('size', ())), result.get('inputs', None)
+
+
+def format_result(result):
+    latency = '' if result.get('latency_p50_ms') is None else \
+        f", latency p50 {result['latency_p50_ms']:.2f} ms p99 {result['latency_p99_ms']:.2f} ms"
+    size = 'x'.join(str(value) for value in result.get('size', []))
+    inputs = f" {result['inputs']} inputs" if result.get('inputs') else ''
+    return f"{result['bench']} {result['mode']} {size}{inputs}: {result['frames_per_s']:.1f} frames/s{latency}"
+
+
+def compare(report, baseline):
+    """ Lines giving the change of the frame rate and p99 latency of each case relative to a baseline report """
+    previous = {case_key(result): result for result in baseline['results']}
+    lines = []
+    for result in report['results']:
+        reference = previous.get(case_key(result), None)
+        if reference is None or not reference.get('frames_per_s'):
+            continue
+        line = f"{format_result(result).split(':')[0]}: rate x{result['frames_per_s'] / reference['frames_per_s']:.2f}"
+        if result.get('latency_p99_ms') is not None and reference.get('latency_p99_ms'):
+            line += f", p99 latency x{result['latency_p99_ms'] / reference['latency_p99_ms']:.2f}"
+        lines.append(line)
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=CASES)
+    parser.add_argument('--sizes', nargs='+', type=int, default=DEFAULT_SIZES, help='STEM image sizes')
+    parser.add_argument('--inputs-size', type=int, default=256, help='image size of the inputs cases')
+    parser.add_argument('--duration', type=float, default=2., help='duration (s) of each case')
+    parser.add_argument('--time-scale', type=float, default=0.,
+                        help='time scale of the simulated libraries, 0 for as fast as possible')
+    parser.add_argument('--output', help='JSON report file')
+    parser.add_argument('--baseline', help='JSON report of a previous run to compare with')
+    args = parser.parse_args(argv)
+
+    report = run(args.cases, args.sizes, args.inputs_size, args.duration, args.time_scale)
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+        print(f'Report saved in {args.output}')
+    if args.baseline:
+        print('\n'.join(compare(report, json.loads(Path(args.baseline).read_text()))))
+
+
+if __name__ == '__main__':
+    main()
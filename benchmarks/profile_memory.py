@@ -0,0 +1,401 @@
+"""
+Memory allocated by the acquisition paths of the Orsay plugins, per frame and per spectrum, on the simulated libraries.
+
+The methods emitting the data are wrapped to measure with tracemalloc, for each call, the allocated bytes (peak of the
+traced memory during the call above its value at the call) and the retained bytes (traced memory left allocated by
+the call). The growth of the traced memory and of the resident set size (sampled by a thread) over the acquisition,
+divided by the number of frames (spectra), tells the memory kept by the acquisition: a leak during long SPIM sessions
+shows up there. The first frames, allocating the buffers reused by the next ones, are excluded by --warmup.
+
+tracemalloc is process wide: the allocations of the dll (simulator) thread during a call are counted too, the figures
+are meant to be compared between releases on the same computer rather than read as exact sizes.
+
+Cases (function profiled):
+    * stem_live: DAQ_2DViewer_OrsaySTEM live mode (emit_data_live)
+    * stem_capture: DAQ_2DViewer_OrsaySTEM capture mode (stem_done, emit_data)
+    * camera: DAQ_2DViewer_OrsayCamera in Camera mode (emit_data)
+    * spim: DAQ_2DViewer_OrsayCamera in SPIM mode, per spectrum (emit_data)
+    * nion: OrsayDevice.Device of the Nion Swift plugin (read_partial), skipped if nion is not installed
+
+Each measure can be bounded in a JSON thresholds file (see memory_thresholds.json), the script exits with an error
+when a measure exceeds its threshold::
+
+    python benchmarks/profile_memory.py --thresholds benchmarks/memory_thresholds.json --output memory.json
+
+--update-thresholds rewrites the thresholds file from the measures (with --margin), after an intended change.
+"""
+import argparse
+from contextlib import redirect_stdout
+import functools
+import gc
+import io
+import json
+import os
+from pathlib import Path
+import sys
+import threading
+import tracemalloc
+
+from bench_viewers import metadata, setup_environment, silence, wait
+
+CASES = ['stem_live', 'stem_capture', 'camera', 'spim', 'nion']
+
+
+def rss_bytes():
+    """ Resident set size of the process, None if it cannot be read """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class RSSSampler(threading.Thread):
+    """ Sample the resident set size every period (s) until stopped """
+
+    def __init__(self, period=0.05):
+        super().__init__(daemon=True)
+        self.period = period
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            rss = rss_bytes()
+            if rss is not None:
+                self.samples.append(rss)
+            self._stop_event.wait(self.period)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class CallStatistics:
+
+    def __init__(self):
+        self.calls = 0
+        self.allocated = 0
+        self.retained = 0
+        self.max_allocated = 0
+
+    def record(self, allocated, retained):
+        self.calls += 1
+        self.allocated += allocated
+        self.retained += retained
+        self.max_allocated = max(self.max_allocated, allocated)
+
+    def to_dict(self) -> dict:
+        calls = max(self.calls, 1)
+        return dict(calls=self.calls, allocated_per_call=self.allocated / calls, max_allocated=self.max_allocated,
+                    retained_per_call=self.retained / calls)
+
+
+class AllocationProfiler:
+    """ Wrap methods to record the memory allocated and retained by their calls, nested calls included """
+
+    def __init__(self):
+        self.statistics = dict()  # function name: CallStatistics
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._start_traced = 0
+        self._start_rss = None
+
+    def wrap(self, obj, name):
+        function = getattr(obj, name)
+        self.statistics[name] = CallStatistics()
+
+        @functools.wraps(function)
+        def profiled(*args, **kwargs):
+            stack = self._local.__dict__.setdefault('stack', [])
+            if stack:  # keep the peak of the calling function before resetting it
+                stack[-1][1] = max(stack[-1][1], tracemalloc.get_traced_memory()[1])
+            gc.collect()
+            tracemalloc.reset_peak()
+            start = tracemalloc.get_traced_memory()[0]
+            stack.append([start, 0])
+            try:
+                return function(*args, **kwargs)
+            finally:
+                peak = tracemalloc.get_traced_memory()[1]
+                gc.collect()  # unreachable cycles (e.g. emitted DataFromPlugins) are not retained
+                current = tracemalloc.get_traced_memory()[0]
+                peak = max(stack.pop()[1], peak)
+                if stack:
+                    stack[-1][1] = max(stack[-1][1], peak)
+                with self._lock:
+                    self.statistics[name].record(peak - start, current - start)
+        setattr(obj, name, profiled)
+
+    def reset(self):
+        """ Start the measures, called after the warmup frames """
+        with self._lock:
+            for name in self.statistics:
+                self.statistics[name] = CallStatistics()
+        gc.collect()
+        self._start_traced = tracemalloc.get_traced_memory()[0]
+        self._start_rss = rss_bytes()
+
+    def result(self, frames, sampler: RSSSampler, unit='frame') -> dict:
+        gc.collect()
+        traced = tracemalloc.get_traced_memory()[0]
+        rss = rss_bytes()
+        frames = max(frames, 1)
+        result = {'frames': frames, 'unit': unit,
+                  f'traced_growth_per_{unit}': (traced - self._start_traced) / frames,
+                  'traced_peak': tracemalloc.get_traced_memory()[1],
+                  'functions': {name: statistics.to_dict() for name, statistics in self.statistics.items()}}
+        if rss is not None and self._start_rss is not None:
+            result[f'rss_growth_per_{unit}'] = (rss - self._start_rss) / frames
+            result['rss_max'] = max(sampler.samples + [rss])
+        return result
+
+
+def stem_viewer(mode, size):
+    from pymodaq_plugins_orsay.daq_viewer_plugins.plugins_2D.daq_2Dviewer_OrsaySTEM import DAQ_2DViewer_OrsaySTEM
+
+    viewer = DAQ_2DViewer_OrsaySTEM()
+    silence(viewer)
+    viewer.ini_detector()
+    for name in ('Nx', 'Ny'):
+        viewer.settings.child('stem_settings', 'pixels_settings', name).setValue(size)
+    viewer.commit_settings(viewer.settings.child('stem_settings', 'pixels_settings', 'Nx'))
+    viewer.settings.child('stem_settings', 'times', f'pixel_time_{mode}').setValue(1)
+    return viewer
+
+
+def profile_stem_live(app, profiler, size, frames, warmup):
+    """ The live frames are emitted at the display rate, runs until frames emissions, returns the frames acquired """
+    viewer = stem_viewer('live', size)
+    profiler.wrap(viewer, 'emit_data_live')
+    try:
+        viewer.grab_data(live=True)
+        wait(app, lambda: profiler.statistics['emit_data_live'].calls >= warmup, 60)
+        profiler.reset()
+        start = viewer.frame_counter.sequence
+        wait(app, lambda: profiler.statistics['emit_data_live'].calls >= frames, 60 + frames)
+        viewer.stop()
+        return viewer.frame_counter.sequence - start
+    finally:
+        viewer.close()
+
+
+def profile_stem_capture(app, profiler, size, frames, warmup):
+    viewer = stem_viewer('capture', size)
+    finals = []
+    viewer.data_grabed_signal.connect(lambda data: finals.append(None))
+    profiler.wrap(viewer, 'stem_done')
+    profiler.wrap(viewer, 'emit_data')
+    try:
+        for ind in range(warmup + frames):
+            if ind == warmup:
+                profiler.reset()
+            viewer.grab_data()
+            if not wait(app, lambda: len(finals) > ind, 60):
+                break
+        return len(finals) - warmup
+    finally:
+        viewer.close()
+
+
+def camera_viewer(mode, spim_size):
+    from pymodaq_plugins_orsay.daq_viewer_plugins.plugins_2D.daq_2Dviewer_OrsayCamera import DAQ_2DViewer_OrsayCamera
+
+    viewer = DAQ_2DViewer_OrsayCamera()
+    silence(viewer)
+    viewer.ini_detector()
+    viewer.controller.setCurrentPort(1)  # fastest readout of the simulated cameras
+    viewer.settings.child('exposure').setValue(0.)
+    viewer.commit_settings(viewer.settings.child('exposure'))
+    if mode == 'SPIM':
+        viewer.settings.child('camera_mode_settings', 'spim_x').setValue(spim_size)
+        viewer.settings.child('camera_mode_settings', 'spim_y').setValue(spim_size)
+        viewer.settings.child('camera_mode_settings', 'camera_mode').setValue('SPIM')
+        viewer.commit_settings(viewer.settings.child('camera_mode_settings', 'camera_mode'))
+    return viewer
+
+
+def profile_camera(app, profiler, frames, warmup):
+    viewer = camera_viewer('Camera', None)
+    finals = []
+    viewer.dte_signal.connect(lambda data: finals.append(None))
+    profiler.wrap(viewer, 'emit_data')
+    try:
+        for ind in range(warmup + frames):
+            if ind == warmup:
+                profiler.reset()
+            viewer.grab_data(1)
+            if not wait(app, lambda: len(finals) > ind, 60):
+                break
+        return len(finals) - warmup
+    finally:
+        viewer.close()
+
+
+def profile_spim(app, profiler, spim_size, spims, warmup):
+    """ warmup and spims are numbers of SPIMs, returns the number of spectra of the measured SPIMs """
+    viewer = camera_viewer('SPIM', spim_size)
+    finals = []
+    viewer.dte_signal.connect(lambda data: finals.append(None))
+    profiler.wrap(viewer, 'emit_data')
+    spectra = 0
+    try:
+        for ind in range(warmup + spims):
+            if ind == warmup:
+                profiler.reset()
+            viewer.grab_data(1)
+            if not wait(app, lambda: len(finals) > ind, 60 + spim_size ** 2 / 100):
+                break
+            if ind >= warmup:
+                spectra += viewer.frame_counter.sequence
+        return spectra
+    finally:
+        viewer.close()
+
+
+def profile_nion(app, profiler, size, frames, warmup):
+    from nion.instrumentation import scan_base
+    from pymodaq_plugins_orsay.hardware.STEM.OrsayDevice import Device
+
+    device = Device()
+    parameters = scan_base.ScanFrameParameters(dict(device.current_frame_parameters.as_dict(), size=(size, size),
+                                                    pixel_time_us=1))
+    device.set_frame_parameters(parameters)
+    profiler.wrap(device, 'read_partial')
+    try:
+        device.start_frame(True)
+        frame_number, pixels_to_skip, complete_frames = None, 0, 0
+        while complete_frames < warmup + frames:
+            _, complete, _, _, frame_number, pixels_to_skip = device.read_partial(frame_number, pixels_to_skip)
+            if complete:
+                complete_frames += 1
+                frame_number = None
+                if complete_frames == warmup:
+                    profiler.reset()
+        device.cancel()
+        return frames
+    finally:
+        device.close()
+
+
+def run(cases=CASES, size=256, spim_size=32, frames=50, spims=3, warmup=3, log=print):
+    setup_environment(0.)
+    from qtpy import QtWidgets
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+    results = dict()
+    for case in cases:
+        if case == 'nion':
+            try:
+                import nion.instrumentation  # noqa: F401
+            except ImportError:
+                log('nion: skipped, nion is not installed')
+                continue
+        profiler = AllocationProfiler()
+        sampler = RSSSampler()
+        tracemalloc.start()
+        sampler.start()
+        try:
+            with redirect_stdout(io.StringIO()):  # the plugins print their status and settings updates
+                if case == 'stem_live':
+                    count = profile_stem_live(app, profiler, size, frames, warmup)
+                elif case == 'stem_capture':
+                    count = profile_stem_capture(app, profiler, size, frames, warmup)
+                elif case == 'camera':
+                    count = profile_camera(app, profiler, frames, warmup)
+                elif case == 'spim':
+                    count = profile_spim(app, profiler, spim_size, spims, 1)
+                else:
+                    count = profile_nion(app, profiler, size, frames, warmup)
+            results[case] = profiler.result(count, sampler, 'spectrum' if case == 'spim' else 'frame')
+        finally:
+            sampler.stop()
+            tracemalloc.stop()
+        log(format_result(case, results[case]))
+    report = dict(metadata=metadata(0., None), results=results)
+    report['metadata'].update(size=size, spim_size=spim_size, frames=frames, spims=spims, warmup=warmup)
+    return report
+
+
+def format_result(case, result):
+    unit = result['unit']
+    lines = [f"{case}: {result['frames']} {unit}s, traced growth {result[f'traced_growth_per_{unit}']:.0f} B/{unit}"
+             + (f", RSS growth {result[f'rss_growth_per_{unit}']:.0f} B/{unit}"
+                if f'rss_growth_per_{unit}' in result else '')]
+    lines += [f"    {name}: {statistics['calls']} calls, allocated {statistics['allocated_per_call']:.0f} B/call "
+              f"(max {statistics['max_allocated']}), retained {statistics['retained_per_call']:.0f} B/call"
+              for name, statistics in result['functions'].items()]
+    return '\n'.join(lines)
+
+
+def measures(result) -> dict:
+    """ Flat dict of the measures of a case that can be bounded by a threshold """
+    unit = result['unit']
+    values = {f'traced_growth_per_{unit}': result[f'traced_growth_per_{unit}']}
+    for name, statistics in result['functions'].items():
+        values[f'{name}.allocated_per_call'] = statistics['allocated_per_call']
+        values[f'{name}.retained_per_call'] = statistics['retained_per_call']
+    return values
+
+
+def check_thresholds(report, thresholds) -> list:
+    """ Messages for the measures of report above their threshold, thresholds being {case: {measure: bytes}} """
+    failures = []
+    for case, bounds in thresholds.items():
+        if case not in report['results']:
+            continue
+        values = measures(report['results'][case])
+        for measure, bound in bounds.items():
+            value = values.get(measure, None)
+            if value is not None and value > bound:
+                failures.append(f'{case} {measure}: {value:.0f} B above the threshold of {bound} B')
+    return failures
+
+
+def make_thresholds(report, margin, slack) -> dict:
+    """ Thresholds of margin times the measures of report plus slack bytes """
+    return {case: {measure: int(max(value, 0) * margin + slack) for measure, value in measures(result).items()}
+            for case, result in report['results'].items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=CASES)
+    parser.add_argument('--size', type=int, default=256, help='STEM image size')
+    parser.add_argument('--spim-size', type=int, default=32, help='SPIM size')
+    parser.add_argument('--frames', type=int, default=50, help='frames measured after the warmup')
+    parser.add_argument('--spims', type=int, default=3, help='SPIMs measured after a first one')
+    parser.add_argument('--warmup', type=int, default=3, help='frames acquired before measuring')
+    parser.add_argument('--output', help='JSON report file')
+    parser.add_argument('--thresholds', help='JSON thresholds file')
+    parser.add_argument('--update-thresholds', action='store_true', help='rewrite the thresholds file')
+    parser.add_argument('--margin', type=float, default=1.5, help='ratio of the thresholds to the measures')
+    parser.add_argument('--slack', type=int, default=8192, help='bytes added to the thresholds')
+    args = parser.parse_args(argv)
+
+    report = run(args.cases, args.size, args.spim_size, args.frames, args.spims, args.warmup)
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+        print(f'Report saved in {args.output}')
+    if args.thresholds:
+        path = Path(args.thresholds)
+        if args.update_thresholds:
+            thresholds = json.loads(path.read_text()) if path.exists() else dict()
+            thresholds.update(make_thresholds(report, args.margin, args.slack))
+            path.write_text(json.dumps(thresholds, indent=2))
+            print(f'Thresholds saved in {path}')
+        else:
+            failures = check_thresholds(report, json.loads(path.read_text()))
+            if failures:
+                print('\n'.join(failures))
+                sys.exit(1)
+            print('All the measures are below their thresholds')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,3 @@
-from qtpy.QtCore import QTimer
 from pymodaq.control_modules.move_utility_classes import DAQ_Move_base, comon_parameters_fun, main, DataActuatorType
 
 from pymodaq.utils.daq_utils import ThreadCommand, getLineInfo
@@ -38,7 +37,7 @@ class DAQ_Move_OrsaySTEM(DAQ_Move_base):
         if self.settings['multiaxes', 'multi_status'] == "Slave":
             new_controller = None
         else:
-            new_controller = OrsayScanPosition(1, 0)
+            new_controller = OrsayScanPosition(1, 0, shared=True)
         self.controller = self.ini_stage_init(old_controller=controller,
                                               new_controller=new_controller)
 
@@ -66,7 +65,7 @@ class DAQ_Move_OrsaySTEM(DAQ_Move_base):
             self.settings.child('bounds', 'max_bound').setValue(sizey - 1)
 
         # set timer to update image size from controller
-        self.timer: QTimer = self.startTimer(1000)  # Timer event fired every 1s
+        self.timer: int = self.startTimer(1000)  # Timer event fired every 1s
 
         info = "STEM coil"
         initialized = True
@@ -82,8 +81,9 @@ class DAQ_Move_OrsaySTEM(DAQ_Move_base):
                 # try:
                 #    self.settings.sigTreeStateChanged.disconnect(self.send_param_status)
                 # except: pass
-                self.controller.setImageSize(sizex, sizey)
-                self.controller.setImageArea(sizex, sizey, 0, sizex, 0, sizey)
+                with self.controller.batch() as batch:
+                    batch.submit(self.controller.setImageSize, sizex, sizey)
+                    batch.submit(self.controller.setImageArea, sizex, sizey, 0, sizex, 0, sizey)
                 self.settings.child('pixels_settings', 'Nx').setValue(sizex)
                 self.settings.child('pixels_settings', 'Ny').setValue(sizey)
 
@@ -103,23 +103,28 @@ class DAQ_Move_OrsaySTEM(DAQ_Move_base):
         """
 
         if param.name() == 'Nx' or param.name() == 'Ny':
-            self.controller.setImageSize(self.settings['pixels_settings', 'Nx'], self.settings['pixels_settings', 'Ny'])
-            sizex, sizey = self.controller.getImageSize()
-            self.controller.setImageArea(sizex, sizey, 0, sizex, 0, sizey)
+            with self.controller.batch() as batch:
+                batch.submit(self.set_image_size, self.settings['pixels_settings', 'Nx'],
+                             self.settings['pixels_settings', 'Ny'])
             if param.name() == 'Nx' and self.axis_name == self.axis_names[0]:
                 self.settings.child('bounds', 'max_bound').setValue(param.value() - 1)
             elif param.name() == 'Ny' and self.axis_name == self.axis_names[1]:
                 self.settings.child('bounds', 'max_bound').setValue(param.value() - 1)
 
+    def set_image_size(self, sizex, sizey):
+        """ Set the image size and its whole area, to be executed in a batch of the scan handle """
+        self.controller.setImageSize(sizex, sizey)
+        sizex, sizey = self.controller.getImageSize()
+        self.controller.setImageArea(sizex, sizey, 0, sizex, 0, sizey)
+
     def close(self):
         """
         
         """
         try:
-            self.timer.stop()
             self.killTimer(self.timer)
-            if self.controller is not None:
-                self.controller.close()
+            if self.controller is not None and self.settings['multiaxes', 'multi_status'] != "Slave":
+                self.controller.close()  # releases the scan handle shared with the other plugins
         except Exception as e:
             self.emit_status(ThreadCommand('Update_Status', [getLineInfo() + str(e), "log"]))
 
@@ -1,6 +1,9 @@
 from collections import OrderedDict
+from datetime import datetime
 import importlib
+from pathlib import Path
 import sys
+import time
 
 import ctypes
 from easydict import EasyDict as edict
@@ -8,6 +11,15 @@ import numpy as np
 from qtpy import QtWidgets
 
 from pymodaq_plugins_orsay.hardware.STEM import orsaycamera
+from pymodaq_plugins_orsay.hardware.STEM.callback_queue import CallbackQueue
+from pymodaq_plugins_orsay.hardware.STEM.acquisition_geometry import AcquisitionGeometry, orsay_data_type
+from pymodaq_plugins_orsay.hardware.STEM.spim_writer import SpimWriter
+from pymodaq_plugins_orsay.hardware.STEM.buffers import BufferPool
+from pymodaq_plugins_orsay.hardware.STEM.status_monitor import StatusMonitor
+from pymodaq_plugins_orsay.hardware.STEM.energy_windows import EnergyWindowMaps, parse_energy_windows
+from pymodaq_plugins_orsay.hardware.STEM.frame_counter import FrameCounter, FrameStamp
+from pymodaq_plugins_orsay.hardware.STEM.instrumentation import (instrumentation, instrumentation_params,
+                                                                  commit_instrumentation_settings)
 from pymodaq.control_modules.viewer_utility_classes import DAQ_Viewer_base, main
 from pymodaq.utils.daq_utils import ThreadCommand, getLineInfo
 from pymodaq.utils.enums import BaseEnum, enum_checker
@@ -280,11 +292,23 @@ class DAQ_2DViewer_OrsayCamera(DAQ_Viewer_base):
          'value': orsay_config('camera', 'default')},
         {'title': 'SN:', 'name': 'serialnumber', 'type': 'str', 'value': ''},
         {'title': 'Mode Settings:', 'name': 'camera_mode_settings', 'type': 'group', 'expanded': True, 'children': [
-            {'title': 'Mode:', 'name': 'camera_mode', 'type': 'list', 'limits': Orsay_Camera_mode.names()},
+            {'title': 'Mode:', 'name': 'camera_mode', 'type': 'list', 'limits': Orsay_Camera_mode.names(),
+             'value': 'Camera'},
             {'title': 'Nx:', 'name': 'spim_x', 'type': 'int', 'value': 10, 'min': 1},
             {'title': 'Ny:', 'name': 'spim_y', 'type': 'int', 'value': 10, 'min': 1},
+            {'title': 'Progress (%):', 'name': 'spim_progress', 'type': 'float', 'value': 0., 'readonly': True},
+            {'title': 'Remaining (s):', 'name': 'spim_eta', 'type': 'float', 'value': 0., 'readonly': True},
+            {'title': 'Energy windows:', 'name': 'energy_windows', 'type': 'text', 'value': '',
+             'tip': 'One map per line as name: start-stop [bg_start-bg_stop], in channel indexes (stop excluded), '
+                    'the mean level of the optional background window is subtracted'},
+            {'title': 'Stream to disk:', 'name': 'stream_spim', 'type': 'bool', 'value': False,
+             'tip': 'Append the SPIM spectra to a HDF5 file while they are acquired'},
+            {'title': 'Stream folder:', 'name': 'stream_folder', 'type': 'browsepath', 'filetype': False,
+             'value': orsay_config('spim', 'stream_folder')},
         ]},
         {'title': 'Exposure (s):', 'name': 'exposure', 'type': 'float', 'value': 1, 'default': 0.1},
+        {'title': 'Data type:', 'name': 'data_type', 'type': 'list', 'limits': ['uint16', 'int32', 'float32'],
+         'value': 'float32', 'tip': 'Type of the buffers filled by the camera, uint16 for the 16 bits cameras'},
         {'title': 'Image size:', 'name': 'image_size', 'type': 'group', 'children': [
             {'title': 'Nx:', 'name': 'Nx', 'type': 'int', 'value': 256, 'default': 256, 'readonly': True},
             {'title': 'Ny:', 'name': 'Ny', 'type': 'int', 'value': 1024, 'default': 1024, 'readonly': True},
@@ -294,27 +318,60 @@ class DAQ_2DViewer_OrsayCamera(DAQ_Viewer_base):
             {'title': 'Current value:', 'name': 'current_value', 'type': 'float', 'value': 0, 'default': 0,
              'readonly': True},
             {'title': 'Locked:', 'name': 'locked', 'type': 'led', 'value': False, 'default': False, 'readonly': True},
+            {'title': 'Status period (s):', 'name': 'status_period', 'type': 'float', 'value': 1., 'min': 0.05,
+             'tip': 'Polling period of the camera status, shared by all the plugins using this camera'},
         ]},
         {'title': 'Binning Settings:', 'name': 'binning_settings', 'type': 'group', 'children': [
             {'name': 'bin_x', 'type': 'int', 'value': 1, 'default': 1, 'min': 1},
             {'name': 'bin_y', 'type': 'int', 'value': 1, 'default': 1, 'min': 1}
-        ]}
-    ]
-    hardware_averaging = False
+        ]},
+        {'title': 'Display:', 'name': 'display', 'type': 'group', 'children': [
+            {'title': 'Display rate (Hz):', 'name': 'display_rate', 'type': 'float', 'value': 20., 'min': 0.,
+             'tip': 'Maximum rate of the spectra emission while a SPIM is running (0 for no limit)'},
+            {'title': 'Coalesced:', 'name': 'coalesced', 'type': 'int', 'value': 0, 'readonly': True},
+            {'title': 'Dropped:', 'name': 'dropped', 'type': 'int', 'value': 0, 'readonly': True},
+            {'title': 'Late after (ms):', 'name': 'late_delay', 'type': 'float', 'value': 500., 'min': 0.,
+             'tip': 'Frames and spectra emitted later than this after their acquisition are counted as late'},
+        ]},
+    ] + instrumentation_params
+    hardware_averaging = True  # Naverage frames are summed by the camera (Cumul mode)
+    spim_map_max_size = 256  # the intensity map displayed while a SPIM is running is decimated above this size
+    spim_map_chunk = 1024  # number of spectra integrated at once in the maps
 
     def ini_attributes(self):
 
         self.controller: orsaycamera.orsayCamera = None
+        self.status_monitor: StatusMonitor = None
+        self.timer: int = None
         self.x_axis: Axis = None
         self.y_axis: Axis = None
 
         self.data = None
+        self.spimdata: np.ndarray = None  # memory mapped above the buffers/ram_budget of the config
+        self.spim_map: np.ndarray = None  # integrated intensity of the spectra, see update_spim_map
+        self.energy_maps: EnergyWindowMaps = None  # maps of the energy_windows setting, None if there is none
+        self.spim_current = 0  # index of the spectrum being acquired, given by spimUpdateInfo
+        self._spim_map_done = 0
+        self._spim_start = 0.
+        self.buffer_pool = BufferPool(ram_budget=orsay_config('buffers', 'ram_budget') * 1024 ** 2,
+                                      folder=orsay_config('buffers', 'memmap_folder'),
+                                      remove_files=orsay_config('buffers', 'remove_memmap_files'))
+        self._camera_mode_key = None  # settings the buffers have been allocated for, see camera_mode_key
         self.CCDSIZEX, self.CCDSIZEY = (None, None)
-        self.data_pointer = None
+        # buffers given to the locker callbacks, rebuilt by update_camera_mode
+        self.geometry: AcquisitionGeometry = None
+        self.spim_geometry: AcquisitionGeometry = None
+        self.spectrum_geometry: AcquisitionGeometry = None
         self.camera_done = False
         self.spectrum_done = False
         self.spim_done = False
+        self.Naverage = 1
+        self.accumulated = 0  # number of frames summed by the camera since the start of the grab
         self.data_shape = 'Data2D'
+        self.callback_queue: CallbackQueue = None  # the unlockers put items, emit_data is called from its thread
+        self.spim_writer: SpimWriter = None
+        self.frame_counter = FrameCounter(self.settings['display', 'late_delay'] / 1000)
+        self.frame_stamp: FrameStamp = None  # stamp of the frame or spectrum being emitted
 
     def commit_settings(self, param):
         """
@@ -334,6 +391,10 @@ class DAQ_2DViewer_OrsayCamera(DAQ_Viewer_base):
                 self.controller.setExposureTime(self.settings['exposure'])
             elif param.name() == 'set_point':
                 self.controller.setTemperature(param.value())
+            elif param.name() == 'status_period':
+                self.status_monitor.period = param.value()
+            elif param.name() == 'energy_windows':
+                self.update_energy_maps()
             elif param.name() == 'manufacturer':
                 mod = importlib.import_module(__file__)
                 models = getattr(mod, f'{param.value()}_models')
@@ -345,6 +406,14 @@ class DAQ_2DViewer_OrsayCamera(DAQ_Viewer_base):
 
             elif param.name() == 'camera_mode':
                 self.update_camera_mode(param.value())
+            elif param.name() == 'data_type':
+                self.update_camera_mode(self.settings['camera_mode_settings', 'camera_mode'])
+            elif param.name() == 'display_rate':
+                self.callback_queue.display_rate = param.value()
+            elif param.name().startswith('instrumentation_'):
+                commit_instrumentation_settings(param)
+            elif param.name() == 'late_delay':
+                self.frame_counter.late_delay = param.value() / 1000
 
             if param.name() in ['bin_x', 'bin_y']:
                 self.get_xaxis()
@@ -386,11 +455,7 @@ class DAQ_2DViewer_OrsayCamera(DAQ_Viewer_base):
 
 
        """
-        sx[0] = self.settings['image_size', 'Nx']
-        sy[0] = self.settings['image_size', 'Ny']
-        sz[0] = 1
-        datatype[0] = 11
-        return self.data_pointer.value
+        return self.geometry.fill_locker(datatype, sx, sy, sz)
 
     def dataUnlocker(self, camera, newdata):
         """
@@ -412,20 +477,18 @@ class DAQ_2DViewer_OrsayCamera(DAQ_Viewer_base):
         # print(self.data[0:10])
         if newdata:
             self.camera_done = True
-            self.emit_data()
+            self.accumulated += 1
+            stamp = self.frame_counter.record()
+            if self.accumulated >= self.Naverage:
+                self.callback_queue.put(('camera', stamp), final=True)
+            else:
+                self.callback_queue.put(('accumulation', stamp))
 
     def spimdataLocker(self, camera, datatype, sx, sy, sz):
         """
         Même chose que pour le mode focus, mais le tableau est 3D, voire plus
         """
-        SPIMX = self.settings['camera_mode_settings', 'spim_x']
-        SPIMY = self.settings['camera_mode_settings', 'spim_y']
-        sizex = self.settings['image_size', 'Nx']
-        sx[0] = SPIMX
-        sy[0] = SPIMY
-        sz[0] = sizex
-        datatype[0] = 11
-        return self.pointeurspim.value
+        return self.spim_geometry.fill_locker(datatype, sx, sy, sz)
 
     def spimdataUnlocker(self, camera, newdata, running):
         if running:
@@ -433,8 +496,15 @@ class DAQ_2DViewer_OrsayCamera(DAQ_Viewer_base):
             # print(".", end = "")
             pass
         else:
+            if newdata:  # the last spectrum, spimUpdateInfo is called after this unlocker
+                self.spim_current = self.spim_map.size
             self.spim_done = True
-            self.emit_data()
+            self.callback_queue.put(('spim', FrameStamp(self.frame_counter.sequence, time.perf_counter())),
+                                    final=True)
+
+    def spimUpdateInfo(self, currentspectrum, running):
+        """ Called by the dll after each spectrum of the SPIM, only records the progress """
+        self.spim_current = currentspectrum
 
     def spectrumdataLocker(self, camera, datatype, sx):
         """
@@ -452,10 +522,7 @@ class DAQ_2DViewer_OrsayCamera(DAQ_Viewer_base):
             11  float 32 bit
             12  double 64 bit
         """
-        sizex = self.settings['image_size', 'Nx']
-        sx[0] = sizex
-        datatype[0] = 11
-        return self.pointeurspectrum.value
+        return self.spectrum_geometry.fill_locker(datatype, sx)
 
     def spectrumdataUnlocker(self, camera, newdata):
         """
@@ -463,10 +530,115 @@ class DAQ_2DViewer_OrsayCamera(DAQ_Viewer_base):
         on imprime les premières valeurs
         """
         self.spectrum_done = True
-        self.emit_data()
-
-    def emit_data(self):
+        spim_writer = self.spim_writer
+        if spim_writer is not None and newdata:
+            spim_writer.add_spectrum(self.spectrumdata)
+        self.callback_queue.put(('spectrum', self.frame_counter.record(self.spim_current)))
+
+    def process_callback(self, item):
+        """ Called by the callback queue thread with the (kind, FrameStamp) items put by the unlockers """
+        kind, stamp = item
+        self.frame_stamp = stamp  # also reset by grab_data from the main thread, see frame_counter.emitted below
+        final = kind in ('camera', 'spim')
+        self.emit_data(final=final)
+        self.frame_counter.emitted(stamp)
+        if final:
+            self.update_queue_counters()
+        if kind == 'spim':
+            self.close_spim_writer()
+
+    def update_spim_map(self, final=False):
+        """ Integrate into spim_map the spectra acquired since the last call
+
+        Each spectrum is summed once, so that the cost of the display is proportional to the spectrum length and not
+        to the size of the cube. final integrates the whole remaining cube.
+        """
+        energy_maps = self.energy_maps  # may be replaced from the Qt thread, see update_energy_maps
+        nspectra = self.spim_map.size
+        done = nspectra if final else min(self.spim_current, nspectra)
+        start = self._spim_map_done if done >= self._spim_map_done else 0  # else a new SPIM
+        cube = self.spimdata.reshape((self.settings['image_size', 'Nx'], nspectra))
+        for first in range(start, done, self.spim_map_chunk):
+            last = min(first + self.spim_map_chunk, done)
+            if energy_maps is None:
+                self.spim_map.flat[first:last] = cube[:, first:last].sum(axis=0)
+            else:
+                self.spim_map.flat[first:last] = energy_maps.update(cube[:, first:last], first)
+        if energy_maps is self.energy_maps:
+            self._spim_map_done = done
+
+    def update_energy_maps(self):
+        """ Create the maps of the energy_windows setting, they are filled from the spectra already acquired """
+        self.energy_maps = None
+        if self.spim_map is None:
+            return
+        try:
+            windows = parse_energy_windows(self.settings['camera_mode_settings', 'energy_windows'],
+                                           self.settings['image_size', 'Nx'])
+        except ValueError as e:
+            self.emit_status(ThreadCommand('Update_Status', [str(e), 'log']))
+            windows = []
+        if windows:
+            self.energy_maps = EnergyWindowMaps(windows, self.spim_map.shape, self.settings['image_size', 'Nx'])
+        self._spim_map_done = 0
+
+    def final_spim_cube(self) -> np.ndarray:
+        """ The SPIM cube emitted as final data, which the next grabs do not overwrite
+
+        A cube in RAM is copied. A memory mapped cube is not: it is detached from the buffer pool (its file is kept and
+        given in the memmap_file attribute of the emitted cube), and the next grab allocates a new one.
+        """
+        cube = self.spimdata.reshape((self.settings['image_size', 'Nx'],
+                                      self.settings['camera_mode_settings', 'spim_y'],
+                                      self.settings['camera_mode_settings', 'spim_x']))
+        if isinstance(self.spimdata, np.memmap):
+            self.buffer_pool.detach('spim')
+            self._camera_mode_key = None  # update_camera_mode takes a new SPIM buffer from the pool
+            return cube
+        return cube.copy()
+
+    def energy_map_data(self, decimation=(1, 1)):
+        if self.energy_maps is None:
+            return []
+        return [DataFromPlugins(name=f'Map {window.name}',
+                                data=[data_map[::decimation[0], ::decimation[1]].copy()], dim='Data2D')
+                for window, data_map in zip(self.energy_maps.windows, self.energy_maps.maps)]
+
+    def update_spim_progress(self):
+        nspectra = self.spim_map.size
+        done = min(self.spim_current, nspectra)
+        elapsed = time.perf_counter() - self._spim_start
+        self.settings.child('camera_mode_settings', 'spim_progress').setValue(100 * done / nspectra)
+        self.settings.child('camera_mode_settings', 'spim_eta').setValue(
+            elapsed / done * (nspectra - done) if done > 0 else 0.)
+
+    def frame_attributes(self) -> dict:
+        """ Extra attributes of the emitted data: sequence number and acquisition time of the frame """
+        stamp = self.frame_stamp
+        if stamp is None:
+            return dict()
+        return dict(sequence=stamp.sequence, acquisition_time=stamp.timestamp)
+
+    def get_frames_data(self) -> DataFromPlugins:
+        """ Data0D of the frame accounting: frames (or spectra) received, skipped by the hardware numbering, emitted
+        late and dropped by the callback queue """
+        return DataFromPlugins(name='Frames', data=[np.array([self.frame_counter.sequence]),
+                                                    np.array([self.frame_counter.skipped]),
+                                                    np.array([self.frame_counter.late]),
+                                                    np.array([self.callback_queue.dropped])],
+                               labels=['frames', 'skipped', 'late', 'dropped'], dim='Data0D')
+
+    def update_queue_counters(self):
+        self.settings.child('display', 'coalesced').setValue(self.callback_queue.coalesced)
+        self.settings.child('display', 'dropped').setValue(self.callback_queue.dropped)
+
+    def emit_data(self, final=False):
         """ Method used to emit data obtained by dataUnlocker callback.
+
+        final is True for the last frame of the accumulation in Camera mode, the emitted frame is then the average of
+        the Naverage frames summed by the camera (the running average is displayed in between). In SPIM mode, final is
+        True for the item put by the spimdataUnlocker at the end of the SPIM: the data is then emitted as final even if
+        the last spectrum has already been displayed.
         """
         try:
             self.ind_grabbed += 1
@@ -483,34 +655,60 @@ class DAQ_2DViewer_OrsayCamera(DAQ_Viewer_base):
                         self.y_axis.index = 0
                         self.x_axis.index = 1
                         axis = [self.x_axis, self.y_axis]
-                    self.dte_signal.emit(
-                        DataToExport('OrsayCamera', data=
+                    frame = self.data
+                    if self.Naverage > 1:
+                        frame = frame / (self.Naverage if final else max(1, min(self.accumulated, self.Naverage)))
+                    elif final:  # self.data is reused by the next grabs, the final frame is kept by DAQ_Viewer
+                        frame = frame.copy()
+                    data = DataToExport('OrsayCamera', data=
                         [DataFromPlugins(name=f"Camera {self.settings['model']}",
-                                         data=[np.atleast_1d(np.squeeze(self.data.reshape(
+                                         data=[np.atleast_1d(np.squeeze(frame.reshape(
                                              (self.settings['image_size', 'Ny'],
                                               self.settings['image_size', 'Nx']))))],
-                                         axes=axis)]))
+                                         axes=axis, **self.frame_attributes()),
+                         self.get_frames_data()])
+                    if final:
+                        self.dte_signal.emit(data)
+                    else:
+                        self.dte_signal_temp.emit(data)
 
             else:  # spim mode
                 # print("spimmode")
-                if self.spectrum_done:
+                if self.spectrum_done or final:
                     # print("spectrum done")
-                    data = DataToExport('OrsaySPIM', data=
-                            [DataFromPlugins(name='SPIM ',
-                                             data=[np.atleast_1d(np.squeeze(self.spimdata.reshape(
-                                                 (self.settings['image_size', 'Nx'],
-                                                  self.settings['camera_mode_settings', 'spim_y'],
-                                                  self.settings['camera_mode_settings', 'spim_x']))))],
-                                             dim='DataND'),
-                             DataFromPlugins(name='Spectrum',
-                                             data=[self.spectrumdata],
-                                             dim='Data1D')
-                             ])
-                    if not self.spim_done:
+                    self.update_spim_map(final)
+                    self.update_spim_progress()
+                    if not final:  # latest spectrum and decimated map only, never the cube
+                        decimation = [int(np.ceil(size / self.spim_map_max_size)) for size in self.spim_map.shape]
+                        data = DataToExport('OrsaySPIM', data=
+                                [DataFromPlugins(name='Spectrum',
+                                                 data=[self.spectrumdata],
+                                                 dim='Data1D', **self.frame_attributes()),
+                                 DataFromPlugins(name='SPIM map',
+                                                 data=[self.spim_map[::decimation[0], ::decimation[1]].copy()],
+                                                 dim='Data2D'),
+                                 self.get_frames_data()
+                                 ] + self.energy_map_data(decimation))
                         self.spectrum_done = False
                         self.dte_signal_temp.emit(data)
-                    elif self.spim_done:
+                    else:
                         # print('spimdone')
+                        cube = self.final_spim_cube()
+                        cube_attributes = self.frame_attributes()
+                        if isinstance(cube, np.memmap):
+                            cube_attributes['memmap_file'] = cube.filename
+                        data = DataToExport('OrsaySPIM', data=
+                                [DataFromPlugins(name='SPIM ',
+                                                 data=[np.atleast_1d(np.squeeze(cube))],
+                                                 dim='DataND', **cube_attributes),
+                                 DataFromPlugins(name='Spectrum',
+                                                 data=[self.spectrumdata.copy()],
+                                                 dim='Data1D', **self.frame_attributes()),
+                                 DataFromPlugins(name='SPIM map',
+                                                 data=[self.spim_map.copy()],
+                                                 dim='Data2D'),
+                                 self.get_frames_data()
+                                 ] + self.energy_map_data())
                         self.dte_signal.emit(data)
                     self.spectrum_done = False
                     self.spim_done = False
@@ -518,6 +716,29 @@ class DAQ_2DViewer_OrsayCamera(DAQ_Viewer_base):
         except Exception as e:
             self.emit_status(ThreadCommand('Update_Status', [getLineInfo() + str(e), 'log']))
 
+    def start_spim_writer(self, spim_x, spim_y):
+        """ Create the writer streaming the spectra to a HDF5 file if the stream_spim setting is on """
+        self.close_spim_writer()
+        if self.settings['camera_mode_settings', 'stream_spim']:
+            folder = Path(self.settings['camera_mode_settings', 'stream_folder'] or Path.home())
+            path = folder.joinpath(f"spim_{datetime.now().strftime('%Y%m%d_%H%M%S')}.h5")
+            self.spim_writer = SpimWriter(path, self.spectrumdata.size, spim_x * spim_y, spim_shape=(spim_y, spim_x),
+                                          dtype=self.spectrumdata.dtype,
+                                          attributes=dict(model=self.settings['model'],
+                                                          exposure=self.settings['exposure']))
+            self.spim_writer.start()
+
+    def close_spim_writer(self):
+        spim_writer = self.spim_writer
+        if spim_writer is not None:
+            self.spim_writer = None
+            written = spim_writer.close()
+            if spim_writer.error is None:
+                message = f'{written} spectra saved in {spim_writer.path}'
+            else:
+                message = f'SPIM streaming to {spim_writer.path} failed after {written} spectra: {spim_writer.error}'
+            self.emit_status(ThreadCommand('Update_Status', [message, 'log']))
+
     def ini_detector(self, controller=None):
         """ Initialisation procedure of the detector in four steps :
                 * Register callback to get data from camera
@@ -544,23 +765,35 @@ class DAQ_2DViewer_OrsayCamera(DAQ_Viewer_base):
         self.controller = self.ini_detector_init(controller, new_controller=new_controller)
 
         # %%%%%%% Register callback to get data from camera
+        self.callback_queue = CallbackQueue(self.process_callback, display_rate=self.settings['display', 'display_rate'],
+                                            name='OrsayCameraCallbackQueue')
+        self.callback_queue.start()
         # mode camera only
-        self.fnlock = orsaycamera.DATALOCKFUNC(self.dataLocker)
+        self.fnlock = orsaycamera.DATALOCKFUNC(
+            instrumentation.timed_callback('OrsayCamera.dataLocker', self.dataLocker))
         self.controller.registerDataLocker(self.fnlock)
 
-        self.fnunlock = orsaycamera.DATAUNLOCKFUNC(self.dataUnlocker)
+        self.fnunlock = orsaycamera.DATAUNLOCKFUNC(
+            instrumentation.timed_callback('OrsayCamera.dataUnlocker', self.dataUnlocker))
         self.controller.registerDataUnlocker(self.fnunlock)
 
         # mode SPIM+spectrum
-        self.fnspimlock = orsaycamera.SPIMLOCKFUNC(self.spimdataLocker)
+        self.fnspimlock = orsaycamera.SPIMLOCKFUNC(
+            instrumentation.timed_callback('OrsayCamera.spimdataLocker', self.spimdataLocker))
         self.controller.registerSpimDataLocker(self.fnspimlock)
-        self.fnspimunlock = orsaycamera.SPIMUNLOCKFUNC(self.spimdataUnlocker)
+        self.fnspimunlock = orsaycamera.SPIMUNLOCKFUNC(
+            instrumentation.timed_callback('OrsayCamera.spimdataUnlocker', self.spimdataUnlocker))
         self.controller.registerSpimDataUnlocker(self.fnspimunlock)
 
-        self.fnspectrumlock = orsaycamera.SPECTLOCKFUNC(self.spectrumdataLocker)
+        self.fnspectrumlock = orsaycamera.SPECTLOCKFUNC(
+            instrumentation.timed_callback('OrsayCamera.spectrumdataLocker', self.spectrumdataLocker))
         self.controller.registerSpectrumDataLocker(self.fnspectrumlock)
-        self.fnspectrumunlock = orsaycamera.SPECTUNLOCKFUNC(self.spectrumdataUnlocker)
+        self.fnspectrumunlock = orsaycamera.SPECTUNLOCKFUNC(
+            instrumentation.timed_callback('OrsayCamera.spectrumdataUnlocker', self.spectrumdataUnlocker))
         self.controller.registerSpectrumDataUnlocker(self.fnspectrumunlock)
+        self.fnspimupdate = orsaycamera.SPIMUPDATEFUNC(
+            instrumentation.timed_callback('OrsayCamera.spimUpdateInfo', self.spimUpdateInfo))
+        self.controller.registerSpimUpdateInfo(self.fnspimupdate)
 
         self.controller.setCurrentPort(0)
 
@@ -576,11 +809,13 @@ class DAQ_2DViewer_OrsayCamera(DAQ_Viewer_base):
 
         # %%%%%%% Set and Get temperature from camera
         self.controller.setTemperature(self.settings['temperature_settings', 'set_point'])
-        temp, locked_status = self.controller.getTemperature()
-        self.settings.child('temperature_settings', 'current_value').setValue(temp)
-        self.settings.child('temperature_settings', 'locked').setValue(locked_status)
-        # set timer to update temperature info from controller
-        self.timer = self.startTimer(2000)  # Timer event fired every 1s
+        self.status_monitor = StatusMonitor.acquire(self.controller,
+                                                    self.settings['temperature_settings', 'status_period'])
+        status = self.status_monitor.poll()
+        self.settings.child('temperature_settings', 'current_value').setValue(status.temperature)
+        self.settings.child('temperature_settings', 'locked').setValue(status.locked)
+        # set timer to update temperature info from the status monitor snapshot
+        self.timer = self.startTimer(2000)  # Timer event fired every 2s
 
         info = 'Orsay Camera initialized'
 
@@ -603,16 +838,27 @@ class DAQ_2DViewer_OrsayCamera(DAQ_Viewer_base):
             *event*           QTimerEvent object   Containing id from timer issuing this event
             =============== ==================== ==============================================
         """
-        temp, locked_status = self.controller.getTemperature()
-        self.settings.child('temperature_settings', 'current_value').setValue(temp)
-        self.settings.child('temperature_settings', 'locked').setValue(locked_status)
+        status = self.status_monitor.status
+        self.settings.child('temperature_settings', 'current_value').setValue(status.temperature)
+        self.settings.child('temperature_settings', 'locked').setValue(status.locked)
 
     def close(self):
         """
 
         """
+        if self.callback_queue is not None:
+            self.callback_queue.stop()
+        self.close_spim_writer()
+        if self.timer is not None:
+            self.killTimer(self.timer)
+            self.timer = None
+        if self.status_monitor is not None:
+            self.status_monitor.release()
+            self.status_monitor = None
         if self.controller is not None:
             self.controller.close()
+        self.buffer_pool.release()
+        self.spimdata = None
 
     def get_xaxis(self) -> Axis:
         """ Obtain the horizontal axis of the image.
@@ -644,10 +890,17 @@ class DAQ_2DViewer_OrsayCamera(DAQ_Viewer_base):
             raise (Exception('Camera not defined'))
         return self.y_axis
 
+    def camera_mode_key(self, mode):
+        return (mode, self.settings['image_size', 'Nx'], self.settings['image_size', 'Ny'],
+                self.settings['camera_mode_settings', 'spim_x'], self.settings['camera_mode_settings', 'spim_y'],
+                self.settings['data_type'], self.Naverage > 1)
+
     def update_camera_mode(self, mode='Camera'):
         sizex = self.settings['image_size', 'Nx']
         sizey = self.settings['image_size', 'Ny']
         image_size = sizex * sizey
+        dtype = np.dtype(self.settings['data_type'])
+        datatype = orsay_data_type(dtype)
 
         if image_size == 1:
             self.data_shape = 'Data0D'
@@ -659,8 +912,11 @@ class DAQ_2DViewer_OrsayCamera(DAQ_Viewer_base):
         if mode == "Camera":
             # %%%%%% Initialize data: self.data for the memory to store new data and self.data_average to store the average data
 
-            self.data = np.zeros((image_size,), dtype=np.float32)
-            self.data_pointer = self.data.ctypes.data_as(ctypes.c_void_p)
+            if self.Naverage > 1:  # frames summed by the camera, as in the Cumul mode of OrsayCameraDevice
+                dtype = np.dtype(np.float32)
+            self.data = self.buffer_pool.get('camera', image_size, dtype)
+            self.geometry = AcquisitionGeometry(sizex, sizey, 1, datatype=orsay_data_type(dtype),
+                                                address=self.data.ctypes.data)
 
         elif mode == "SPIM":
             Ny = self.settings['image_size', 'Ny']
@@ -673,11 +929,18 @@ class DAQ_2DViewer_OrsayCamera(DAQ_Viewer_base):
             SPIMY = self.settings['camera_mode_settings', 'spim_y']
             spimsize = sizex * SPIMY * SPIMX
 
-            self.spimdata = np.zeros((spimsize,), dtype=np.float32)
-            self.pointeurspim = self.spimdata.ctypes.data_as(ctypes.c_void_p)
+            self.spimdata = self.buffer_pool.get('spim', spimsize, dtype, clear=True)
+            if isinstance(self.spimdata, np.memmap):
+                self.emit_status(ThreadCommand('Update_Status',
+                                               [f'SPIM buffer memory mapped on {self.spimdata.filename}', 'log']))
+            self.spim_geometry = AcquisitionGeometry(SPIMX, SPIMY, sizex, datatype=datatype,
+                                                     address=self.spimdata.ctypes.data)
 
-            self.spectrumdata = np.zeros((sizex,), dtype=np.float32)
-            self.pointeurspectrum = self.spectrumdata.ctypes.data_as(ctypes.c_void_p)
+            self.spectrumdata = self.buffer_pool.get('spectrum', sizex, dtype, clear=True)
+            self.spectrum_geometry = AcquisitionGeometry(sizex, datatype=datatype,
+                                                         address=self.spectrumdata.ctypes.data)
+            self.spim_map = self.buffer_pool.get('spim_map', (SPIMY, SPIMX), np.float32, clear=True)
+            self.update_energy_maps()
 
             # init the viewers
             data = DataToExport('OrsaySPIM', data=
@@ -689,10 +952,15 @@ class DAQ_2DViewer_OrsayCamera(DAQ_Viewer_base):
                              dim='DataND'),
              DataFromPlugins(name='Spectrum',
                              data=[self.spectrumdata],
-                             dim='Data1D')
-             ])
+                             dim='Data1D'),
+             DataFromPlugins(name='SPIM map',
+                             data=[self.spim_map],
+                             dim='Data2D')
+             ] + self.energy_map_data())
             self.dte_signal_temp.emit(data)
 
+        self._camera_mode_key = self.camera_mode_key(mode)
+
     def grab_data(self, Naverage=1, **kwargs):
         """
             Start new acquisition in two steps :
@@ -714,18 +982,34 @@ class DAQ_2DViewer_OrsayCamera(DAQ_Viewer_base):
             self.spim_done = False
 
             self.ind_grabbed = 0  # to keep track of the current image in the average
-            self.Naverage = Naverage  # no need averaging is done software wise by DAQ_Viewer_Detector
-
-            self.update_camera_mode(self.settings['camera_mode_settings', 'camera_mode'])
+            self.callback_queue.clear()
+            self.callback_queue.reset_counters()
+            self.Naverage = Naverage  # summed by the camera, see hardware_averaging
+            self.accumulated = 0
+            self.frame_counter.reset()
+            self.frame_stamp = None
+
+            mode = self.settings['camera_mode_settings', 'camera_mode']
+            if self._camera_mode_key != self.camera_mode_key(mode):
+                self.update_camera_mode(mode)
+            elif mode == 'SPIM':
+                self.spimdata.fill(0)  # same buffers as the last grab, only clear the previous SPIM
+                self.spim_map.fill(0)
+                if self.energy_maps is not None:
+                    self.energy_maps.clear()
 
             if self.settings['camera_mode_settings', 'camera_mode'] == 'Camera':
                 self.controller.setAccumulationNumber(
-                    Naverage)  # stop the acquisition after Navergae image if third argument of startfocus is 1
+                    Naverage)  # stop the acquisition after Naverage images summed as third argument of startfocus is 1
                 self.controller.startFocus(self.settings['exposure'], "2d", 1)
 
             else:  # spim mode
                 SPIMX = self.settings['camera_mode_settings', 'spim_x']
                 SPIMY = self.settings['camera_mode_settings', 'spim_y']
+                self.start_spim_writer(SPIMX, SPIMY)
+                self.spim_current = 0
+                self._spim_map_done = 0
+                self._spim_start = time.perf_counter()
                 self.controller.startSpim(SPIMX * SPIMY, 1, self.settings['exposure'], False)
                 self.controller.resumeSpim(4)  # stop eof
 
@@ -743,6 +1027,7 @@ class DAQ_2DViewer_OrsayCamera(DAQ_Viewer_base):
                 self.controller.stopFocus()
             else:  # spim mode
                 self.controller.stopSpim(True)
+                self.close_spim_writer()
         except:
             pass
         return ""
@@ -1,6 +1,3 @@
-import ctypes
-
-
 import numpy as np
 from qtpy import QtWidgets
 from qtpy.QtCore import QThread, Slot, QRectF
@@ -13,6 +10,12 @@ from pymodaq.utils.parameter import utils as putils
 
 from pymodaq_plugins_orsay.hardware.STEM import orsayscan
 from pymodaq_plugins_orsay.hardware.STEM.orsayscan_position import OrsayScanPosition
+from pymodaq_plugins_orsay.hardware.STEM.frame_ring import FrameRing
+from pymodaq_plugins_orsay.hardware.STEM.callback_queue import CallbackQueue
+from pymodaq_plugins_orsay.hardware.STEM.acquisition_geometry import AcquisitionGeometry
+from pymodaq_plugins_orsay.hardware.STEM.frame_counter import FrameCounter, FrameStamp
+from pymodaq_plugins_orsay.hardware.STEM.instrumentation import (instrumentation, instrumentation_params,
+                                                                  commit_instrumentation_settings)
 
 try:
     from pymodaq_plugins_orsay.daq_viewer_plugins.plugins_2D.daq_2Dviewer_OrsayCamera import DAQ_2DViewer_OrsayCamera
@@ -36,6 +39,8 @@ class DAQ_2DViewer_OrsaySTEM(DAQ_Viewer_base):
     is_Orsay_camera = is_Orsay_camera
 
     hardware_averaging = False
+    # hyperspectroscopy parameters the camera reads from its own settings tree, copied there when committed
+    camera_tree_parameters = ('stream_spim', 'stream_folder', 'data_type', 'energy_windows')
     params = comon_parameters + [
         {'title': 'Do HyperSpectroscopy:', 'name': 'do_hyperspectroscopy', 'type': 'bool', 'value': False},
         {'title': 'HyperSpectroscopy:', 'name': 'hyperspectroscopy', 'visible': False, 'type': 'group', 'children':
@@ -73,6 +78,13 @@ class DAQ_2DViewer_OrsaySTEM(DAQ_Viewer_base):
                  'readonly': True},
                 {'title': 'Scan mode:', 'name': 'scan_mode', 'type': 'list', 'value': 'Normal',
                  'limits': ['Normal', 'Random', 'Ebm']},
+                {'title': 'Frame buffers:', 'name': 'frame_buffers', 'type': 'int', 'min': 2, 'value': 3,
+                 'tip': 'Number of preallocated frames the scan cycles through, a completed frame is not overwritten'
+                        ' before the next ones have been acquired'},
+                {'title': 'Emitted data type:', 'name': 'emit_dtype', 'type': 'list', 'value': 'native',
+                 'limits': ['native', 'float32', 'float64'],
+                 'tip': 'native emits the acquisition buffers (int16) without conversion: views of the frame ring, '
+                        'a copy for the final frame. float32 and float64 convert them'},
             ]},
             {'title': 'Mag. Rot.:', 'name': 'mag_rot', 'type': 'group', 'children': [
                 {'title': 'Field:', 'name': 'field', 'type': 'slide', 'value': 1e-7, 'limits': [1e-7, 1],
@@ -90,8 +102,16 @@ class DAQ_2DViewer_OrsaySTEM(DAQ_Viewer_base):
                 {'title': 'Capture Time (µs):', 'name': 'pixel_time_capture', 'type': 'slide', 'value': 10,
                  'subtype': 'log', 'limits': [1, 1e6]},
             ]},
+            {'title': 'Display:', 'name': 'display', 'type': 'group', 'children': [
+                {'title': 'Display rate (Hz):', 'name': 'display_rate', 'type': 'float', 'value': 20., 'min': 0.,
+                 'tip': 'Maximum rate of the intermediate frames emission (0 for no limit)'},
+                {'title': 'Coalesced frames:', 'name': 'coalesced', 'type': 'int', 'value': 0, 'readonly': True},
+                {'title': 'Dropped frames:', 'name': 'dropped', 'type': 'int', 'value': 0, 'readonly': True},
+                {'title': 'Late after (ms):', 'name': 'late_delay', 'type': 'float', 'value': 500., 'min': 0.,
+                 'tip': 'Frames emitted later than this after their acquisition are counted as late'},
+            ]},
         ]},
-    ]
+    ] + instrumentation_params
 
     def __init__(self, parent=None, params_state=None):
 
@@ -110,6 +130,7 @@ class DAQ_2DViewer_OrsaySTEM(DAQ_Viewer_base):
         self.data_stem_ready = False
         self.data_spectrum_ready = False
         self.stem_scan_finished = False
+        self.final_queued = False  # set by queue_frame when the complete frame of a capture is queued
         self.max_field = 1
         self.x_axis = None
         self.y_axis = None
@@ -118,15 +139,22 @@ class DAQ_2DViewer_OrsaySTEM(DAQ_Viewer_base):
         self.data_stem = None
         self.SIZEX, self.SIZEY = (None, None)
         self.SIZE_SPIMX, self.SIZE_SPIMY = (None, None)
-        self.data_stem_pointer = None
         self.inputs = []
 
-        self.data_stem = None  # buffer for HADF type of data typically shape (2*32*32) (2 for 2 inputs)
+        self.frame_ring: FrameRing = None  # preallocated buffers given to the scan, see init_data
+        self.geometry: AcquisitionGeometry = None  # read by the lockers, rebuilt with the frame ring
+        self.data_stem = None  # ring slot of the last scanned data typically shape (2*32*32) (2 for 2 inputs)
+        self.data_stem_slot = 0  # index of data_stem in the frame ring
+        self._converted_stem: np.ndarray = None  # float copies of the ring slots, updated band by band
 
         self.data_stem_current: np.ndarray = None  # local buffer to be dislpayed from time to time.typically shape (2,32,32)
         self.data_stem_STEM_as_reference: DataFromPlugins = None  # used to keep data on screen while doing hyperspectroscopy
-        self.data_stem_pointer = None  # pointer to the data array
         self.data_spectrum_spim: DataToExport = None  # data received from the camera object
+        self.callback_queue: CallbackQueue = None  # items put by the unlockers, processed by process_frame
+        self._stale_slots = set()  # ring slots whose updated rows have been lost by the queue
+        self._dropped_seen = 0
+        self.frame_counter = FrameCounter(self.settings['stem_settings', 'display', 'late_delay'] / 1000)
+        self.frame_stamp: FrameStamp = None  # stamp of the frame being emitted
 
     def ROISelect(self, pos_size: QRectF):
         self.settings.child('roi_group', 'x0').setValue(int(pos_size.x()))
@@ -189,7 +217,7 @@ class DAQ_2DViewer_OrsaySTEM(DAQ_Viewer_base):
                 self.stem_scan.SetInputs([self.inputs.index(input1), self.inputs.index(input2)])
                 self.spim_scan.SetInputs([self.inputs.index(input1), self.inputs.index(input2)])
 
-            elif param.name() == 'Nx' or param.name() == 'Ny':
+            elif param.name() == 'Nx' or param.name() == 'Ny' or param.name() == 'frame_buffers':
                 self.init_data(self.settings['stem_settings', 'pixels_settings', 'Nx'],
                                self.settings['stem_settings', 'pixels_settings', 'Ny'])
                 Nx = self.settings['stem_settings', 'pixels_settings', 'Nx']
@@ -197,6 +225,11 @@ class DAQ_2DViewer_OrsaySTEM(DAQ_Viewer_base):
                 self.settings.child('stem_settings', 'spot_settings', 'spot_x').setOpts(bounds=(0, Nx - 1))
                 self.settings.child('stem_settings', 'spot_settings', 'spot_y').setOpts(bounds=(0, Ny - 1))
 
+            elif param.name() == 'display_rate':
+                self.callback_queue.display_rate = param.value()
+            elif param.name() == 'late_delay':
+                self.frame_counter.late_delay = param.value() / 1000
+
             elif param.name() in putils.iter_children(self.settings.child('stem_settings', 'times'), []):
                 self.stem_scan.pixelTime = param.value() / 1e6
 
@@ -208,7 +241,7 @@ class DAQ_2DViewer_OrsaySTEM(DAQ_Viewer_base):
 
             elif param.name() == 'do_hyperspectroscopy':
                 if param.value():
-                    data_stem_STEM_as_reference = self.data_stem.reshape((2, self.SIZEX, self.SIZEY)).astype(np.float64)
+                    data_stem_STEM_as_reference = self.data_stem.reshape((2, self.SIZEY, self.SIZEX)).astype(np.float64)
                     self.data_stem_STEM_as_reference = DataToExport('stem', data=[
                         DataFromPlugins(name=self.settings['stem_settings', 'inputs', 'input1'],
                                         data=[data_stem_STEM_as_reference[0]], dim='Data2D'),
@@ -240,22 +273,39 @@ class DAQ_2DViewer_OrsaySTEM(DAQ_Viewer_base):
                             # remove viewers related to camera
                             self.dte_signal_temp(DataToExport('stem', data=[]))
 
+            elif param.name().startswith('instrumentation_'):
+                commit_instrumentation_settings(param)
             elif param.name() in putils.iter_children(self.settings.child('hyperspectroscopy'),
                                                       []):  # parameters related to camera
                 if self.camera is not None:
-                    self.camera.commit_settings(param)
+                    self.commit_camera_settings(param)
 
 
         except Exception as e:
             self.emit_status(ThreadCommand('Update_Status', [getLineInfo() + str(e), 'log']))
 
+    def commit_camera_settings(self, param):
+        """ Commit a parameter of the hyperspectroscopy group to the camera
+
+        The camera has its own settings tree, built from the group at init. The parameters it reads from that tree
+        (camera_tree_parameters) are copied there and committed from there.
+        """
+        if param.name() in self.camera_tree_parameters:
+            camera_param = self.camera.settings.child(*self.settings.child('hyperspectroscopy').childPath(param))
+            camera_param.setValue(param.value())
+            param = camera_param
+        self.camera.commit_settings(param)
+
     def update_live(self, live=False):
-        if live:
-            self.stem_scan.registerUnlockerA(self.fnunlockA_live)
-            self.stem_scan.pixelTime = self.settings['stem_settings', 'times', 'pixel_time_live'] / 1e6
-        else:
-            self.stem_scan.registerUnlockerA(self.fnunlockA)
-            self.stem_scan.pixelTime = self.settings['stem_settings', 'times', 'pixel_time_capture'] / 1e6
+        with self.stem_scan.batch() as batch:
+            if live:
+                batch.submit(self.stem_scan.registerUnlockerA, self.fnunlockA_live)
+                batch.submit(setattr, self.stem_scan, 'pixelTime',
+                             self.settings['stem_settings', 'times', 'pixel_time_live'] / 1e6)
+            else:
+                batch.submit(self.stem_scan.registerUnlockerA, self.fnunlockA)
+                batch.submit(setattr, self.stem_scan, 'pixelTime',
+                             self.settings['stem_settings', 'times', 'pixel_time_capture'] / 1e6)
 
     def dataLocker(self, gene, datatype, sx, sy, sz):
         """
@@ -271,11 +321,7 @@ class DAQ_2DViewer_OrsaySTEM(DAQ_Viewer_base):
             11  float 32 bit
             12  double 64 bit
         """
-        sx[0] = self.settings['stem_settings', 'pixels_settings', 'Nx']
-        sy[0] = self.settings['stem_settings', 'pixels_settings', 'Ny']
-        sz[0] = 2  # 2 inputs
-        datatype[0] = 2
-        return self.data_stem_pointer.value
+        return self.geometry.fill_locker(datatype, sx, sy, sz)
 
     def spim_dataLocker(self, gene, datatype, sx, sy, sz):
         """
@@ -291,11 +337,7 @@ class DAQ_2DViewer_OrsaySTEM(DAQ_Viewer_base):
             11  float 32 bit
             12  double 64 bit
         """
-        sx[0] = self.settings['stem_settings', 'pixels_settings', 'Nx']
-        sy[0] = self.settings['stem_settings', 'pixels_settings', 'Ny']
-        sz[0] = 2  # 2 inputs
-        datatype[0] = 2
-        return self.data_stem_pointer.value
+        return self.geometry.fill_locker(datatype, sx, sy, sz)
 
     def dataUnlocker(self, gene, newdata):
         """
@@ -309,39 +351,79 @@ class DAQ_2DViewer_OrsaySTEM(DAQ_Viewer_base):
         """
         Le tableau peut être utilisé
         """
-        Nscan = imagenb
-        ##self.emit_data_live()
-        if newdata and Nscan != self.curr_scan:
-            print('Nscan:{:}'.format(Nscan))
-            self.curr_scan = Nscan
-            self.stem_scan_finished = True
-            self.stem_done()
-        else:
-            print('emit temp')
-            self.stem_done()
+        self.queue_frame(newdata, imagenb, rect, live=False)
 
     def spim_dataUnlockerA(self, gene, newdata, imagenb, rect):
         """
         Le tableau peut être utilisé
         """
-        Nscan = imagenb
-        ##self.emit_data_live()
-        if newdata and Nscan != self.curr_scan:
-            print('Nscan:{:}'.format(Nscan))
-            self.curr_scan = Nscan
-            self.stem_scan_finished = True
-            self.stem_done()
-        else:
-            print('emit temp')
-            self.stem_done()
+        self.queue_frame(newdata, imagenb, rect, live=False)
 
     def dataUnlockerA_live(self, gene, newdata, imagenb, rect):
         """
         Le tableau peut être utilisé
         """
-        Nscan = imagenb
+        self.queue_frame(newdata, imagenb, rect, live=True)
 
-        self.emit_data_live()
+    def queue_frame(self, newdata, imagenb, rect, live=False):
+        """ Called from the unlockers (dll thread): publish completed frames and let the callback queue process them
+
+        The items are (ring slot, (first, last + 1) updated lines, live, frame completed, FrameStamp). A capture emits
+        its first completed frame only: the frames acquired until emit_data stops the scan are ignored.
+        """
+        if self.final_queued and not live:
+            return
+        rows = (rect[1], rect[1] + rect[3])
+        if newdata and imagenb != self.curr_scan:
+            self.curr_scan = imagenb
+            stamp = self.frame_counter.record(imagenb)
+            slot = self.frame_ring.publish()
+            if live:
+                self.callback_queue.put((slot, rows, True, True, stamp))
+            else:
+                self.final_queued = True
+                self.frame_ring.hold(slot)
+                self.callback_queue.put((slot, rows, False, True, stamp), final=True)
+        else:
+            self.callback_queue.put((self.frame_ring.filling, rows, live, False, self.frame_counter.partial()))
+
+    def merge_frames(self, pending, item):
+        """ Merge two intermediate items of the callback queue """
+        if pending[0] != item[0]:
+            self._stale_slots.add(pending[0])
+            return item
+        rows = (min(pending[1][0], item[1][0]), max(pending[1][1], item[1][1]))
+        return item[0], rows, item[2], pending[3] or item[3], item[4]
+
+    def process_frame(self, item):
+        """ Called by the callback queue thread with the items put by queue_frame """
+        slot, rows, live, finished, stamp = item
+        self.frame_stamp = stamp  # also reset by grab_data from the main thread, see frame_counter.emitted below
+        if self.callback_queue.dropped != self._dropped_seen:
+            self._dropped_seen = self.callback_queue.dropped
+            self._stale_slots.update(range(self.frame_ring.nslots))
+        if slot in self._stale_slots:
+            self._stale_slots.discard(slot)
+            rows = None
+        else:
+            rows = slice(*rows)
+        self.set_data_stem(slot)
+        if live:
+            self.emit_data_live(rows)
+            if finished:
+                self.frame_counter.emitted(stamp)
+        else:
+            if finished:
+                self.stem_scan_finished = True
+            self.stem_done(rows)
+            if finished:
+                self.frame_counter.emitted(stamp)
+                self.frame_ring.release(slot)
+                self.update_queue_counters()
+
+    def update_queue_counters(self):
+        self.settings.child('stem_settings', 'display', 'coalesced').setValue(self.callback_queue.coalesced)
+        self.settings.child('stem_settings', 'display', 'dropped').setValue(self.callback_queue.dropped)
 
     def spim_done(self, data_spectrum_spim: DataToExport):
         self.data_spectrum_spim_ready = True
@@ -353,35 +435,83 @@ class DAQ_2DViewer_OrsaySTEM(DAQ_Viewer_base):
         self.data_spectrum_spim = data_spectrum_spim
         # self.emit_data()
 
-    def stem_done(self):
+    def set_data_stem(self, slot: int):
+        self.data_stem_slot = slot
+        self.data_stem = self.frame_ring.buffers[slot]
+
+    def stem_done(self, rows: slice = None):
+        """ Process the scanned data, rows is the band of lines updated by the last callback (None for all) """
         self.data_stem_ready = True
-        self.data_stem_current = self.data_stem.reshape((2, self.SIZEX,
-                                                         self.SIZEY)).astype(float)
+        self.data_stem_current = self.convert_stem(self.data_stem.reshape((2, self.SIZEY, self.SIZEX)), rows)
         self.emit_data()
 
+    def convert_stem(self, data_stem: np.ndarray, rows: slice = None) -> np.ndarray:
+        """ Get the scanned data with the type selected in the emit_dtype setting
+
+        native returns data_stem itself (a view of the frame ring). float32 and float64 return the converted copy
+        of the ring slot, only the given rows being converted (all of them if rows is None).
+        """
+        dtype = self.settings['stem_settings', 'pixels_settings', 'emit_dtype']
+        if dtype == 'native':
+            return data_stem
+        if self._converted_stem is None or self._converted_stem.dtype != dtype or \
+                self._converted_stem.shape[1:] != data_stem.shape:
+            self._converted_stem = np.zeros((self.frame_ring.nslots,) + data_stem.shape, dtype=dtype)
+            rows = None
+        converted = self._converted_stem[self.data_stem_slot]
+        if rows is None:
+            rows = slice(None)
+        converted[:, rows] = data_stem[:, rows]
+        return converted
+
+    def get_data_from_plugins(self, name: str, data: np.ndarray, final=False) -> DataFromPlugins:
+        """ Get a new Data2D DataFromPlugins holding data
+
+        The intermediate frames hold the buffers themselves (views of the ring slots or of their converted copies),
+        overwritten by the next frames. The final frame, kept by DAQ_Viewer, holds a copy.
+        """
+        dwa = DataFromPlugins(name=name, data=[data.copy() if final else data], dim='Data2D')
+        stamp = self.frame_stamp
+        if stamp is not None:
+            dwa.add_extra_attribute(sequence=stamp.sequence, acquisition_time=stamp.timestamp)
+        return dwa
+
+    def get_frames_data(self) -> DataFromPlugins:
+        """ Data0D of the frame accounting: frames received, skipped by the hardware numbering, emitted late and
+        dropped by the callback queue """
+        return DataFromPlugins(name='Frames', data=[np.array([self.frame_counter.sequence]),
+                                                    np.array([self.frame_counter.skipped]),
+                                                    np.array([self.frame_counter.late]),
+                                                    np.array([self.callback_queue.dropped])],
+                               labels=['frames', 'skipped', 'late', 'dropped'], dim='Data0D')
+
     def emit_data(self):
         # data_stem = self.data_stem.reshape((2, self.SIZEX,
         #                                     self.SIZEY)).astype(float)
 
         if not self.settings['do_hyperspectroscopy']:
+            final = self.stem_scan_finished
             data_stem = [
-                DataFromPlugins(name=self.settings['stem_settings', 'inputs', 'input1'],
-                                data=[self.data_stem_current[0]], dim='Data2D'),
-                DataFromPlugins(name=self.settings['stem_settings', 'inputs', 'input2'],
-                                data=[self.data_stem_current[1]], dim='Data2D'), ]
+                self.get_data_from_plugins(self.settings['stem_settings', 'inputs', 'input1'],
+                                           self.data_stem_current[0], final),
+                self.get_data_from_plugins(self.settings['stem_settings', 'inputs', 'input2'],
+                                           self.data_stem_current[1], final),
+                self.get_frames_data()]
             if self.data_stem_ready:
-                if self.stem_scan_finished:
+                if final:
                     self.data_grabed_signal.emit(data_stem)
                     self.stem_scan.stopImaging(True)
                 else:
                     self.data_grabed_signal_temp.emit(data_stem)
         else:
+            final = self.data_spectrum_spim_ready and self.stem_scan_finished  # all data have been taken
             data_stem = [
-                DataFromPlugins(name='SPIM ' + self.settings['stem_settings', 'inputs', 'input1'],
-                                data=[self.data_stem_current[0]], dim='Data2D'),
-                DataFromPlugins(name='SPIM ' + self.settings['stem_settings', 'inputs', 'input2'],
-                                data=[self.data_stem_current[1]], dim='Data2D'), ]
-            if self.data_spectrum_spim_ready and self.stem_scan_finished:  # all data have been taken
+                self.get_data_from_plugins('SPIM ' + self.settings['stem_settings', 'inputs', 'input1'],
+                                           self.data_stem_current[0], final),
+                self.get_data_from_plugins('SPIM ' + self.settings['stem_settings', 'inputs', 'input2'],
+                                           self.data_stem_current[1], final),
+                self.get_frames_data()]
+            if final:
                 self.spim_scan.stopImaging(True)
                 self.data_grabed_signal.emit(self.data_stem_STEM_as_reference + data_stem + self.data_spectrum_spim)
 
@@ -390,8 +520,7 @@ class DAQ_2DViewer_OrsaySTEM(DAQ_Viewer_base):
                     self.data_stem_STEM_as_reference + data_stem + self.data_spectrum_spim)
 
     def emit_data_init(self):
-        data_stem = self.data_stem.reshape((2, self.SIZEX,
-                                            self.SIZEY)).astype(float)
+        data_stem = self.convert_stem(self.data_stem.reshape((2, self.SIZEY, self.SIZEX)))
         if not self.settings['do_hyperspectroscopy']:
             data_stem = DataToExport('stem', data=[
                 DataFromPlugins(name=self.settings['stem_settings', 'inputs', 'input1'],
@@ -423,19 +552,18 @@ class DAQ_2DViewer_OrsaySTEM(DAQ_Viewer_base):
             dte.append(self.data_spectrum_spim)
             self.dte_signal_temp.emit(dte)
 
-    def emit_data_live(self):
+    def emit_data_live(self, rows: slice = None):
         """
-        temporary datas emitter when acquisition is running
+        temporary datas emitter when acquisition is running, rows is the band of lines updated (None for all)
         """
-        data_stem = self.data_stem.reshape((2, self.settings['stem_settings', 'pixels_settings', 'Ny'],
-                                            self.settings['stem_settings', 'pixels_settings',
-                                            'Nx'])).astype(float)
+        data_stem = self.convert_stem(self.data_stem.reshape((2, self.settings['stem_settings', 'pixels_settings', 'Ny'],
+                                                              self.settings['stem_settings', 'pixels_settings', 'Nx'])),
+                                      rows)
         # print('livedata')
-        self.data_grabed_signal_temp.emit([DataFromPlugins(
-            name=self.settings['stem_settings', 'inputs', 'input1'], data=[data_stem[0]], dim='Data2D'),
-            DataFromPlugins(
-                name=self.settings['stem_settings', 'inputs', 'input2'],
-                data=[data_stem[1]], dim='Data2D')]
+        self.data_grabed_signal_temp.emit([
+            self.get_data_from_plugins(self.settings['stem_settings', 'inputs', 'input1'], data_stem[0]),
+            self.get_data_from_plugins(self.settings['stem_settings', 'inputs', 'input2'], data_stem[1]),
+            self.get_frames_data()]
         )
 
     def list_inputs(self, scan):
@@ -448,6 +576,7 @@ class DAQ_2DViewer_OrsaySTEM(DAQ_Viewer_base):
             k += 1
         self.settings.child('stem_settings', 'inputs', 'input1').setOpts(limits=self.inputs)
         self.settings.child('stem_settings', 'inputs', 'input2').setOpts(limits=self.inputs)
+        self.settings.child('stem_settings', 'inputs', 'input2').setValue(self.inputs[0])
         if 'BF' in self.inputs:
             self.settings.child('stem_settings', 'inputs', 'input1').setValue('BF')
 
@@ -474,19 +603,23 @@ class DAQ_2DViewer_OrsaySTEM(DAQ_Viewer_base):
             self.SIZEY = Ny
             self.spim_scan.setImageArea(Nx, Ny, startx, endx, starty, endy)
 
-        self.data_spectrum_spim = [DataFromPlugins(name='SPIM ',
-                                                   data=[np.zeros((
-                                                       self.settings['hyperspectroscopy', 'image_size', 'Nx'],
-                                                       self.settings['hyperspectroscopy', 'camera_mode_settings', 'spim_y'],
-                                                       self.settings['hyperspectroscopy', 'camera_mode_settings', 'spim_x']))],
-                                                   dim='DataND', nav_indexes=(1, 2)),
-                                   DataFromPlugins(name='Spectrum', data=[np.zeros((
-                                       self.settings['hyperspectroscopy', 'image_size', 'Nx'],))],
-                                                   dim='Data1D')]
-
-        self.data_stem = np.zeros((2 * Nx * Ny), dtype=np.int16)
-        self.data_stem_current = np.zeros((2, Nx, Ny), dtype=np.int16)
-        self.data_stem_pointer = self.data_stem.ctypes.data_as(ctypes.c_void_p)
+        if self.is_Orsay_camera:
+            self.data_spectrum_spim = [DataFromPlugins(name='SPIM ',
+                                                       data=[np.zeros((
+                                                           self.settings['hyperspectroscopy', 'image_size', 'Nx'],
+                                                           self.settings['hyperspectroscopy', 'camera_mode_settings', 'spim_y'],
+                                                           self.settings['hyperspectroscopy', 'camera_mode_settings', 'spim_x']))],
+                                                       dim='DataND', nav_indexes=(1, 2)),
+                                       DataFromPlugins(name='Spectrum', data=[np.zeros((
+                                           self.settings['hyperspectroscopy', 'image_size', 'Nx'],))],
+                                                       dim='Data1D')]
+
+        self.frame_ring = FrameRing(self.settings['stem_settings', 'pixels_settings', 'frame_buffers'],
+                                    (2 * Nx * Ny,), dtype=np.int16)
+        self.geometry = AcquisitionGeometry(Nx, Ny, 2, datatype=2, ring=self.frame_ring)  # 2 inputs
+        self.set_data_stem(self.frame_ring.filling)
+        self._converted_stem = None
+        self.data_stem_current = np.zeros((2, Ny, Nx), dtype=np.int16)
 
     def ini_detector(self, controller=None):
         """
@@ -538,7 +671,7 @@ class DAQ_2DViewer_OrsaySTEM(DAQ_Viewer_base):
             else:
                 self.stem_scan = controller
         else:
-            self.stem_scan = OrsayScanPosition(1, 0)  # to be used to scan STEM only
+            self.stem_scan = OrsayScanPosition(1, 0, shared=True)  # to be used to scan STEM only
 
         self.spim_scan = OrsayScanPosition(2,
                                            self.stem_scan.orsayscan)  # to be used when performing hyperspectroscopy SPIM
@@ -552,31 +685,40 @@ class DAQ_2DViewer_OrsaySTEM(DAQ_Viewer_base):
         self.spim_scan.SetInputs([self.inputs.index(input1), self.inputs.index(input2)])
 
         # %%%%%%% Register callback to get data from camera
-        self.fnlock = orsayscan.LOCKERFUNC(self.dataLocker)
+        self.callback_queue = CallbackQueue(self.process_frame, self.merge_frames,
+                                            display_rate=self.settings['stem_settings', 'display', 'display_rate'],
+                                            name='OrsaySTEMCallbackQueue')
+        self.callback_queue.start()
+        self.fnlock = orsayscan.LOCKERFUNC(instrumentation.timed_callback('OrsaySTEM.dataLocker', self.dataLocker))
         self.stem_scan.registerLocker(self.fnlock)
 
-        self.SPIM_fnlock = orsayscan.LOCKERFUNC(self.spim_dataLocker)
+        self.SPIM_fnlock = orsayscan.LOCKERFUNC(
+            instrumentation.timed_callback('OrsaySTEM.spim_dataLocker', self.spim_dataLocker))
         self.spim_scan.registerLocker(self.SPIM_fnlock)
 
-        self.fnunlockA = orsayscan.UNLOCKERFUNCA(self.dataUnlockerA)
-        self.fnunlockA_live = orsayscan.UNLOCKERFUNCA(self.dataUnlockerA_live)
-        self.SPIM_funlockA = orsayscan.UNLOCKERFUNCA(self.spim_dataUnlockerA)
+        self.fnunlockA = orsayscan.UNLOCKERFUNCA(
+            instrumentation.timed_callback('OrsaySTEM.dataUnlockerA', self.dataUnlockerA))
+        self.fnunlockA_live = orsayscan.UNLOCKERFUNCA(
+            instrumentation.timed_callback('OrsaySTEM.dataUnlockerA_live', self.dataUnlockerA_live))
+        self.SPIM_funlockA = orsayscan.UNLOCKERFUNCA(
+            instrumentation.timed_callback('OrsaySTEM.spim_dataUnlockerA', self.spim_dataUnlockerA))
 
         self.stem_scan.registerUnlockerA(self.fnunlockA)
         self.spim_scan.registerUnlockerA(self.SPIM_funlockA)
 
-        # %%%%%%%%%% set initial scan image size
+        # %%%%%%%%%% set initial scan image size, pixel time and rotation in a single job of the scan executor
         Nx = self.settings['stem_settings', 'pixels_settings', 'Nx']
         Ny = self.settings['stem_settings', 'pixels_settings', 'Ny']
-        self.stem_scan.setImageSize(Nx, Ny)
+        with self.stem_scan.batch() as batch:
+            batch.submit(self.stem_scan.setImageSize, Nx, Ny)
+            batch.submit(setattr, self.stem_scan, 'pixelTime',
+                         self.settings['stem_settings', 'times', 'pixel_time_live'] / 1e6)
+            batch.submit(self.stem_scan.setScanRotation, self.settings['stem_settings', 'mag_rot', 'angle'])
         self.init_data(Nx, Ny)
 
         # init the viewers
         self.emit_data_init()
 
-        # %%%%%%%%%%% set pixel time
-        self.stem_scan.pixelTime = self.settings['stem_settings', 'times', 'pixel_time_live'] / 1e6
-        self.stem_scan.setScanRotation(self.settings['stem_settings', 'mag_rot', 'angle'])
         self.get_set_field()
 
         # %%%%%%% init axes from image
@@ -600,9 +742,11 @@ class DAQ_2DViewer_OrsaySTEM(DAQ_Viewer_base):
         """
 
         """
+        if self.callback_queue is not None:
+            self.callback_queue.stop()
         if self.spim_scan is not None:
             self.spim_scan.close()
-        if self.stem_scan is not None:
+        if self.stem_scan is not None and self.settings['controller_status'] != "Slave":  # else the master's one
             self.stem_scan.close()
 
     def get_xaxis(self):
@@ -664,6 +808,12 @@ class DAQ_2DViewer_OrsaySTEM(DAQ_Viewer_base):
             self.stem_scan_finished = False
 
             self.curr_scan = 0
+            self.final_queued = False
+            self.callback_queue.clear()
+            self.callback_queue.reset_counters()
+            self._dropped_seen = 0
+            self.frame_counter.reset()
+            self.frame_ring.reset()
 
             # %%%%% Start acquisition
             time_sleep = self.stem_scan.GetImageTime()
@@ -689,13 +839,14 @@ class DAQ_2DViewer_OrsaySTEM(DAQ_Viewer_base):
                     height = self.settings['roi_group', 'height']
                     endx = startx + width
                     endy = starty + height
-                    self.stem_scan.setImageArea(width, height, startx, endx, starty, endy)
                 else:
                     width = self.settings['stem_settings', 'pixels_settings', 'Nx']
                     height = self.settings['stem_settings', 'pixels_settings', 'Ny']
-                    self.stem_scan.setImageArea(width, height, 0, width, 0, height)
-                self.stem_scan.startImaging(mode, self.settings['stem_settings', 'pixels_settings',
-                'line_averaging'])
+                    startx, endx, starty, endy = 0, width, 0, height
+                with self.stem_scan.batch() as batch:
+                    batch.submit(self.stem_scan.setImageArea, width, height, startx, endx, starty, endy)
+                    batch.submit(self.stem_scan.startImaging, mode,
+                                 self.settings['stem_settings', 'pixels_settings', 'line_averaging'])
 
             # self.stem_scan.stopImaging(False) #will stop the acquisition when the image is done
 
@@ -710,6 +861,7 @@ class DAQ_2DViewer_OrsaySTEM(DAQ_Viewer_base):
         """
         try:
             self.stem_scan.stopImaging(True)
+            self.update_queue_counters()
             self.spim_scan.s
             if self.settings['do_hyperspectroscopy']:
                 self.camera.stop()
@@ -11,6 +11,8 @@ import traceback
 
 # third party libraries
 from . import orsaycamera
+from .buffers import allocate_buffer, release_buffer
+from .status_monitor import StatusMonitor
 
 # local libraries
 from nion.data import Calibration
@@ -38,6 +40,8 @@ class CameraDevice(camera_base.Camera):
     def __init__(self, manufacturer, model, sn, simul):
         self.__config_dialog_handler = None
         self.camera = orsaycamera.orsayCamera(manufacturer, model, sn, simul)
+        # temperature and acquisition status read by the callbacks, polled in a background thread
+        self.status_monitor = StatusMonitor.acquire(self.camera)
         self.__sensor_dimensions = self.camera.getCCDSize()
         self.__readout_area = 0, 0, *self.__sensor_dimensions
         self.__orsay_binning = self.camera.getBinning()
@@ -129,6 +133,7 @@ class CameraDevice(camera_base.Camera):
 
     def close(self):
         self.camera.stopSpim(True)
+        self.status_monitor.release()
         #self.camera.close()
 
     def create_frame_parameters(self, d: dict) -> dict:
@@ -240,16 +245,16 @@ class CameraDevice(camera_base.Camera):
         return self.imagedata_ptr.value
 
     def __data_unlocker(self, gene, new_data):
-        self.__frame_number += 1
+        self.__frame_number += 1  # counted here, the status snapshot can be one polling period old
         if new_data:
             t = time.time()
             if t - self._last_time > 0.1:
                 self.has_data_event.set()
                 self._last_time = t
-        status = self.camera.getCCDStatus()
-        if status["mode"] == "Cumul":
-            self.__frame_number = status["accumulation_count"]
-        if status["mode"] == "idle":
+        if self.current_camera_settings.acquisition_mode == "Cumul" and \
+                self.__frame_number >= self.current_camera_settings.spectra_count:
+            self.status_monitor.refresh()  # the camera stops after the last accumulation
+        if self.status_monitor.status.mode == "idle":
             hardware_source = HardwareSource.HardwareSourceManager().get_hardware_source_for_hardware_source_id(
                 self.camera_id)
             hardware_source.stop_playing()
@@ -266,10 +271,11 @@ class CameraDevice(camera_base.Camera):
         return self.spimimagedata_ptr.value
 
     def __spim_data_unlocker(self, gene :int, new_data : bool, running : bool):
-        status = self.camera.getCCDStatus()
-        if status["mode"] == "Spectrum imaging":
-            self.__frame_number = status["current spectrum"]
-        if "Chrono" in status["mode"]:
+        if new_data:
+            self.__frame_number += 1  # spectra counted here, the status snapshot can be one polling period old
+        if not running:
+            self.status_monitor.refresh()
+        if "Chrono" in self.status_monitor.status.mode:
             if new_data:
                 self.has_data_event.set()
         else:
@@ -339,11 +345,14 @@ class CameraDevice(camera_base.Camera):
             self.sizez = 1
             if (self.current_camera_settings.acquisition_mode == "2D-Chrono"):
                 self.sizez = self.current_camera_settings.spectra_count
-                self.spimimagedata = numpy.zeros((self.sizez, self.sizey, self.sizex), dtype = numpy.float32)
+                release_buffer(self.spimimagedata)
+                self.spimimagedata = allocate_buffer((self.sizez, self.sizey, self.sizex), numpy.float32,
+                                                     name='orsay_spim')
             else:
                 self.sizey = self.current_camera_settings.spectra_count
                 self.sizez = 1
-                self.spimimagedata = numpy.zeros((self.sizey, self.sizex), dtype=numpy.float32)
+                release_buffer(self.spimimagedata)
+                self.spimimagedata = allocate_buffer((self.sizey, self.sizex), numpy.float32, name='orsay_spim')
             self.spimimagedata_ptr = self.spimimagedata.ctypes.data_as(ctypes.c_void_p)
             self.camera.startSpim(self.current_camera_settings.spectra_count, 1,
                                   self.current_camera_settings.exposure_ms * 1000,
@@ -351,6 +360,7 @@ class CameraDevice(camera_base.Camera):
             self.camera.resumeSpim(4)  # stop eof
             if self.current_camera_settings.acquisition_mode == "1D-Chrono-Live":
                 self.camera.setSpimMode(1)  # continuous
+            self.status_monitor.poll()  # the callbacks must not see the idle status of before the start
             # for channels in hardware_source.data_channels:
             #     channels.processor = "None"
         elif "spim" in self.current_camera_settings.acquisition_mode:
@@ -366,6 +376,7 @@ class CameraDevice(camera_base.Camera):
             self.imagedata_ptr = self.imagedata.ctypes.data_as(ctypes.c_void_p)
             self.__acqon = self.camera.startFocus(self.current_camera_settings.exposure_ms * 1000,
                                                   self.current_camera_settings.acquisition_style, acqmode)
+            self.status_monitor.poll()
             # for channels in hardware_source.data_channels:
             #     channels. = HardwareSource.SumProcessor(((0.25, 0.0), (0.5, 1.0)))
             #     pass
@@ -443,8 +454,8 @@ class CameraDevice(camera_base.Camera):
             self.sizey = scansize
             self.sizez = 1
         print(f"{self.sizex} {self.sizey} {self.sizez}")
-        self.spimimagedata = numpy.zeros((self.sizey * self.sizez, self.sizex), dtype = numpy.float32)
-        self.spimimagedata = numpy.ascontiguousarray(self.spimimagedata, dtype = numpy.float32)
+        release_buffer(self.spimimagedata)
+        self.spimimagedata = allocate_buffer((self.sizey * self.sizez, self.sizex), numpy.float32, name='orsay_spim')
         self.spimimagedata_ptr = self.spimimagedata.ctypes.data_as(ctypes.c_void_p)
         print(f"allocated {self.spimimagedata_ptr}")
         if self.__acqon:
@@ -454,6 +465,7 @@ class CameraDevice(camera_base.Camera):
 
     def acquire_sequence(self, n: int) -> dict:
         self.camera.resumeSpim(4)  # stop eof
+        self.status_monitor.poll()
         self.__acqspimon = True
         print(f"resumed")
         print(f"acquiring {n}")
@@ -12,6 +12,7 @@ from nion.swift.model import HardwareSource
 from nion.utils import Registry
 
 from .orsayscan import orsayScan, LOCKERFUNC, UNLOCKERFUNC, UNLOCKERFUNCA
+from .buffers import allocate_buffer, release_buffer
 from . ConfigDialog import ConfigDialog
 
 from nion.instrumentation import scan_base
@@ -66,9 +67,12 @@ class Device:
         self.__profiles.append(scan_base.ScanFrameParameters({"size": (2048, 2048), "pixel_time_us": 2.5, "channels":channels}))
         self.__frame_parameters = copy.deepcopy(self.__profiles[0])
 
-        self.imagedata = numpy.empty((self.__sizez * self.__scan_size[1], self.__scan_size[0]), dtype = numpy.int16)
+        self.imagedata = allocate_buffer((self.__sizez * self.__scan_size[1], self.__scan_size[0]), numpy.int16,
+                                         name='orsay_scan')
         self.imagedata_ptr = self.imagedata.ctypes.data_as(ctypes.c_void_p)
         self.has_data_event = threading.Event()
+        self.__band_lock = threading.Lock()
+        self.__reset_bands()
         self.fnlock = LOCKERFUNC(self.__data_locker)
         self.orsayscan.registerLocker(self.fnlock)
         self.fnunlock = UNLOCKERFUNCA(self.__data_unlockerA)
@@ -124,6 +128,12 @@ class Device:
         #return self.orsayscan.getInputProperties(self.usedinputs[channel_index])[2]
         return self.usedinputs[channel_index][2][2]
 
+    def __reset_bands(self):
+        self.__band = None  # (first, last + 1) lines updated since the last read_partial
+        self.__rows_done = 0  # lines of the current frame already available
+        self.__frame_complete = False
+        self.__frame_data = numpy.zeros((self.__sizez, self.__scan_size[1], self.__scan_size[0]), dtype=numpy.float32)
+
     def read_partial(self, frame_number, pixels_to_skip) -> (typing.Sequence[dict], bool, bool, tuple, int, int):
         """Read or continue reading a frame.
 
@@ -145,7 +155,16 @@ class Device:
 
         gotit = self.has_data_event.wait(2.0)
         #if gotit:
+        with self.__band_lock:
+            band = self.__band
+            complete = self.__frame_complete
+            self.__band = None
+            self.__frame_complete = False
+            self.has_data_event.clear()
         frame_number = self.__frame_number
+        if band is not None:
+            self.__rows_done = band[1]
+        rows_done = self.__scan_size[1] if complete else self.__rows_done
 
         _data_elements = []
 
@@ -158,8 +177,12 @@ class Device:
                 data_element = dict()
                 image_metadata = self.__frame_parameters.as_dict()
                 if self.usedinputs[channel_index][0] < 100:
-                    data_array = self.imagedata[dataposition*self.__scan_size[1]:(dataposition+1)*self.__scan_size[1], 0:self.__scan_size[0]].astype(numpy.float32)
-                    sub_area = ((0, 0), data_array.shape)
+                    # only the lines updated since the last call are converted
+                    data_array = self.__frame_data[dataposition]
+                    if band is not None:
+                        first = dataposition * self.__scan_size[1]
+                        data_array[band[0]:band[1]] = self.imagedata[first + band[0]:first + band[1], 0:self.__scan_size[0]]
+                    sub_area = ((0, 0), (rows_done, data_array.shape[1]))
                 else:
                     if self.isSpim and (self.__eelscamera is not None):
                         data_array = self.__eelscamera.spimimagedata
@@ -181,10 +204,10 @@ class Device:
                 _data_elements.append(data_element)
             channel_index = channel_index + 1
 
-        complete = True
         bad_frame = False
-        self.has_data_event.clear()
-        pixels_to_skip = 0  # only important when sub_area is not full area
+        if complete:
+            self.__rows_done = 0
+        pixels_to_skip = 0 if complete else rows_done * self.__scan_size[0]
         return _data_elements, complete, bad_frame, sub_area, frame_number, pixels_to_skip
         #else:
         #    return None, False, False, None, 0,0
@@ -271,8 +294,12 @@ class Device:
             self.__sizez = self.orsayscan.GetInputs()[0]
             if self.__sizez % 2:
                 self.__sizez += 1
-            self.imagedata = numpy.empty((self.__sizez * self.__scan_size[1], self.__scan_size[0]), dtype = numpy.int16)
+            release_buffer(self.imagedata)
+            self.imagedata = allocate_buffer((self.__sizez * self.__scan_size[1], self.__scan_size[0]), numpy.int16,
+                                             name='orsay_scan')
             self.imagedata_ptr = self.imagedata.ctypes.data_as(ctypes.c_void_p)
+            with self.__band_lock:
+                self.__reset_bands()
             self.__angle = 0
             self.orsayscan.setScanRotation(self.__angle)
 
@@ -320,8 +347,15 @@ class Device:
             #     self.__angle = self.__angle + 5
             #     self.orsayscan.setScanRotation(self.__angle)
             #     print("Frame number: " + str(imagenb) + "    New rotation: " + str(self.__angle))
-            self.__frame_number = imagenb
-            self.has_data_event.set()
+            with self.__band_lock:
+                first, last = rect[1], rect[1] + rect[3]
+                if self.__band is not None:
+                    first, last = min(first, self.__band[0]), max(last, self.__band[1])
+                self.__band = (first, last)
+                if last >= self.__scan_size[1]:
+                    self.__frame_complete = True
+                self.__frame_number = imagenb
+                self.has_data_event.set()
             if self.isSpim:
                 status = self.__eelscamera.camera.getCCDStatus()
                 if status["mode"] == "idle":
@@ -0,0 +1,53 @@
+"""
+Immutable description of the buffers handed to the Scan.dll and Cameras.dll locker callbacks.
+
+The lockers are called by the dll threads before each data transfer. Instead of reading the sizes from the parameter
+tree there, the viewers build an AcquisitionGeometry when they (re)allocate their buffers and replace it as a whole,
+so that a callback always reads sizes, data type and address belonging to the same buffer.
+"""
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from .frame_ring import FrameRing
+
+#: data type codes of the locker callbacks
+ORSAY_DATA_TYPES = {np.dtype(np.int8): 1, np.dtype(np.int16): 2, np.dtype(np.int32): 3, np.dtype(np.uint8): 5,
+                    np.dtype(np.uint16): 6, np.dtype(np.uint32): 7, np.dtype(np.float32): 11,
+                    np.dtype(np.float64): 12}
+
+
+def orsay_data_type(dtype) -> int:
+    """ Data type code to be returned by a locker for a buffer of the given numpy dtype """
+    return ORSAY_DATA_TYPES[np.dtype(dtype)]
+
+
+@dataclass(frozen=True)
+class AcquisitionGeometry:
+    """ Sizes, data type code and buffer to be returned by a locker callback
+
+    Either address (fixed buffer) or ring (the locker hands out the ring slots) is given.
+    """
+    sx: int
+    sy: int = 1
+    sz: int = 1
+    datatype: int = 2
+    address: int = 0
+    ring: Optional[FrameRing] = None
+
+    @property
+    def size(self):
+        return self.sx * self.sy * self.sz
+
+    def fill_locker(self, datatype, sx, sy=None, sz=None) -> int:
+        """ Set the pointers given to the locker callback and return the buffer address """
+        datatype[0] = self.datatype
+        sx[0] = self.sx
+        if sy is not None:
+            sy[0] = self.sy
+        if sz is not None:
+            sz[0] = self.sz
+        if self.ring is not None:
+            return self.ring.acquire()
+        return self.address
@@ -0,0 +1,382 @@
+"""
+asyncio interface to the scan and camera acquisitions, for scripts driving several instruments from one event loop.
+
+AsyncScan and AsyncCamera register their own locker/unlocker callbacks on an orsayScan/orsayCamera. The callbacks,
+called from the dll threads, copy the completed frames (spectra) and hand them to the event loop with
+loop.call_soon_threadsafe, where they resolve the coroutines waiting for them. The dll calls are executed off the
+event loop: in the executor of the scan handle (see scan_executor), in the default executor of the loop for the camera.
+
+    async def main():
+        scan = AsyncScan(orsayScan(1, shared=True))
+        camera = AsyncCamera(orsayCamera(1, 'PIXIS: 256E', '', True))
+        async with scan:
+            await scan.start()
+            frame = await scan.next_frame(timeout=5.)
+            async with contextlib.aclosing(camera.spim_stream(16, 16, 0.01)) as spectra:
+                async for spectrum in spectra:
+                    ...
+
+Cancelling a task waiting in start stops the acquisition it may have started, and stop completes even if the task
+calling it is cancelled. Both only act on the acquisition running when they are called, not on one started meanwhile.
+spim_stream stops its SPIM when the generator is closed: with contextlib.aclosing when leaving the async with block,
+otherwise only when the event loop finalizes the generator, possibly long after a break.
+"""
+import abc
+import asyncio
+
+import numpy as np
+
+from . import orsaycamera, orsayscan
+from .acquisition_geometry import AcquisitionGeometry, orsay_data_type
+from .instrumentation import instrumentation
+
+_END = object()  # posted when the acquisition is over
+
+
+class _Stream:
+    """ Frames (spectra) posted from the dll threads and consumed by the coroutines of the event loop
+
+    With maxlen, the oldest pending items are dropped (and counted) when the consumer does not keep up.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, maxlen=None):
+        self.loop = loop
+        self.maxlen = maxlen
+        self.dropped = 0
+        self.ended = False  # the items posted after the end are ignored
+        self._queue = asyncio.Queue()
+
+    def post(self, item):
+        """ Thread safe, called from the dll callbacks """
+        try:
+            self.loop.call_soon_threadsafe(self._put, item)
+        except RuntimeError:  # the loop is closed, nobody is waiting any more
+            pass
+
+    def end(self):
+        self.post(_END)
+
+    def _put(self, item):
+        if self.ended:
+            return
+        if item is _END:
+            self.ended = True
+        elif self.maxlen is not None and self._queue.qsize() >= self.maxlen:
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(item)
+
+    async def get(self, timeout=None):
+        """ Next item, or _END (for this and the following calls) once the acquisition is over """
+        item = await asyncio.wait_for(self._queue.get(), timeout)
+        if item is _END:
+            self._queue.put_nowait(_END)
+        return item
+
+
+class _AsyncAcquisition(abc.ABC):
+    """ Frame stream and async iteration shared by AsyncScan and AsyncCamera """
+
+    def __init__(self, maxlen=8):
+        self.maxlen = maxlen  # number of frames kept for a consumer slower than the acquisition
+        self.loop: asyncio.AbstractEventLoop = None
+        self._frames: _Stream = None
+
+    @property
+    def dropped(self) -> int:
+        """ Frames of the current acquisition discarded before being awaited """
+        return 0 if self._frames is None else self._frames.dropped
+
+    def _new_frames(self):
+        self.loop = asyncio.get_running_loop()
+        if self._frames is not None:
+            self._frames.end()
+        self._frames = _Stream(self.loop, self.maxlen)
+
+    def _post_frame(self, frame):
+        frames = self._frames
+        if frames is not None:
+            frames.post(frame)
+
+    async def next_frame(self, timeout=None) -> np.ndarray:
+        """ Next frame not yet returned, raises RuntimeError if the acquisition is stopped, asyncio.TimeoutError after
+        timeout seconds """
+        if self._frames is None:
+            raise RuntimeError('No acquisition has been started')
+        frame = await self._frames.get(timeout)
+        if frame is _END:
+            raise RuntimeError('The acquisition is stopped')
+        return frame
+
+    async def frames(self, timeout=None):
+        """ Async iterator over the frames, until the acquisition is stopped """
+        while True:
+            try:
+                yield await self.next_frame(timeout)
+            except RuntimeError:
+                return
+
+    @abc.abstractmethod
+    async def call(self, function, *args):
+        """ Result of function(*args) executed off the event loop """
+
+    @abc.abstractmethod
+    def _current(self):
+        """ State identifying the running acquisition, given to _stop """
+
+    @abc.abstractmethod
+    async def _stop(self, current):
+        """ Stop the acquisition identified by current (see _current) if it is still running and end its stream """
+
+    async def stop(self):
+        """ Stop the running acquisition """
+        await self._stop(self._current())
+
+    async def _start(self, function, *args):
+        """ Result of the call of function(*args) starting the acquisition
+
+        If the calling task is cancelled, the acquisition is stopped once the call, that cannot be interrupted, returns.
+        """
+        current = self._current()
+        start = asyncio.ensure_future(self.call(function, *args))
+        try:
+            return await asyncio.shield(start)
+        except asyncio.CancelledError:
+            start.add_done_callback(lambda _: asyncio.ensure_future(self._stop(current)))
+            raise
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop()
+
+
+class AsyncScan(_AsyncAcquisition):
+    """ Frames of an orsayScan (all its inputs, as a (inputs, Ny, Nx) int16 array) awaited from an event loop
+
+    The callbacks of the handle are replaced by the ones of this object.
+    """
+
+    def __init__(self, scan: orsayscan.orsayScan, maxlen=8):
+        super().__init__(maxlen)
+        self.scan = scan
+        self.geometry: AcquisitionGeometry = None
+        self._buffer: np.ndarray = None
+        self._imagenb = 0
+        self._stopping: _Stream = None  # frames ended by the next completed frame, see stop
+        self.fnlock = orsayscan.LOCKERFUNC(instrumentation.timed_callback('AsyncScan.dataLocker', self.dataLocker))
+        self.fnunlockA = orsayscan.UNLOCKERFUNCA(
+            instrumentation.timed_callback('AsyncScan.dataUnlockerA', self.dataUnlockerA))
+        self.scan.registerLocker(self.fnlock)
+        self.scan.registerUnlockerA(self.fnunlockA)
+
+    async def call(self, function, *args):
+        """ Result of function(*args) (e.g. a method of the orsayScan) executed by the executor of the handle """
+        return await asyncio.wrap_future(self.scan.submit(function, *args))
+
+    async def start(self, mode=0, linesaveraging=1) -> bool:
+        """ Start imaging with the current image size, area and inputs """
+        sizex, sizey = await self.call(self.scan.getImageSize)
+        nbinputs, _ = await self.call(self.scan.GetInputs)
+        self._buffer = np.zeros((max(nbinputs, 1), sizey, sizex), dtype=np.int16)
+        self.geometry = AcquisitionGeometry(sizex, sizey, self._buffer.shape[0], datatype=2,
+                                            address=self._buffer.ctypes.data)
+        self._imagenb = 0
+        self._stopping = None
+        self._new_frames()
+        return await self._start(self.scan.startImaging, mode, linesaveraging)
+
+    async def stop(self, cancel=True):
+        """ Stop imaging, immediately if cancel else at the end of the current frame (the last frame) """
+        await self._stop(self._current(), cancel)
+
+    def _current(self):
+        return self._frames
+
+    async def _stop(self, current, cancel=True):
+        if current is None:
+            return
+        if current is not self._frames:  # replaced by a newer acquisition, left running
+            current.end()
+            return
+        if not cancel:
+            self._stopping = current
+        await asyncio.shield(self.call(self.scan.stopImaging, cancel))
+        if cancel:
+            current.end()
+
+    def dataLocker(self, gene, datatype, sx, sy, sz):
+        geometry = self.geometry
+        if geometry is None:
+            return 0
+        return geometry.fill_locker(datatype, sx, sy, sz)
+
+    def dataUnlockerA(self, gene, newdata, imagenb, rect):
+        """ Posts a copy of the buffer once the frame is complete: the image number changes, as in the STEM viewer """
+        if newdata and imagenb != self._imagenb:
+            self._imagenb = imagenb
+            self._post_frame(self._buffer.copy())
+            stopping = self._stopping
+            if stopping is not None:
+                stopping.end()
+
+
+class AsyncCamera(_AsyncAcquisition):
+    """ Frames (focus mode) and spectra (SPIM) of an orsayCamera awaited from an event loop
+
+    The callbacks of the camera are replaced by the ones of this object.
+    """
+
+    def __init__(self, camera: orsaycamera.orsayCamera, dtype=np.float32, maxlen=8):
+        super().__init__(maxlen)
+        self.camera = camera
+        self.dtype = np.dtype(dtype)
+        self.geometry: AcquisitionGeometry = None
+        self.spim_geometry: AcquisitionGeometry = None
+        self.spectrum_geometry: AcquisitionGeometry = None
+        self._buffer: np.ndarray = None
+        self._spectrum: np.ndarray = None
+        self.spim: np.ndarray = None  # (spectrum size, spim_y, spim_x) cube filled during the SPIM
+        self.spim_current = 0  # index of the next spectrum of the SPIM
+        self._spectra: _Stream = None
+        self._mode = None  # 'focus' or 'spim' while acquiring
+
+        self.fnlock = orsaycamera.DATALOCKFUNC(
+            instrumentation.timed_callback('AsyncCamera.dataLocker', self.dataLocker))
+        self.fnunlock = orsaycamera.DATAUNLOCKFUNC(
+            instrumentation.timed_callback('AsyncCamera.dataUnlocker', self.dataUnlocker))
+        self.fnspimlock = orsaycamera.SPIMLOCKFUNC(
+            instrumentation.timed_callback('AsyncCamera.spimdataLocker', self.spimdataLocker))
+        self.fnspimunlock = orsaycamera.SPIMUNLOCKFUNC(
+            instrumentation.timed_callback('AsyncCamera.spimdataUnlocker', self.spimdataUnlocker))
+        self.fnspectrumlock = orsaycamera.SPECTLOCKFUNC(
+            instrumentation.timed_callback('AsyncCamera.spectrumdataLocker', self.spectrumdataLocker))
+        self.fnspectrumunlock = orsaycamera.SPECTUNLOCKFUNC(
+            instrumentation.timed_callback('AsyncCamera.spectrumdataUnlocker', self.spectrumdataUnlocker))
+        self.fnspimupdate = orsaycamera.SPIMUPDATEFUNC(
+            instrumentation.timed_callback('AsyncCamera.spimUpdateInfo', self.spimUpdateInfo))
+        self.camera.registerDataLocker(self.fnlock)
+        self.camera.registerDataUnlocker(self.fnunlock)
+        self.camera.registerSpimDataLocker(self.fnspimlock)
+        self.camera.registerSpimDataUnlocker(self.fnspimunlock)
+        self.camera.registerSpectrumDataLocker(self.fnspectrumlock)
+        self.camera.registerSpectrumDataUnlocker(self.fnspectrumunlock)
+        self.camera.registerSpimUpdateInfo(self.fnspimupdate)
+
+    async def call(self, function, *args):
+        """ Result of function(*args) (e.g. a method of the orsayCamera) executed in the default executor """
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    async def start_focus(self, exposure, displaymode='2d', accumulate=False) -> bool:
+        """ Start the continuous acquisition of frames (spectra if displaymode is '1d') """
+        sizex, sizey = await self.call(self.camera.getImageSize)
+        self._buffer = np.zeros((sizey, sizex), dtype=self.dtype)
+        self.geometry = AcquisitionGeometry(sizex, sizey, 1, datatype=orsay_data_type(self.dtype),
+                                            address=self._buffer.ctypes.data)
+        self._new_frames()
+        self._mode = 'focus'
+        return await self._start(self.camera.startFocus, exposure, displaymode, accumulate)
+
+    async def start_spim(self, spim_x, spim_y, exposure) -> bool:
+        """ Start a SPIM of spim_x * spim_y spectra, stopped at its end, the spectra are awaited with next_spectrum """
+        sizex, _ = await self.call(self.camera.getImageSize)
+        self.spim = np.zeros((sizex, spim_y, spim_x), dtype=self.dtype)
+        self._spectrum = np.zeros((sizex,), dtype=self.dtype)
+        datatype = orsay_data_type(self.dtype)
+        self.spim_geometry = AcquisitionGeometry(spim_x, spim_y, sizex, datatype=datatype,
+                                                 address=self.spim.ctypes.data)
+        self.spectrum_geometry = AcquisitionGeometry(sizex, datatype=datatype, address=self._spectrum.ctypes.data)
+        self.spim_current = 0
+        self.loop = asyncio.get_running_loop()
+        if self._spectra is not None:
+            self._spectra.end()
+        self._spectra = _Stream(self.loop)  # spectra are not dropped, the SPIM is finite
+        self._mode = 'spim'
+        return await self._start(self._start_spim, spim_x * spim_y, exposure)
+
+    def _start_spim(self, nbspectra, exposure):
+        self.camera.startSpim(nbspectra, 1, exposure, False)
+        return self.camera.resumeSpim(4)  # stop at the end of the spim
+
+    def _current(self):
+        """ Mode and stream of the running focus or SPIM acquisition """
+        if self._mode == 'focus':
+            return 'focus', self._frames
+        if self._mode == 'spim':
+            return 'spim', self._spectra
+        return None, None
+
+    async def _stop(self, current):
+        mode, stream = current
+        if mode is not None and self._current() == current:  # else over or replaced by a newer acquisition
+            self._mode = None
+            if mode == 'focus':
+                await asyncio.shield(self.call(self.camera.stopFocus))
+            else:
+                await asyncio.shield(self.call(self.camera.stopSpim, True))
+        if stream is not None:
+            stream.end()
+
+    async def next_spectrum(self, timeout=None) -> np.ndarray:
+        """ Next spectrum of the SPIM, raises RuntimeError once the SPIM is over """
+        if self._spectra is None:
+            raise RuntimeError('No SPIM has been started')
+        spectrum = await self._spectra.get(timeout)
+        if spectrum is _END:
+            raise RuntimeError('The SPIM is over')
+        return spectrum
+
+    async def spim_stream(self, spim_x, spim_y, exposure, timeout=None):
+        """ Async iterator over the spectra of a SPIM started by the iteration, the whole cube is then in spim
+
+        The SPIM is stopped when the generator is closed: use contextlib.aclosing to stop it at a break, an unclosed
+        generator is only finalized later by the loop (a newer acquisition started meanwhile is then left running).
+        """
+        await self.start_spim(spim_x, spim_y, exposure)
+        current = ('spim', self._spectra)
+        try:
+            while True:
+                try:
+                    spectrum = await self.next_spectrum(timeout)
+                except RuntimeError:
+                    return
+                yield spectrum
+        finally:
+            await self._stop(current)
+
+    def dataLocker(self, camera, datatype, sx, sy, sz):
+        geometry = self.geometry
+        if geometry is None:
+            return 0
+        return geometry.fill_locker(datatype, sx, sy, sz)
+
+    def dataUnlocker(self, camera, newdata):
+        if newdata:
+            self._post_frame(self._buffer.copy())
+
+    def spimdataLocker(self, camera, datatype, sx, sy, sz):
+        geometry = self.spim_geometry
+        if geometry is None:
+            return 0
+        return geometry.fill_locker(datatype, sx, sy, sz)
+
+    def spimdataUnlocker(self, camera, newdata, running):
+        if not running:
+            if self._spectra is not None:
+                self._spectra.end()
+            if self._mode == 'spim':  # not a focus started meanwhile, whose start ended the SPIM
+                self._mode = None
+
+    def spectrumdataLocker(self, camera, datatype, sx):
+        geometry = self.spectrum_geometry
+        if geometry is None:
+            return 0
+        return geometry.fill_locker(datatype, sx)
+
+    def spectrumdataUnlocker(self, camera, newdata):
+        if newdata and self._spectra is not None:
+            self._spectra.post(self._spectrum.copy())
+
+    def spimUpdateInfo(self, currentspectrum, running):
+        self.spim_current = currentspectrum
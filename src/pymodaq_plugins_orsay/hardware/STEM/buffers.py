@@ -0,0 +1,119 @@
+"""
+Allocation of the acquisition buffers handed to the Scan.dll and Cameras.dll lockers.
+
+Small buffers are plain numpy arrays. Above a RAM budget (a 1024x1024 SPIM of 2048 channels is 8 GB of float32) the
+buffer is a numpy.memmap on a file: the dll writes directly into the page cache backed mapping, the system can page
+it out instead of failing the allocation, and the data is on disk when the acquisition ends. The file is kept when the
+buffer is released (its path is logged when it is created), unless its removal is requested.
+"""
+import logging
+import os
+from pathlib import Path
+import tempfile
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RAM_BUDGET = 2 * 1024 ** 3  # bytes
+
+
+def buffer_nbytes(shape, dtype) -> int:
+    return int(np.prod(shape)) * np.dtype(dtype).itemsize
+
+
+def allocate_buffer(shape, dtype=np.float32, ram_budget=DEFAULT_RAM_BUDGET, folder=None, name='orsay_buffer'):
+    """ Zero filled C contiguous array, memory mapped on a file of folder if larger than ram_budget
+
+    Parameters
+    ----------
+    shape: int or tuple of int
+    dtype: numpy dtype
+    ram_budget: int
+        size in bytes above which the buffer is memory mapped, None to always allocate it in RAM
+    folder: str or Path
+        folder of the mapped file, the system temporary folder if None or empty
+    name: str
+        prefix of the mapped file name
+
+    Returns
+    -------
+    np.ndarray or np.memmap
+    """
+    shape = tuple(np.atleast_1d(shape).astype(int))
+    if ram_budget is None or buffer_nbytes(shape, dtype) <= ram_budget:
+        return np.zeros(shape, dtype=dtype)
+    folder = Path(folder) if folder else Path(tempfile.gettempdir())
+    folder.mkdir(parents=True, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix=f'{name}_', suffix='.dat', dir=folder)
+    os.close(fd)
+    logger.info(f'Buffer of shape {shape} memory mapped on {path}')
+    return np.memmap(path, dtype=dtype, mode='w+', shape=shape)  # the file is created sparse, hence zero filled
+
+
+def release_buffer(array, remove_file=False):
+    """ Flush a buffer given by allocate_buffer, its file is kept unless remove_file is True
+
+    The mapping itself is closed once the last reference to the array is gone. Where an open mapping prevents the
+    removal (Windows), the file is left in place.
+    """
+    if isinstance(array, np.memmap) and array.filename is not None:
+        array.flush()
+        if remove_file:
+            try:
+                os.remove(array.filename)
+            except OSError:
+                pass
+
+
+class BufferPool:
+    """ Acquisition buffers by name, allocated again only when their shape or dtype change
+
+    Parameters
+    ----------
+    ram_budget: int
+        see allocate_buffer
+    folder: str or Path
+        see allocate_buffer
+    remove_files: bool
+        remove the files of the memory mapped buffers when they are released, see release_buffer
+    """
+
+    def __init__(self, ram_budget=DEFAULT_RAM_BUDGET, folder=None, remove_files=False):
+        self.ram_budget = ram_budget
+        self.folder = folder
+        self.remove_files = remove_files
+        self.allocations = 0
+        self._buffers = dict()
+
+    def get(self, name, shape, dtype=np.float32, clear=False):
+        """ Buffer of the given name, shape and dtype
+
+        The buffer previously returned for this name is given back if it has the same shape and dtype (and zero filled
+        if clear is True), else it is released and a new one is allocated.
+        """
+        shape = tuple(np.atleast_1d(shape).astype(int))
+        dtype = np.dtype(dtype)
+        array = self._buffers.get(name, None)
+        if array is not None and array.shape == shape and array.dtype == dtype:
+            if clear:
+                array.fill(0)
+            return array
+        release_buffer(array, self.remove_files)
+        array = allocate_buffer(shape, dtype, ram_budget=self.ram_budget, folder=self.folder, name=f'orsay_{name}')
+        self._buffers[name] = array
+        self.allocations += 1
+        return array
+
+    def detach(self, name):
+        """ Remove the buffer of the given name from the pool without releasing it, the next get allocates a new one
+
+        To hand a buffer (typically a memory mapped one, too large to be copied) over to its user.
+        """
+        return self._buffers.pop(name, None)
+
+    def release(self):
+        """ Release all the buffers, to be called once the dll does not use them anymore """
+        for array in self._buffers.values():
+            release_buffer(array, self.remove_files)
+        self._buffers.clear()
@@ -0,0 +1,122 @@
+"""
+Bounded queue decoupling the dll callback threads from the data processing and emission.
+
+The Scan.dll and Cameras.dll callbacks run in the vendor acquisition threads: anything done there (numpy conversions,
+DataToExport construction, Qt signal emission) delays the acquisition. The callbacks only put a small item describing
+what is available in a CallbackQueue, and a consumer thread calls the handler with it.
+
+Intermediate items (partial frames, spectra while a SPIM is running) are displayed at most display_rate times per
+second: the ones arriving while the previous one is still pending are merged into it (counted in coalesced). Final
+items (complete frames) are handled as soon as possible. If the consumer falls behind and the queue is full, the
+oldest intermediate item is discarded (counted in dropped). Final items are never discarded: they may hold resources
+(a frame buffer) released by their handler, and a grab completes only when its final item is handled.
+"""
+from collections import deque
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CallbackQueue:
+    """ Single producer, single consumer bounded queue with a consumer thread
+
+    Parameters
+    ----------
+    handler: callable
+        called by the consumer thread with each item
+    merge: callable
+        merge(pending_item, new_item) -> item, combining a pending intermediate item with a new one. If None, the new
+        item replaces the pending one.
+    maxlen: int
+        maximum number of pending items, exceeded only by final items
+    display_rate: float
+        maximum number of intermediate items handled per second (0 for no limit)
+    """
+
+    def __init__(self, handler, merge=None, maxlen=8, display_rate=20., name='OrsayCallbackQueue'):
+        self.handler = handler
+        self.merge = merge if merge is not None else lambda pending, item: item
+        self.maxlen = maxlen
+        self.display_rate = display_rate
+        self.name = name
+        self.coalesced = 0
+        self.dropped = 0
+        self.handled = 0
+        self._items = deque()  # (item, final)
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+        self._next_display = 0.
+
+    def put(self, item, final=False):
+        """ Called from the dll callback, never blocks """
+        with self._condition:
+            if self._items and not self._items[-1][1]:
+                pending, _ = self._items.pop()
+                item = self.merge(pending, item)
+                self.coalesced += 1
+            elif len(self._items) >= self.maxlen:
+                intermediate = next((ind for ind, (_, pending_final) in enumerate(self._items)
+                                     if not pending_final), None)
+                self.dropped += 1
+                if intermediate is not None:
+                    del self._items[intermediate]
+                elif not final:  # only final items are pending
+                    return
+            self._items.append((item, final))
+            self._condition.notify()
+
+    def clear(self):
+        with self._condition:
+            self._items.clear()
+
+    def reset_counters(self):
+        self.coalesced = 0
+        self.dropped = 0
+        self.handled = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2.):
+        with self._condition:
+            self._running = False
+            self._items.clear()
+            self._condition.notify()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _next_item(self):
+        """ Wait for the next item to handle, None when stopped """
+        with self._condition:
+            while self._running:
+                if self._items:
+                    final = self._items[0][1]
+                    delay = self._next_display - time.perf_counter()
+                    if final or delay <= 0 or len(self._items) > 1:
+                        item, final = self._items.popleft()
+                        if not final and self.display_rate > 0:
+                            self._next_display = time.perf_counter() + 1 / self.display_rate
+                        return item,
+                    self._condition.wait(delay)
+                else:
+                    self._condition.wait()
+            return None
+
+    def _run(self):
+        while True:
+            item = self._next_item()
+            if item is None:
+                break
+            try:
+                self.handler(item[0])
+            except Exception:
+                logger.exception(f'{self.name}: error while handling {item[0]}')
+            self.handled += 1
@@ -0,0 +1,405 @@
+"""
+Recording of the locker/unlocker callbacks of Scan.dll and Cameras.dll, and replay of the recordings.
+
+With the ORSAY_SCAN_RECORD (or ORSAY_CAMERA_RECORD) environment variable set to a file path, orsayscan (orsaycamera)
+wraps its library in a RecordingLibrary: every callback registered by the plugins is called through a recording
+function that saves its arguments, the sizes returned by the lockers and the data written by the library in the locked
+buffer (the updated rect of a scan frame, a camera frame, a spectrum), together with the time of the call. The start of
+each acquisition is saved as a marker. Only the copy of the data is done in the library thread, the events are pickled
+and compressed into the file by a writer thread.
+
+With ORSAY_SCAN_BACKEND (ORSAY_CAMERA_BACKEND) set to "replay" and ORSAY_SCAN_REPLAY (ORSAY_CAMERA_REPLAY) set to a
+recorded file, the library is the simulator whose devices, instead of synthesizing data, play the recorded events
+acquisition after acquisition through the callbacks registered by the plugins. The recorded durations are multiplied by
+the time_scale of the simulated device (ORSAY_SIMULATOR_TIME_SCALE, 0 to replay as fast as possible), the recorded
+acquisitions are played again from the first one once they have all been replayed.
+
+The SPIM cube is not recorded: the replay writes each recorded spectrum in the cube at the index given by the spim
+update callback, as the camera does.
+"""
+import atexit
+import ctypes
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import partial
+import gzip
+import pickle
+import queue
+import threading
+import time
+from typing import Dict, Set
+
+import numpy as np
+
+from . import orsayscan_simulator, orsaycamera_simulator
+from .orsayscan_simulator import DATA_TYPES
+
+FILE_VERSION = 1
+
+
+@dataclass(frozen=True)
+class LibrarySpec:
+    """ Entry points of a library involved in the recording """
+    name: str
+    init: str  # function returning a new handle
+    callbacks: Dict[str, str]  # registering function: name of the callback
+    starts: Set[str]  # functions starting an acquisition
+    gene_channel: bool  # if True the first argument of the callbacks and start functions is the generator
+    device_attributes: Dict[str, str] = field(default_factory=dict)  # callback: attribute of the simulated device
+
+
+SCAN = LibrarySpec(
+    name='scan', init='OrsayScanInit',
+    callbacks={'OrsayScanRegisterDataLocker': 'DataLocker', 'OrsayScanRegisterDataUnlocker': 'DataUnlocker',
+               'OrsayScanRegisterDataUnlockerA': 'DataUnlockerA'},
+    starts={'OrsayScanStartImaging', 'OrsayScanStartSpim'}, gene_channel=True,
+    device_attributes={'DataLocker': 'locker', 'DataUnlocker': 'unlocker', 'DataUnlockerA': 'unlockerA'})
+
+CAMERA = LibrarySpec(
+    name='camera', init='OrsayCamerasInit',
+    callbacks={'RegisterDataLocker': 'DataLocker', 'RegisterDataUnlocker': 'DataUnlocker',
+               'RegisterSpimDataLocker': 'SpimDataLocker', 'RegisterSpimDataUnlocker': 'SpimDataUnlocker',
+               'RegisterSpectrumDataLocker': 'SpectrumDataLocker',
+               'RegisterSpectrumDataUnlocker': 'SpectrumDataUnlocker', 'RegisterSpimUpdateInfo': 'SpimUpdateInfo'},
+    starts={'StartFocus', 'StartSpim'}, gene_channel=False,
+    device_attributes={'DataLocker': 'data_locker', 'DataUnlocker': 'data_unlocker', 'SpimDataLocker': 'spim_locker',
+                       'SpimDataUnlocker': 'spim_unlocker', 'SpectrumDataLocker': 'spectrum_locker',
+                       'SpectrumDataUnlocker': 'spectrum_unlocker', 'SpimUpdateInfo': 'spim_update'})
+
+
+def _family(name) -> str:
+    """ Buffer shared by a locker and its unlockers: 'Data', 'SpimData' or 'SpectrumData' """
+    return name.split('Locker')[0].split('Unlocker')[0]
+
+
+def _buffer_view(address, sizes) -> np.ndarray:
+    """ View on a locked buffer from the (datatype, sx[, sy, sz]) set by the locker, shape (sz, sy, sx) """
+    dtype = DATA_TYPES.get(sizes[0] % 100, None)
+    if not address or dtype is None:
+        return None
+    dtype = np.dtype(dtype)
+    shape = tuple(reversed(sizes[1:]))
+    buffer = (ctypes.c_char * (int(np.prod(shape)) * dtype.itemsize)).from_address(address)
+    return np.frombuffer(buffer, dtype=dtype).reshape(shape)
+
+
+def _copy_into(target: np.ndarray, source: np.ndarray):
+    """ Copy source into the first elements of target, whatever their shapes and dtypes """
+    count = min(target.size, source.size)
+    np.copyto(target.reshape(-1)[:count], source.reshape(-1)[:count], casting='unsafe')
+
+
+class CallbackRecorder:
+    """ Save the events given by a RecordingLibrary in a gzip compressed stream of pickles
+
+    The file, complete once close has been called (at exit for a RecordingLibrary), starts with a header dict, then
+    one tuple per event:
+    ('start', device, channel, time) at the start of an acquisition and
+    ('callback', device, channel, time, name, args, sizes, data) for each callback, device being the index of the
+    handle in the order of creation, channel the generator (scan) or 0 (camera), time a time.perf_counter().
+    """
+
+    def __init__(self, path, spec: LibrarySpec):
+        self.path = str(path)
+        self.spec = spec
+        self.events = 0
+        self._buffers = dict()  # (device, channel, family): view of the locked buffer
+        self._unlockers_a = set()  # devices with a DataUnlockerA, whose DataUnlocker is recorded without data
+        self._queue = queue.Queue()
+        self._file = gzip.open(self.path, 'wb', compresslevel=1)
+        pickle.dump(dict(version=FILE_VERSION, library=spec.name, date=datetime.now().isoformat()), self._file)
+        self._thread = threading.Thread(target=self._run, name='OrsayCallbackRecorder', daemon=True)
+        self._thread.start()
+
+    def start(self, device, channel):
+        self._queue.put(('start', device, channel, time.perf_counter()))
+
+    def callback(self, device, name, function):
+        """ Python function recording the calls of the callback name before calling the ctypes function object """
+        if name.endswith('Locker'):
+            return partial(self._locker, device, name, function)
+        elif 'Unlocker' in name:
+            if name == 'DataUnlockerA':
+                self._unlockers_a.add(device)
+            return partial(self._unlocker, device, name, function)
+        return partial(self._call, device, name, function)
+
+    def _channel(self, args):
+        return args[0] if self.spec.gene_channel else 0
+
+    def _locker(self, device, name, function, *args):
+        address = function(*args)
+        sizes = tuple(pointer[0] for pointer in args[1:])
+        channel = self._channel(args)
+        self._buffers[(device, channel, _family(name))] = _buffer_view(address, sizes)
+        self._queue.put(('callback', device, channel, time.perf_counter(), name, args[:1], sizes, None))
+        return address
+
+    def _unlocker(self, device, name, function, *args):
+        channel = self._channel(args)
+        view = self._buffers.get((device, channel, _family(name)), None)
+        recorded_args = args
+        data = None
+        if name == 'DataUnlockerA':
+            x, y, width, height = (args[3][ind] for ind in range(4))
+            recorded_args = args[:3] + ((x, y, width, height),)
+            if args[1] and view is not None:
+                data = view[:, y:y + height, x:x + width].copy()
+        elif args[1] and view is not None and name != 'SpimDataUnlocker' and \
+                not (name == 'DataUnlocker' and device in self._unlockers_a and self.spec.gene_channel):
+            data = view.copy()
+        self._queue.put(('callback', device, channel, time.perf_counter(), name, recorded_args, None, data))
+        return function(*args)
+
+    def _call(self, device, name, function, *args):
+        self._queue.put(('callback', device, 0, time.perf_counter(), name, args, None, None))
+        return function(*args)
+
+    def _run(self):
+        while True:
+            event = self._queue.get()
+            if event is None:
+                break
+            pickle.dump(event, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+            self.events += 1
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+
+
+class _InterceptedFunction:
+    """ Python callable standing for a library function, its argtypes and restype are those of the library function """
+
+    def __init__(self, function, call):
+        self.function = function
+        self.call = call
+
+    def __call__(self, *args):
+        return self.call(self.function, *args)
+
+    @property
+    def argtypes(self):
+        return getattr(self.function, 'argtypes', None)
+
+    @argtypes.setter
+    def argtypes(self, argtypes):
+        self.function.argtypes = argtypes
+
+    @property
+    def restype(self):
+        return getattr(self.function, 'restype', None)
+
+    @restype.setter
+    def restype(self, restype):
+        self.function.restype = restype
+
+
+class RecordingLibrary:
+    """ Library (dll or simulator) whose callbacks and acquisition starts are recorded in the file path """
+
+    def __init__(self, library, spec: LibrarySpec, path):
+        self.library = library
+        self.spec = spec
+        self.recorder = CallbackRecorder(path, spec)
+        atexit.register(self.recorder.close)
+        self._devices = dict()  # handle: index
+        self._callbacks = dict()  # (handle, registering function): recording ctypes function object, kept alive
+
+    def __getattr__(self, name):
+        function = getattr(self.library, name)
+        if name == self.spec.init:
+            return _InterceptedFunction(function, self._init)
+        elif name in self.spec.callbacks:
+            return _InterceptedFunction(function, partial(self._register, name))
+        elif name in self.spec.starts:
+            return _InterceptedFunction(function, self._start)
+        return function
+
+    def _init(self, function, *args):
+        handle = function(*args)
+        self._devices[handle] = len(self._devices)
+        return handle
+
+    def _register(self, register_name, function, handle, callback):
+        device = self._devices.setdefault(handle, len(self._devices))
+        recording = type(callback)(self.recorder.callback(device, self.spec.callbacks[register_name], callback))
+        self._callbacks[(handle, register_name)] = recording
+        return function(handle, recording)
+
+    def _start(self, function, handle, *args):
+        self.recorder.start(self._devices.setdefault(handle, len(self._devices)),
+                            args[0] if self.spec.gene_channel else 0)
+        return function(handle, *args)
+
+
+def load_session(path):
+    """ Header and acquisitions of a recorded file
+
+    Returns
+    -------
+    dict: the header
+    dict: (device, channel): list of acquisitions, each one a list of (time since the start, name, args, sizes, data)
+    """
+    acquisitions = dict()
+    starts = dict()
+    with gzip.open(str(path), 'rb') as file:
+        header = pickle.load(file)
+        while True:
+            try:
+                event = pickle.load(file)
+            except EOFError:
+                break
+            key = (event[1], event[2])
+            if event[0] == 'start':
+                starts[key] = event[3]
+                acquisitions.setdefault(key, []).append([])
+            elif key in starts:  # the callbacks before the first start are not replayed
+                acquisitions[key][-1].append((event[3] - starts[key],) + event[4:])
+    return header, acquisitions
+
+
+class SessionPlayer:
+    """ Acquisitions of one recorded device, played one after the other through the callbacks of a simulated one """
+
+    def __init__(self, spec: LibrarySpec, acquisitions: dict):
+        self.spec = spec
+        self.acquisitions = acquisitions  # channel: list of acquisitions
+        self.played = dict()  # channel: number of acquisitions played
+        self.events = 0
+
+    def play(self, device, channel, cancel: threading.Event, stop_at_end_of_frame=lambda: False):
+        """ Play the next acquisition of channel, until its end or cancel is set """
+        acquisitions = self.acquisitions.get(channel, [])
+        if not acquisitions:
+            return
+        events = acquisitions[self.played.get(channel, 0) % len(acquisitions)]
+        self.played[channel] = self.played.get(channel, 0) + 1
+        views = dict()  # family: (datatype, view of the locked buffer)
+        spectrum = None
+        spim_index = 0
+        start = time.perf_counter()
+        for delay, name, args, sizes, data in events:
+            if cancel.wait(max(0., start + delay * device.time_scale - time.perf_counter())):
+                return
+            callback = getattr(device, self.spec.device_attributes[name], None)
+            self.events += 1
+            if name.endswith('Locker'):
+                if callback is not None:
+                    values = [ctypes.c_int(value) for value in sizes]
+                    address = callback(*args, *(ctypes.pointer(value) for value in values))
+                    sizes = tuple(value.value for value in values)
+                    views[_family(name)] = (sizes[0], _buffer_view(address, sizes))
+                continue
+            datatype, view = views.get(_family(name), (0, None))
+            if name == 'DataUnlockerA':
+                x, y, width, height = args[3]
+                if data is not None and view is not None:
+                    target = view[:, y:y + height, x:x + width]
+                    np.copyto(target, data[:target.shape[0], :target.shape[1], :target.shape[2]], casting='unsafe')
+                if callback is not None:
+                    callback(*args[:3], (ctypes.c_int * 4)(*args[3]))
+                if stop_at_end_of_frame() and view is not None and y + height >= view.shape[1]:
+                    return
+                continue
+            if name == 'SpimUpdateInfo':
+                spim_index = args[0]
+            elif name == 'SpectrumDataUnlocker':
+                spectrum = data
+            elif name == 'SpimDataUnlocker' and args[1] and spectrum is not None and view is not None:
+                if datatype >= 100:  # spectrum data on first axis: one spectrum after the other
+                    cube = view.reshape((-1, view.shape[-1]))
+                else:  # energy is the slowest axis
+                    cube = view.reshape((view.shape[0], -1)).T
+                if spim_index < cube.shape[0]:
+                    _copy_into(cube[spim_index], spectrum)
+            if data is not None and view is not None:
+                _copy_into(view, data)
+            if callback is not None:
+                callback(*args)
+
+
+class ReplayScanDevice(orsayscan_simulator.SimulatedScanDevice):
+    """ Simulated scan unit playing recorded frames instead of synthetic ones """
+
+    def __init__(self, player: SessionPlayer):
+        super().__init__()
+        self.player = player
+
+    def _scan(self, gene, gen):
+        self.player.play(self, gene, gen.cancel, lambda: gen.stop_at_end_of_frame)
+        gen.kind = 0
+
+
+class ReplayCamera(orsaycamera_simulator.SimulatedCamera):
+    """ Simulated camera playing recorded frames and spectra instead of synthetic ones """
+
+    def __init__(self, manufacturer, model: str, player: SessionPlayer):
+        super().__init__(manufacturer, model)
+        self.player = player
+
+    def _focus(self, accumulate):
+        self.mode = 4 if accumulate else 3
+        self.player.play(self, 0, self._cancel)
+        self.mode = 0
+
+    def _spim(self):
+        self.mode = 5
+        self.player.play(self, 0, self._cancel)
+        self._spim_armed = False
+        self.mode = 0
+
+
+class ReplayLibrary:
+    """ Simulator module whose devices are replaying the recorded file path, one recorded device per handle """
+
+    def __init__(self, simulator, spec: LibrarySpec, path):
+        self.simulator = simulator
+        self.spec = spec
+        self.header, acquisitions = load_session(path)
+        if self.header.get('library', spec.name) != spec.name:
+            raise ValueError(f"{path} is a recording of the {self.header['library']} library, not of the {spec.name} "
+                             f"library")
+        self.players = dict()  # recorded device: SessionPlayer
+        for (device, channel), device_acquisitions in acquisitions.items():
+            self.players.setdefault(device, SessionPlayer(spec, dict())).acquisitions[channel] = device_acquisitions
+        self._handles = 0
+        # a function object, _buildFunction sets its argtypes and restype
+        setattr(self, spec.init,
+                _InterceptedFunction(getattr(simulator, spec.init), getattr(self, f'_{spec.name}_init')))
+
+    def __getattr__(self, name):
+        return getattr(self.simulator, name)
+
+    def _player(self) -> SessionPlayer:
+        player = self.players.get(self._handles, None) or SessionPlayer(self.spec, dict())
+        self._handles += 1
+        return player
+
+    def _scan_init(self, function):
+        handle = next(self.simulator._handle_counter)
+        self.simulator._devices[handle] = ReplayScanDevice(self._player())
+        return handle
+
+    def _camera_init(self, function, manufacturer, model, sn, logger, simul):
+        handle = next(self.simulator._handle_counter)
+        camera = ReplayCamera(manufacturer, model.decode('utf-8') if isinstance(model, bytes) else model,
+                              self._player())
+        camera.logger = logger
+        self.simulator._devices[handle] = camera
+        if logger is not None:
+            logger(f"Replayed camera {camera.model}: {camera.ccd_size[0]}x{camera.ccd_size[1]}".encode('utf-8'),
+                   False)
+        return handle
+
+
+def scan_replay_library(path) -> ReplayLibrary:
+    return ReplayLibrary(orsayscan_simulator, SCAN, path)
+
+
+def camera_replay_library(path) -> ReplayLibrary:
+    return ReplayLibrary(orsaycamera_simulator, CAMERA, path)
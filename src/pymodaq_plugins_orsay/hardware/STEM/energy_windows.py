@@ -0,0 +1,91 @@
+"""
+Maps of the signal integrated in energy windows of the SPIM spectra, updated while the SPIM is acquired.
+
+The windows are ranges of channel indexes, each with an optional background window whose mean level is subtracted
+(flat background). The channels of each spectrum are summed once between the precomputed window boundaries, the
+signal of any window is then the difference of two cumulative sums of these segments: besides this single pass over
+the spectrum, updating the maps costs O(number of windows) per spectrum.
+"""
+from dataclasses import dataclass
+import re
+from typing import List, Optional
+
+import numpy as np
+
+_WINDOW_PATTERN = re.compile(r'^\s*(?P<name>[^:]+?)\s*:\s*(?P<start>\d+)\s*-\s*(?P<stop>\d+)'
+                             r'(\s+(?P<bg_start>\d+)\s*-\s*(?P<bg_stop>\d+))?\s*$')
+
+
+@dataclass(frozen=True)
+class EnergyWindow:
+    """ Channels start to stop (excluded), background channels bg_start to bg_stop (excluded) if given """
+    name: str
+    start: int
+    stop: int
+    bg_start: Optional[int] = None
+    bg_stop: Optional[int] = None
+
+    @property
+    def has_background(self):
+        return self.bg_start is not None
+
+
+def parse_energy_windows(text: str, nchannels: int) -> List[EnergyWindow]:
+    """ Windows from a text with one window per line as name: start-stop [bg_start-bg_stop]
+
+    Raises
+    ------
+    ValueError: if a line is not valid or a window is empty or outside the nchannels channels
+    """
+    windows = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        match = _WINDOW_PATTERN.match(line)
+        if match is None:
+            raise ValueError(f'Invalid energy window "{line}", expected name: start-stop [bg_start-bg_stop]')
+        bounds = [None if match[key] is None else int(match[key]) for key in ('start', 'stop', 'bg_start', 'bg_stop')]
+        window = EnergyWindow(match['name'], *bounds)
+        for start, stop in ((window.start, window.stop), (window.bg_start, window.bg_stop)):
+            if start is not None and not 0 <= start < stop <= nchannels:
+                raise ValueError(f'Invalid channels {start}-{stop} of energy window "{window.name}", '
+                                 f'the spectra have {nchannels} channels')
+        windows.append(window)
+    return windows
+
+
+class EnergyWindowMaps:
+    """ One map of shape map_shape per energy window, filled spectrum after spectrum in the order of the flat map """
+
+    def __init__(self, windows: List[EnergyWindow], map_shape, nchannels):
+        self.windows = windows
+        self.maps = np.zeros((len(windows),) + tuple(map_shape), dtype=np.float32)
+        bounds = {0, nchannels}
+        for window in windows:
+            bounds.update(bound for bound in (window.start, window.stop, window.bg_start, window.bg_stop)
+                          if bound is not None)
+        self._bounds = sorted(bounds)  # the channels are summed once between consecutive bounds
+        self._position = {bound: ind for ind, bound in enumerate(self._bounds)}
+
+    def clear(self):
+        self.maps.fill(0)
+
+    def update(self, spectra: np.ndarray, first: int) -> np.ndarray:
+        """ Set the pixels first to first + n of the maps from the (nchannels, n) spectra
+
+        Returns
+        -------
+        np.ndarray: the total intensity of the n spectra
+        """
+        segments = [spectra[start:stop].sum(axis=0, dtype=np.float64)
+                    for start, stop in zip(self._bounds[:-1], self._bounds[1:])]
+        cumsum = np.zeros((len(self._bounds), spectra.shape[1]), dtype=np.float64)
+        np.cumsum(segments, axis=0, out=cumsum[1:])
+        last = first + spectra.shape[1]
+        for window, data_map in zip(self.windows, self.maps):
+            signal = cumsum[self._position[window.stop]] - cumsum[self._position[window.start]]
+            if window.has_background:
+                background = cumsum[self._position[window.bg_stop]] - cumsum[self._position[window.bg_start]]
+                signal -= background * ((window.stop - window.start) / (window.bg_stop - window.bg_start))
+            data_map.flat[first:last] = signal
+        return cumsum[-1]
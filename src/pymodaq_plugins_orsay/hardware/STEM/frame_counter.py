@@ -0,0 +1,59 @@
+"""
+Sequence numbers, acquisition times and loss accounting of the frames given by the dll callbacks.
+
+The callbacks stamp each frame (or spectrum) with a sequence number and a time.perf_counter() timestamp taken in the
+dll thread. When the hardware numbers its frames (imagenb of the Scan.dll unlockers, current spectrum of a SPIM) the
+gaps are counted as skipped frames, and frames emitted more than late_delay after their acquisition are counted as
+late: both tell from the data itself when the processing fell behind the hardware.
+"""
+from dataclasses import dataclass
+import time
+
+
+@dataclass(frozen=True)
+class FrameStamp:
+    sequence: int  # 1 for the first frame of the acquisition
+    timestamp: float  # time.perf_counter() in the dll callback
+
+
+class FrameCounter:
+    """ Count the frames of an acquisition, record is called from the dll thread and emitted from the emitting one
+
+    Parameters
+    ----------
+    late_delay: float
+        delay (s) between the acquisition and the emission of a frame above which it is counted as late
+    """
+
+    def __init__(self, late_delay=0.5):
+        self.late_delay = late_delay
+        self.sequence = 0
+        self.skipped = 0
+        self.late = 0
+        self._last_number = None
+
+    def reset(self):
+        self.sequence = 0
+        self.skipped = 0
+        self.late = 0
+        self._last_number = None
+
+    def record(self, number=None) -> FrameStamp:
+        """ Count a new frame, number being its hardware number if any """
+        if number is not None:
+            if self._last_number is not None and number > self._last_number + 1:
+                self.skipped += number - self._last_number - 1
+            self._last_number = number
+        self.sequence += 1
+        return FrameStamp(self.sequence, time.perf_counter())
+
+    def partial(self) -> FrameStamp:
+        """ Stamp of a partial update of the frame being acquired, not counted """
+        return FrameStamp(self.sequence + 1, time.perf_counter())
+
+    def emitted(self, stamp: FrameStamp) -> float:
+        """ To be called when the frame of the given stamp is emitted, returns the delay since its acquisition """
+        delay = time.perf_counter() - stamp.timestamp
+        if delay > self.late_delay:
+            self.late += 1
+        return delay
@@ -0,0 +1,99 @@
+"""
+Preallocated ring of frame buffers handed to the Scan.dll locker callbacks.
+
+The dll calls the locker before writing each band of lines and the unlocker once the band is written. With a single
+buffer, the next frame overwrites the one that is still being processed or displayed. The FrameRing keeps the same
+slot for all the bands of a frame, publishes it when the frame is complete, and moves to the next free slot for the
+following frame, so that a published frame stays untouched while the next ones are acquired.
+"""
+import threading
+
+import numpy as np
+
+
+class FrameRing:
+    """ Ring of nslots preallocated buffers of the given shape and dtype
+
+    Slots are used round robin. A published slot is never handed out again before a newer frame has been published,
+    and slots held by a consumer (see hold/release) are skipped as long as another slot is available.
+    """
+
+    def __init__(self, nslots, shape, dtype=np.int16):
+        if nslots < 2:
+            raise ValueError('A frame ring needs at least two slots')
+        self.buffers = np.zeros((nslots,) + tuple(shape), dtype=dtype)
+        self._addresses = [self.buffers[ind].ctypes.data for ind in range(nslots)]
+        self._lock = threading.Lock()
+        self._filling = 0
+        self._in_frame = False
+        self._published = None
+        self._held = set()
+        self.published_count = 0
+        self.overruns = 0  # number of times a held slot had to be reused
+
+    @property
+    def nslots(self):
+        return self.buffers.shape[0]
+
+    def acquire(self):
+        """ Address of the slot to be filled, to be returned by the locker callback
+
+        All the calls made before the frame is published return the same slot.
+        """
+        with self._lock:
+            if not self._in_frame:
+                self._filling = self._next_slot()
+                self._in_frame = True
+            return self._addresses[self._filling]
+
+    def _next_slot(self):
+        candidates = [(self._filling + ind) % self.nslots for ind in range(1, self.nslots + 1)]
+        candidates = [ind for ind in candidates if ind != self._published]
+        for ind in candidates:
+            if ind not in self._held:
+                return ind
+        self.overruns += 1
+        self._held.discard(candidates[0])
+        return candidates[0]
+
+    def publish(self):
+        """ Mark the slot being filled as the latest complete frame, the next acquire moves to another slot
+
+        Returns
+        -------
+        int: the index of the published slot
+        """
+        with self._lock:
+            self._published = self._filling
+            self._in_frame = False
+            self.published_count += 1
+            return self._published
+
+    @property
+    def filling(self):
+        """ Index of the slot being filled (or of the last filled one if no frame is in progress) """
+        return self._filling
+
+    def current(self):
+        """ Buffer being filled (or the last filled one if no frame is in progress) """
+        return self.buffers[self._filling]
+
+    def latest(self):
+        """ Buffer of the last published frame or None if no frame has been published yet """
+        published = self._published
+        return None if published is None else self.buffers[published]
+
+    def hold(self, index):
+        """ Prevent the slot from being reused while it is processed """
+        with self._lock:
+            self._held.add(index)
+
+    def release(self, index):
+        with self._lock:
+            self._held.discard(index)
+
+    def reset(self):
+        """ Forget any frame in progress (e.g. cancelled scan) and any hold, to be called before a new acquisition """
+        with self._lock:
+            self._in_frame = False
+            self._held.clear()
@@ -0,0 +1,224 @@
+"""
+Opt-in timing of the Scan.dll and Cameras.dll calls and of the locker/unlocker callbacks.
+
+When enabled, the functions built by _buildFunction in orsayscan and orsaycamera are replaced in their module by timed
+wrappers and restored when disabled, so that the dll calls cost nothing more while the instrumentation is off. The
+Scan.dll timings include the time waited for the other calls of the same handle, see scan_executor. The callbacks are
+wrapped once with timed_callback when their ctypes function object is created: while disabled the wrapper only checks a
+flag before calling the plugin method.
+
+The statistics are shared by all the plugins of the process (the dll functions are module level), they are given as a
+dictionary by to_dict, dumped to a JSON file by dump and summarized as text by summary. The plugins expose them with the
+instrumentation_params group below, handled by commit_instrumentation_settings.
+"""
+from datetime import datetime
+import json
+from pathlib import Path
+import threading
+import time
+
+instrumentation_params = [
+    {'title': 'Instrumentation:', 'name': 'instrumentation', 'type': 'group', 'expanded': False, 'children': [
+        {'title': 'Enabled:', 'name': 'instrumentation_enabled', 'type': 'bool', 'value': False,
+         'tip': 'Time the dll calls and the callbacks of all the Orsay plugins'},
+        {'title': 'Refresh:', 'name': 'instrumentation_refresh', 'type': 'bool_push', 'value': False},
+        {'title': 'Reset:', 'name': 'instrumentation_reset', 'type': 'bool_push', 'value': False},
+        {'title': 'Statistics:', 'name': 'instrumentation_stats', 'type': 'text', 'value': '', 'readonly': True},
+        {'title': 'JSON file:', 'name': 'instrumentation_file', 'type': 'browsepath', 'filetype': True, 'value': '',
+         'tip': 'File written by Dump, a dated file of the home folder if empty'},
+        {'title': 'Dump:', 'name': 'instrumentation_dump', 'type': 'bool_push', 'value': False},
+    ]},
+]
+
+NBINS = 32  # bin 0: below 1 µs, bin k: from 2**(k-1) to 2**k µs, the last one collects everything above
+
+
+class LatencyHistogram:
+    """ Count, extrema and log2 histogram of durations given in seconds """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self.min = float('inf')
+        self.max = 0.
+        self.bins = [0] * NBINS
+
+    def record(self, duration):
+        self.count += 1
+        self.total += duration
+        if duration < self.min:
+            self.min = duration
+        if duration > self.max:
+            self.max = duration
+        self.bins[min(int(duration * 1e6).bit_length(), NBINS - 1)] += 1
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.
+
+    def percentile(self, percent) -> float:
+        """ Upper edge (s) of the bin containing the given percentile, bounded by the maximum """
+        threshold = self.count * percent / 100
+        cumulated = 0
+        for ind, count in enumerate(self.bins):
+            cumulated += count
+            if count and cumulated >= threshold:
+                return min(2 ** ind * 1e-6, self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return dict(count=self.count, total_s=self.total, mean_us=self.mean * 1e6,
+                    min_us=self.min * 1e6 if self.count else 0., max_us=self.max * 1e6,
+                    p50_us=self.percentile(50) * 1e6, p99_us=self.percentile(99) * 1e6,
+                    histogram=dict(upper_edges_us=[2 ** ind for ind in range(NBINS - 1)] + [None],
+                                   counts=list(self.bins)))
+
+
+class CallbackStatistics:
+    """ Durations of the calls of a callback and gaps between the end of a call and the start of the next one """
+
+    def __init__(self):
+        self.durations = LatencyHistogram()
+        self.gaps = LatencyHistogram()
+        self.last_end: float = None
+
+    def record(self, start, end):
+        self.durations.record(end - start)
+        if self.last_end is not None:
+            self.gaps.record(start - self.last_end)
+        self.last_end = end
+
+    def to_dict(self) -> dict:
+        return dict(duration=self.durations.to_dict(), gap=self.gaps.to_dict())
+
+
+class Instrumentation:
+    """ Timing of the dll functions and callbacks, use the module level instrumentation object """
+
+    def __init__(self):
+        self.enabled = False
+        self.calls = dict()  # name of the dll function: LatencyHistogram
+        self.callbacks = dict()  # name of the callback: CallbackStatistics
+        self._lock = threading.Lock()
+        self._namespaces = []  # (module globals, prefix of the dll functions)
+        self._originals = dict()  # (id of the module globals, name): dll function
+
+    def register_functions(self, namespace: dict, prefix: str):
+        """ Declare the functions of namespace (a module globals()) starting with prefix as dll functions to time """
+        with self._lock:
+            self._namespaces.append((namespace, prefix))
+            if self.enabled:
+                self._wrap_functions(namespace, prefix)
+
+    def set_enabled(self, enabled: bool):
+        with self._lock:
+            if enabled == self.enabled:
+                return
+            self.enabled = enabled
+            for namespace, prefix in self._namespaces:
+                if enabled:
+                    self._wrap_functions(namespace, prefix)
+                else:
+                    self._restore_functions(namespace, prefix)
+
+    def _wrap_functions(self, namespace, prefix):
+        for name, function in list(namespace.items()):
+            if name.startswith(prefix) and callable(function):
+                self._originals[(id(namespace), name)] = function
+                namespace[name] = self._timed_call(name.lstrip('_'), function)
+
+    def _restore_functions(self, namespace, prefix):
+        for name in list(namespace):
+            if name.startswith(prefix):
+                function = self._originals.pop((id(namespace), name), None)
+                if function is not None:
+                    namespace[name] = function
+
+    def _timed_call(self, name, function):
+        def timed(*args):
+            start = time.perf_counter()
+            try:
+                return function(*args)
+            finally:
+                duration = time.perf_counter() - start
+                with self._lock:
+                    histogram = self.calls.get(name, None)
+                    if histogram is None:
+                        histogram = self.calls[name] = LatencyHistogram()
+                    histogram.record(duration)
+        timed.__wrapped__ = function
+        return timed
+
+    def timed_callback(self, name, function):
+        """ Wrap a callback before building its ctypes function object, e.g. LOCKERFUNC(timed_callback(...)) """
+        def callback(*args):
+            if not self.enabled:
+                return function(*args)
+            start = time.perf_counter()
+            try:
+                return function(*args)
+            finally:
+                end = time.perf_counter()
+                with self._lock:
+                    statistics = self.callbacks.get(name, None)
+                    if statistics is None:
+                        statistics = self.callbacks[name] = CallbackStatistics()
+                    statistics.record(start, end)
+        callback.__wrapped__ = function
+        return callback
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.callbacks.clear()
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return dict(enabled=self.enabled, date=datetime.now().isoformat(),
+                        calls={name: histogram.to_dict() for name, histogram in sorted(self.calls.items())},
+                        callbacks={name: statistics.to_dict()
+                                   for name, statistics in sorted(self.callbacks.items())})
+
+    def dump(self, path):
+        """ Save to_dict as a JSON file """
+        with open(path, 'w') as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+    def summary(self) -> str:
+        """ One line per dll function and per callback, the slowest (in total time) first """
+        with self._lock:
+            lines = [f'{name}: {histogram.count} calls, mean {histogram.mean * 1e6:.1f} µs, '
+                     f'p99 {histogram.percentile(99) * 1e6:.1f} µs, max {histogram.max * 1e6:.1f} µs'
+                     for name, histogram in sorted(self.calls.items(), key=lambda item: -item[1].total)]
+            lines += [f'{name}: {statistics.durations.count} callbacks, mean {statistics.durations.mean * 1e6:.1f} µs, '
+                      f'max {statistics.durations.max * 1e6:.1f} µs, mean gap {statistics.gaps.mean * 1e3:.2f} ms, '
+                      f'max gap {statistics.gaps.max * 1e3:.2f} ms'
+                      for name, statistics in sorted(self.callbacks.items(),
+                                                     key=lambda item: -item[1].durations.total)]
+        return '\n'.join(lines)
+
+
+instrumentation = Instrumentation()
+
+
+def commit_instrumentation_settings(param):
+    """ Apply the change of a child of the instrumentation_params group, called from the plugins commit_settings """
+    group = param.parent()
+    if param.name() == 'instrumentation_enabled':
+        instrumentation.set_enabled(param.value())
+    elif param.name() == 'instrumentation_reset':
+        if param.value():
+            instrumentation.reset()
+            group.child('instrumentation_stats').setValue('')
+            param.setValue(False)
+    elif param.name() == 'instrumentation_refresh':
+        if param.value():
+            group.child('instrumentation_stats').setValue(instrumentation.summary())
+            param.setValue(False)
+    elif param.name() == 'instrumentation_dump':
+        if param.value():
+            path = group['instrumentation_file'] or \
+                Path.home().joinpath(f"orsay_instrumentation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+            instrumentation.dump(path)
+            group.child('instrumentation_stats').setValue(f'{instrumentation.summary()}\nSaved in {path}')
+            param.setValue(False)
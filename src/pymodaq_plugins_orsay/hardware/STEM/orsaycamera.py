@@ -3,9 +3,16 @@ Class controlling orsay scan hardware.
 """
 import sys
 from ctypes import cdll, create_string_buffer, POINTER, byref
-from ctypes import c_uint, c_int, c_char, c_char_p, c_void_p, c_short, c_long, c_bool, c_double, c_uint64, c_uint32, Array, CFUNCTYPE, WINFUNCTYPE
+from ctypes import c_uint, c_int, c_char, c_char_p, c_void_p, c_short, c_long, c_bool, c_double, c_uint64, c_uint32, Array, CFUNCTYPE
 from ctypes import c_ushort, c_ulong, c_float
 import os
+import threading
+from .instrumentation import instrumentation
+from .state_cache import StateCache
+try:
+    from ctypes import WINFUNCTYPE
+except ImportError:  # not on windows, only the simulated library can be used
+    WINFUNCTYPE = CFUNCTYPE
 
 __author__  = "Marcel Tence"
 __status__  = "alpha"
@@ -34,160 +41,205 @@ def _toString23(string):
         return string.encode("utf-8")
     return string
 
-# library must be in the same folder as this file.
-if (sys.maxsize > 2**32):
-    libname = os.path.dirname(__file__)
-    libname = os.path.join(libname, "Cameras.dll")
-    _library = cdll.LoadLibrary(libname)
-    #print(f"OrsayCamera library: {_library}")
-else:
-    raise Exception("It must a python 64 bit version")
+def _loadLibrary():
+    """
+    Load Cameras.dll, or its pure python simulation (orsaycamera_simulator) when the ORSAY_CAMERA_BACKEND
+    environment variable is set to "simulator". The simulation is the default outside windows.
+    With ORSAY_CAMERA_BACKEND set to "replay", the simulation plays the callbacks recorded in the
+    ORSAY_CAMERA_REPLAY file, see callback_recording.
+    """
+    backend = os.environ.get("ORSAY_CAMERA_BACKEND", "dll" if sys.platform == "win32" else "simulator")
+    if backend == "simulator":
+        from . import orsaycamera_simulator
+        return orsaycamera_simulator
+    if backend == "replay":
+        from .callback_recording import camera_replay_library
+        return camera_replay_library(os.environ["ORSAY_CAMERA_REPLAY"])
+    # library must be in the same folder as this file.
+    if (sys.maxsize > 2**32):
+        libname = os.path.dirname(__file__)
+        libname = os.path.join(libname, "Cameras.dll")
+        return cdll.LoadLibrary(libname)
+        #print(f"OrsayCamera library: {_library}")
+    else:
+        raise Exception("It must a python 64 bit version")
+
+_library = None
+_libraryLock = threading.Lock()
 
 LOGGERFUNC = WINFUNCTYPE(None, c_char_p, c_bool)
-#	void CAMERAS_EXPORT *OrsayCamerasInit(int manufacturer, const char *model, void(*logger)(const char *buf, bool debug), bool simul);
-_OrsayCameraInit = _buildFunction(_library.OrsayCamerasInit, [c_int, c_char_p, c_char_p, LOGGERFUNC, c_bool], c_void_p)
-#void CAMERAS_EXPORT OrsayCamerasClose(void* o);
-_OrsayCameraClose = _buildFunction(_library.OrsayCamerasClose, [c_void_p], None)
-#_OrsayCamera = _buildFunction(_library., [c_void_p, ], )
-
-#void CAMERAS_EXPORT RegisterLogger(void *o, void(*logger)(const char *, bool));
-_OrsayCameraRegisterLogger = _buildFunction(_library.RegisterLogger, [c_void_p, LOGGERFUNC], None)
-#void CAMERAS_EXPORT RegisterDataLocker(void * o, void *(*LockDataPointer)(int cam,  int *datatype, int *sx, int *sy, int *sz));
 DATALOCKFUNC = WINFUNCTYPE(c_void_p, c_int, POINTER(c_int), POINTER(c_int), POINTER(c_int), POINTER(c_int))
-_OrsayCameraRegisterDataLocker = _buildFunction(_library.RegisterDataLocker, [c_void_p, DATALOCKFUNC], None)
-#void CAMERAS_EXPORT RegisterDataUnlocker(void *o, void(*UnLockDataPointer)(int cam, bool newdata));
 DATAUNLOCKFUNC = WINFUNCTYPE(None, c_int, c_bool)
-_OrsayCameraRegisterDataUnlocker = _buildFunction(_library.RegisterDataUnlocker, [c_void_p, DATAUNLOCKFUNC], None)
-#void CAMERAS_EXPORT RegisterSpimDataLocker(void *o, void(*LockSpimDataPointer)(int cam, int *datatype, int *sx, int *sy, int *sz));
 SPIMLOCKFUNC = WINFUNCTYPE(c_void_p, c_int, POINTER(c_int), POINTER(c_int), POINTER(c_int), POINTER(c_int))
-_OrsayCameraRegisterSpimDataLocker = _buildFunction(_library.RegisterSpimDataLocker, [c_void_p, SPIMLOCKFUNC], None)
-#void CAMERAS_EXPORT RegisterSpimDataUnlocker(void *o, void *(*UnLockSpimDataPointer)(int cam, bool newdata, bool running));
 SPIMUNLOCKFUNC = WINFUNCTYPE(None, c_int, c_bool, c_bool)
-_OrsayCameraRegisterSpimDataUnlocker = _buildFunction(_library.RegisterSpimDataUnlocker, [c_void_p, SPIMUNLOCKFUNC], None)
-#//void ** (*LockOnlineSpimDataPointer)(void *o, short cam, short *datatype, short *sx, short *sy, short *sz);
-#//void(*UnLockOnlineSpimDataPointer)(void *o, int cam, bool newdata, bool running);
-#void CAMERAS_EXPORT RegisterSpectrumDataLocker(void *o, void *(*LockSpectrumDataPointer)(int cam, int *datatype, int *sx));
 SPECTLOCKFUNC = WINFUNCTYPE(c_void_p, c_int, POINTER(c_int), POINTER(c_int))
-_OrsayCameraRegisterSpectrumDataLocker = _buildFunction(_library.RegisterSpectrumDataLocker, [c_void_p, SPECTLOCKFUNC], None)
-#void CAMERAS_EXPORT RegisterSpectrumDataUnlocker(void *o, void(*UnLockSpectrumDataPointer)(int cam, bool newdata));
 SPECTUNLOCKFUNC = WINFUNCTYPE(None, c_int, c_bool)
-_OrsayCameraRegisterSpectrumDataUnlocker = _buildFunction(_library.RegisterSpectrumDataUnlocker, [c_void_p, SPECTUNLOCKFUNC], None)
-#void CAMERAS_EXPORT RegisterSpimUpdateInfo(void *o, void(*UpdateSpimInfo)(unsigned long currentspectrum, bool running));
 SPIMUPDATEFUNC = WINFUNCTYPE(None, c_int, c_bool)
-_OrsayCameraRegisterSpimUpdateLocker = _buildFunction(_library.RegisterSpimUpdateInfo, [c_void_p, SPIMUPDATEFUNC], None)
-
-#bool CAMERAS_EXPORT init_data_structures(void *o);
-_OrsayCameraInit_data_structures = _buildFunction(_library.init_data_structures, [c_void_p], c_bool)
-
-#void CAMERAS_EXPORT GetCCDSize(void *o, long *sx, long *sy);
-_OrsayCameraGetCCDSize = _buildFunction(_library.GetCCDSize, [c_void_p, POINTER(c_long), POINTER(c_long)], None)
-#void CAMERAS_EXPORT GetImageSize(void *o, long *sx, long *sy);
-_OrsayCameraGetImageSize = _buildFunction(_library.GetImageSize, [c_void_p, ], None)
-
-#//myrgn_type GetArea(void *o, );
-#//bool CAMERAS_EXPORT SetCameraArea(void *o, short top, short left, short bottom, short right);
-_OrsayCameraSetArea = _buildFunction(_library.SetCameraArea, [c_void_p, c_short, c_short, c_short, c_short], c_bool)
-#bool CAMERAS_EXPORT GetCameraArea(void *o, short *top, short *left, short *bottom, short *right);#void CAMERAS_EXPORT SetCCDOverscan(void *o, int x, int y);
-_OrsayCameraGetArea = _buildFunction(_library.GetCameraArea, [c_void_p, POINTER(c_short), POINTER(c_short), POINTER(c_short), POINTER(c_short)], c_bool)
-#void CAMERAS_EXPORT SetCCDOverscan(void *o, int x, int y);
-_OrsayCameraSetCCDOverscan = _buildFunction(_library.SetCCDOverscan, [c_void_p, c_int, c_int], None)
-#void CAMERAS_EXPORT DisplayOverscan(void *o, bool on);
-_OrsayCameraDisplayOverscan = _buildFunction(_library.DisplayOverscan, [c_void_p, c_bool], None)
-#void CAMERAS_EXPORT GetBinning(void *o, unsigned short *bx, unsigned short *by);
-_OrsayCameraGetBinning = _buildFunction(_library.GetBinning, [c_void_p, POINTER(c_ushort), POINTER(c_ushort)], None)
-#bool CAMERAS_EXPORT SetBinning(void *o, unsigned short bx, unsigned short by, bool estimatedark = true);
-_OrsayCameraSetBinning = _buildFunction(_library.SetBinning, [c_void_p, c_ushort, c_ushort, c_bool], c_bool)
-#void CAMERAS_EXPORT SetMirror(void *o, bool On);
-_OrsayCameraSetMirror = _buildFunction(_library.SetMirror, [c_void_p, c_bool], None)
-#void CAMERAS_EXPORT SetNbCumul(void *o, long n);
-_OrsayCameraSetNbCumul = _buildFunction(_library.SetNbCumul, [c_void_p, c_long], None)
-#long CAMERAS_EXPORT GetNbCumul(void *o);
-_OrsayCameraGetNbCumul = _buildFunction(_library.GetNbCumul, [c_void_p], c_long)
-#void CAMERAS_EXPORT SetSpimMode(void *o, unsigned short mode);
-_OrsayCameraSetSpimMode = _buildFunction(_library.SetSpimMode, [c_void_p, c_ushort], None)
-#bool CAMERAS_EXPORT StartSpim(void *o, unsigned long nbSpectra, unsigned long nbsp, float pose, bool saveK);
-_OrsayCameraStartSpim = _buildFunction(_library.StartSpim, [c_void_p, c_ulong, c_ulong, c_float, c_bool], c_bool)
-#bool CAMERAS_EXPORT ResumeSpim(void *o, int mode);
-_OrsayCameraResumeSpim = _buildFunction(_library.ResumeSpim, [c_void_p, c_int], c_bool)
-#bool CAMERAS_EXPORT PauseSpim(void *o);
-_OrsayCameraPauseSpim = _buildFunction(_library.PauseSpim, [c_void_p], c_bool)
-#bool CAMERAS_EXPORT StopSpim(void *o, bool endofline = false);
-_OrsayCameraStopSpim = _buildFunction(_library.StopSpim, [c_void_p, c_bool], c_bool)
-
-#void CAMERAS_EXPORT DisplayCCDInfos(void *o, char *filter);
-_OrsayCameraDisplayCCDInfos = _buildFunction(_library.DisplayCCDInfos, [c_void_p, c_char_p], None)
-#bool CAMERAS_EXPORT isCameraThere(void *o);
-_OrsayCameraIsCameraThere = _buildFunction(_library.isCameraThere, [c_void_p], c_bool)
-#bool CAMERAS_EXPORT GetTemperature(void *o, float *temperature, bool *status);
-_OrsayCameraGetTemperature = _buildFunction(_library.GetCameraTemperature, [c_void_p, POINTER(c_float), POINTER(c_bool)], c_bool)
-#bool CAMERAS_EXPORT SetTemperature(void *o, float temperature);
-_OrsayCameraSetTemperature = _buildFunction(_library.SetCameraTemperature, [c_void_p, c_float], c_bool)
-#bool CAMERAS_EXPORT SetupBinning(void *o);
-_OrsayCameraSetupBinning = _buildFunction(_library.SetupBinning, [c_void_p], c_bool)
-#bool CAMERAS_EXPORT StartFocus(void *o, float pose, short display, short accumulate);
-_OrsayCameraStartFocus = _buildFunction(_library.StartFocus, [c_void_p, c_float, c_short, c_short], c_bool)
-#bool CAMERAS_EXPORT StopFocus(void *o);
-_OrsayCameraStopFocus = _buildFunction(_library.StopFocus, [c_void_p],c_bool )
-#bool CAMERAS_EXPORT SetCameraExposureTime(void *o, double pose);
-_OrsayCameraSetExposureTime = _buildFunction(_library.SetCameraExposureTime, [c_void_p, c_double], c_bool)
-#bool CAMERAS_EXPORT StartDarkCalibration(void *o, long numofimages);
-#_OrsayCameraStartDarkCalibration = _buildFunction(_library.StartDarkCalibration, [c_void_p, c_long], c_bool)
-#long CAMERAS_EXPORT GetNumOfSpeed(void *o, short p);
-_OrsayCameraGetNumOfSpeed = _buildFunction(_library.GetNumOfSpeed, [c_void_p, c_int], c_long)
-#long CAMERAS_EXPORT GetCurrentSpeed(void *o, short p);
-_OrsayCameraGetCurrentSpeed = _buildFunction(_library.GetCurrentSpeed, [c_void_p, c_short], c_long)
-#long CAMERAS_EXPORT SetSpeed(void *o, short p, long n);
-_OrsayCameraSetSpeed = _buildFunction(_library.SetSpeed, [c_void_p, c_short, c_long], c_long)
-#int CAMERAS_EXPORT GetNumOfGains(void *o, int p);
-_OrsayCameraGetNumOfGains = _buildFunction(_library.GetNumOfGains, [c_void_p, c_int], c_int)
-#const char CAMERAS_EXPORT *GetGainName(void *o, int p, int g);
-_OrsayCameraGetGainName = _buildFunction(_library.GetGainName, [c_void_p, c_int, c_int], c_char_p)
-#bool CAMERAS_EXPORT SetGain(void *o, short newgain);
-_OrsayCameraSetGain = _buildFunction(_library.SetGain, [c_void_p, c_short], c_bool)
-#short CAMERAS_EXPORT GetGain(void *o);
-_OrsayCameraGetGain = _buildFunction(_library.GetGain, [c_void_p], c_short)
-#double CAMERAS_EXPORT GetReadOutTime(void *o);
-_OrsayCameraGetReadOutTime = _buildFunction(_library.GetReadOutTime, [c_void_p], c_double)
-#long CAMERAS_EXPORT GetNumOfPorts(void *o);
-_OrsayCameraGetNumOfPorts = _buildFunction(_library.GetNumOfPorts, [c_void_p], c_long)
-#const char CAMERAS_EXPORT *GetPortName(void *o, long nb);
-_OrsayCameraGetPortName = _buildFunction(_library.GetPortName, [c_void_p, c_long], c_char_p)
-#long CAMERAS_EXPORT GetCurrentPort(void *o);
-_OrsayCameraGetCurrentPort = _buildFunction(_library.GetCurrentPort, [c_void_p], c_long)
-#bool CAMERAS_EXPORT SetCameraPort(void *o, long n);
-_OrsayCameraSetCameraPort = _buildFunction(_library.SetCameraPort, [c_void_p, c_long], c_bool)
-#unsigned short CAMERAS_EXPORT GetMultiplication(void *o, unsigned short *pmin, unsigned short *pmax);
-_OrsayCameraGetMultiplication = _buildFunction(_library.GetMultiplication, [c_void_p, POINTER(c_ushort), POINTER(c_ushort)], c_ushort)
-#void CAMERAS_EXPORT SetMultiplication(void *o, unsigned short mult);
-_OrsayCameraSetMultiplication = _buildFunction(_library.SetMultiplication, [c_void_p, c_ushort], None)
-#void CAMERAS_EXPORT getCCDStatus(void *o, short *mode, double *p1, double *p2, double *p3, double *p4);
-_OrsayCameragetCCDStatus = _buildFunction(_library.getCCDStatus, [c_void_p, POINTER(c_short), POINTER(c_double), POINTER(c_double), POINTER(c_double), POINTER(c_double)], None)
-#double CAMERAS_EXPORT GetReadoutSpeed(void *o);
-_OrsayCameraGetReadoutSpeed = _buildFunction(_library.GetReadoutSpeed, [c_void_p], c_double)
-#long CAMERAS_EXPORT GetPixelTime(void *o, short p, short v);
-_OrsayCameraGetPixelTime = _buildFunction(_library.GetPixelTime, [c_void_p, c_short, c_short], c_long)
-#void CAMERAS_EXPORT AdjustOverscan(void *o, int sx, int sy);
-_OrsayCameraAdjustOverscan = _buildFunction(_library.AdjustOverscan, [c_void_p, c_int, c_int], None)
-#void CAMERAS_EXPORT SetTurboMode(void *o, int active, short horizontalsize, short verticalsize);
-_OrsayCameraSetTurboMode = _buildFunction(_library.SetTurboMode, [c_void_p, c_short, c_short, c_short], None)
-#int CAMERAS_EXPORT GetTurboMode(void *o, short *horizontalsize, short *verticalsize);
-_OrsayCameraGetTurboMode = _buildFunction(_library.GetTurboMode, [c_void_p, POINTER(c_short), POINTER(c_short)], c_int)
-#bool CAMERAS_EXPORT SetExposureMode(void *o, short mode, short edge);
-_OrsayCameraSetExposureMode = _buildFunction(_library.SetExposureMode, [c_void_p, c_short, c_short], c_bool)
-#short CAMERAS_EXPORT GetExposureMode(void *o, short *edge);
-_OrsayCameraGetExposureMode = _buildFunction(_library.GetExposureMode, [c_void_p, POINTER(c_short)], c_short)
-#bool CAMERAS_EXPORT SetPulseMode(void *o, short mode);
-_OrsayCameraSetPulseMode = _buildFunction(_library.SetPulseMode, [c_void_p, c_int], c_bool)
-#bool CAMERAS_EXPORT SetVerticalShift(void *o, double shift, int clear);
-_OrsayCameraSetVerticalShift = _buildFunction(_library.SetVerticalShift, [c_void_p, c_double, c_int], c_bool)
-#bool CAMERAS_EXPORT SetFan(void *o, bool OnOff);
-_OrsayCameraSetFan = _buildFunction(_library.SetFan, [c_void_p, c_bool], c_bool)
-#bool CAMERAS_EXPORT GetFan(void *o);
-_OrsayCameraGetFan = _buildFunction(_library.GetFan, [c_void_p], c_bool)
-#	void CAMERAS_EXPORT SetVideoThreshold(void *o, unsigned short th);
-_OrsayCameraSetVideoThreshold = _buildFunction(_library.SetVideoThreshold, [c_void_p, c_ushort], None)
-#	unsigned short CAMERAS_EXPORT GetVideoThreshold(void *o);
-_OrsayCameraGetVideoThreshold = _buildFunction(_library.GetVideoThreshold, [c_void_p], c_ushort)
+
+
+def _initLibrary():
+    """
+    Load the library and build the function prototypes. Called on first orsayCamera construction so that
+    importing this module (e.g. during pymodaq plugin discovery) neither requires nor loads Cameras.dll.
+    """
+    global _library
+    with _libraryLock:
+        if _library is not None:
+            return
+        library = _loadLibrary()
+        if os.environ.get("ORSAY_CAMERA_RECORD", ""):  # record the callbacks, see callback_recording
+            from .callback_recording import RecordingLibrary, CAMERA
+            library = RecordingLibrary(library, CAMERA, os.environ["ORSAY_CAMERA_RECORD"])
+
+        #	void CAMERAS_EXPORT *OrsayCamerasInit(int manufacturer, const char *model, void(*logger)(const char *buf, bool debug), bool simul);
+        _OrsayCameraInit = _buildFunction(library.OrsayCamerasInit, [c_int, c_char_p, c_char_p, LOGGERFUNC, c_bool], c_void_p)
+        #void CAMERAS_EXPORT OrsayCamerasClose(void* o);
+        _OrsayCameraClose = _buildFunction(library.OrsayCamerasClose, [c_void_p], None)
+        #_OrsayCamera = _buildFunction(library., [c_void_p, ], )
+
+        #void CAMERAS_EXPORT RegisterLogger(void *o, void(*logger)(const char *, bool));
+        _OrsayCameraRegisterLogger = _buildFunction(library.RegisterLogger, [c_void_p, LOGGERFUNC], None)
+        #void CAMERAS_EXPORT RegisterDataLocker(void * o, void *(*LockDataPointer)(int cam,  int *datatype, int *sx, int *sy, int *sz));
+        _OrsayCameraRegisterDataLocker = _buildFunction(library.RegisterDataLocker, [c_void_p, DATALOCKFUNC], None)
+        #void CAMERAS_EXPORT RegisterDataUnlocker(void *o, void(*UnLockDataPointer)(int cam, bool newdata));
+        _OrsayCameraRegisterDataUnlocker = _buildFunction(library.RegisterDataUnlocker, [c_void_p, DATAUNLOCKFUNC], None)
+        #void CAMERAS_EXPORT RegisterSpimDataLocker(void *o, void(*LockSpimDataPointer)(int cam, int *datatype, int *sx, int *sy, int *sz));
+        _OrsayCameraRegisterSpimDataLocker = _buildFunction(library.RegisterSpimDataLocker, [c_void_p, SPIMLOCKFUNC], None)
+        #void CAMERAS_EXPORT RegisterSpimDataUnlocker(void *o, void *(*UnLockSpimDataPointer)(int cam, bool newdata, bool running));
+        _OrsayCameraRegisterSpimDataUnlocker = _buildFunction(library.RegisterSpimDataUnlocker, [c_void_p, SPIMUNLOCKFUNC], None)
+        #//void ** (*LockOnlineSpimDataPointer)(void *o, short cam, short *datatype, short *sx, short *sy, short *sz);
+        #//void(*UnLockOnlineSpimDataPointer)(void *o, int cam, bool newdata, bool running);
+        #void CAMERAS_EXPORT RegisterSpectrumDataLocker(void *o, void *(*LockSpectrumDataPointer)(int cam, int *datatype, int *sx));
+        _OrsayCameraRegisterSpectrumDataLocker = _buildFunction(library.RegisterSpectrumDataLocker, [c_void_p, SPECTLOCKFUNC], None)
+        #void CAMERAS_EXPORT RegisterSpectrumDataUnlocker(void *o, void(*UnLockSpectrumDataPointer)(int cam, bool newdata));
+        _OrsayCameraRegisterSpectrumDataUnlocker = _buildFunction(library.RegisterSpectrumDataUnlocker, [c_void_p, SPECTUNLOCKFUNC], None)
+        #void CAMERAS_EXPORT RegisterSpimUpdateInfo(void *o, void(*UpdateSpimInfo)(unsigned long currentspectrum, bool running));
+        _OrsayCameraRegisterSpimUpdateLocker = _buildFunction(library.RegisterSpimUpdateInfo, [c_void_p, SPIMUPDATEFUNC], None)
+
+        #bool CAMERAS_EXPORT init_data_structures(void *o);
+        _OrsayCameraInit_data_structures = _buildFunction(library.init_data_structures, [c_void_p], c_bool)
+
+        #void CAMERAS_EXPORT GetCCDSize(void *o, long *sx, long *sy);
+        _OrsayCameraGetCCDSize = _buildFunction(library.GetCCDSize, [c_void_p, POINTER(c_long), POINTER(c_long)], None)
+        #void CAMERAS_EXPORT GetImageSize(void *o, long *sx, long *sy);
+        _OrsayCameraGetImageSize = _buildFunction(library.GetImageSize, [c_void_p, ], None)
+
+        #//myrgn_type GetArea(void *o, );
+        #//bool CAMERAS_EXPORT SetCameraArea(void *o, short top, short left, short bottom, short right);
+        _OrsayCameraSetArea = _buildFunction(library.SetCameraArea, [c_void_p, c_short, c_short, c_short, c_short], c_bool)
+        #bool CAMERAS_EXPORT GetCameraArea(void *o, short *top, short *left, short *bottom, short *right);#void CAMERAS_EXPORT SetCCDOverscan(void *o, int x, int y);
+        _OrsayCameraGetArea = _buildFunction(library.GetCameraArea, [c_void_p, POINTER(c_short), POINTER(c_short), POINTER(c_short), POINTER(c_short)], c_bool)
+        #void CAMERAS_EXPORT SetCCDOverscan(void *o, int x, int y);
+        _OrsayCameraSetCCDOverscan = _buildFunction(library.SetCCDOverscan, [c_void_p, c_int, c_int], None)
+        #void CAMERAS_EXPORT DisplayOverscan(void *o, bool on);
+        _OrsayCameraDisplayOverscan = _buildFunction(library.DisplayOverscan, [c_void_p, c_bool], None)
+        #void CAMERAS_EXPORT GetBinning(void *o, unsigned short *bx, unsigned short *by);
+        _OrsayCameraGetBinning = _buildFunction(library.GetBinning, [c_void_p, POINTER(c_ushort), POINTER(c_ushort)], None)
+        #bool CAMERAS_EXPORT SetBinning(void *o, unsigned short bx, unsigned short by, bool estimatedark = true);
+        _OrsayCameraSetBinning = _buildFunction(library.SetBinning, [c_void_p, c_ushort, c_ushort, c_bool], c_bool)
+        #void CAMERAS_EXPORT SetMirror(void *o, bool On);
+        _OrsayCameraSetMirror = _buildFunction(library.SetMirror, [c_void_p, c_bool], None)
+        #void CAMERAS_EXPORT SetNbCumul(void *o, long n);
+        _OrsayCameraSetNbCumul = _buildFunction(library.SetNbCumul, [c_void_p, c_long], None)
+        #long CAMERAS_EXPORT GetNbCumul(void *o);
+        _OrsayCameraGetNbCumul = _buildFunction(library.GetNbCumul, [c_void_p], c_long)
+        #void CAMERAS_EXPORT SetSpimMode(void *o, unsigned short mode);
+        _OrsayCameraSetSpimMode = _buildFunction(library.SetSpimMode, [c_void_p, c_ushort], None)
+        #bool CAMERAS_EXPORT StartSpim(void *o, unsigned long nbSpectra, unsigned long nbsp, float pose, bool saveK);
+        _OrsayCameraStartSpim = _buildFunction(library.StartSpim, [c_void_p, c_ulong, c_ulong, c_float, c_bool], c_bool)
+        #bool CAMERAS_EXPORT ResumeSpim(void *o, int mode);
+        _OrsayCameraResumeSpim = _buildFunction(library.ResumeSpim, [c_void_p, c_int], c_bool)
+        #bool CAMERAS_EXPORT PauseSpim(void *o);
+        _OrsayCameraPauseSpim = _buildFunction(library.PauseSpim, [c_void_p], c_bool)
+        #bool CAMERAS_EXPORT StopSpim(void *o, bool endofline = false);
+        _OrsayCameraStopSpim = _buildFunction(library.StopSpim, [c_void_p, c_bool], c_bool)
+
+        #void CAMERAS_EXPORT DisplayCCDInfos(void *o, char *filter);
+        _OrsayCameraDisplayCCDInfos = _buildFunction(library.DisplayCCDInfos, [c_void_p, c_char_p], None)
+        #bool CAMERAS_EXPORT isCameraThere(void *o);
+        _OrsayCameraIsCameraThere = _buildFunction(library.isCameraThere, [c_void_p], c_bool)
+        #bool CAMERAS_EXPORT GetTemperature(void *o, float *temperature, bool *status);
+        _OrsayCameraGetTemperature = _buildFunction(library.GetCameraTemperature, [c_void_p, POINTER(c_float), POINTER(c_bool)], c_bool)
+        #bool CAMERAS_EXPORT SetTemperature(void *o, float temperature);
+        _OrsayCameraSetTemperature = _buildFunction(library.SetCameraTemperature, [c_void_p, c_float], c_bool)
+        #bool CAMERAS_EXPORT SetupBinning(void *o);
+        _OrsayCameraSetupBinning = _buildFunction(library.SetupBinning, [c_void_p], c_bool)
+        #bool CAMERAS_EXPORT StartFocus(void *o, float pose, short display, short accumulate);
+        _OrsayCameraStartFocus = _buildFunction(library.StartFocus, [c_void_p, c_float, c_short, c_short], c_bool)
+        #bool CAMERAS_EXPORT StopFocus(void *o);
+        _OrsayCameraStopFocus = _buildFunction(library.StopFocus, [c_void_p],c_bool )
+        #bool CAMERAS_EXPORT SetCameraExposureTime(void *o, double pose);
+        _OrsayCameraSetExposureTime = _buildFunction(library.SetCameraExposureTime, [c_void_p, c_double], c_bool)
+        #bool CAMERAS_EXPORT StartDarkCalibration(void *o, long numofimages);
+        #_OrsayCameraStartDarkCalibration = _buildFunction(library.StartDarkCalibration, [c_void_p, c_long], c_bool)
+        #long CAMERAS_EXPORT GetNumOfSpeed(void *o, short p);
+        _OrsayCameraGetNumOfSpeed = _buildFunction(library.GetNumOfSpeed, [c_void_p, c_int], c_long)
+        #long CAMERAS_EXPORT GetCurrentSpeed(void *o, short p);
+        _OrsayCameraGetCurrentSpeed = _buildFunction(library.GetCurrentSpeed, [c_void_p, c_short], c_long)
+        #long CAMERAS_EXPORT SetSpeed(void *o, short p, long n);
+        _OrsayCameraSetSpeed = _buildFunction(library.SetSpeed, [c_void_p, c_short, c_long], c_long)
+        #int CAMERAS_EXPORT GetNumOfGains(void *o, int p);
+        _OrsayCameraGetNumOfGains = _buildFunction(library.GetNumOfGains, [c_void_p, c_int], c_int)
+        #const char CAMERAS_EXPORT *GetGainName(void *o, int p, int g);
+        _OrsayCameraGetGainName = _buildFunction(library.GetGainName, [c_void_p, c_int, c_int], c_char_p)
+        #bool CAMERAS_EXPORT SetGain(void *o, short newgain);
+        _OrsayCameraSetGain = _buildFunction(library.SetGain, [c_void_p, c_short], c_bool)
+        #short CAMERAS_EXPORT GetGain(void *o);
+        _OrsayCameraGetGain = _buildFunction(library.GetGain, [c_void_p], c_short)
+        #double CAMERAS_EXPORT GetReadOutTime(void *o);
+        _OrsayCameraGetReadOutTime = _buildFunction(library.GetReadOutTime, [c_void_p], c_double)
+        #long CAMERAS_EXPORT GetNumOfPorts(void *o);
+        _OrsayCameraGetNumOfPorts = _buildFunction(library.GetNumOfPorts, [c_void_p], c_long)
+        #const char CAMERAS_EXPORT *GetPortName(void *o, long nb);
+        _OrsayCameraGetPortName = _buildFunction(library.GetPortName, [c_void_p, c_long], c_char_p)
+        #long CAMERAS_EXPORT GetCurrentPort(void *o);
+        _OrsayCameraGetCurrentPort = _buildFunction(library.GetCurrentPort, [c_void_p], c_long)
+        #bool CAMERAS_EXPORT SetCameraPort(void *o, long n);
+        _OrsayCameraSetCameraPort = _buildFunction(library.SetCameraPort, [c_void_p, c_long], c_bool)
+        #unsigned short CAMERAS_EXPORT GetMultiplication(void *o, unsigned short *pmin, unsigned short *pmax);
+        _OrsayCameraGetMultiplication = _buildFunction(library.GetMultiplication, [c_void_p, POINTER(c_ushort), POINTER(c_ushort)], c_ushort)
+        #void CAMERAS_EXPORT SetMultiplication(void *o, unsigned short mult);
+        _OrsayCameraSetMultiplication = _buildFunction(library.SetMultiplication, [c_void_p, c_ushort], None)
+        #void CAMERAS_EXPORT getCCDStatus(void *o, short *mode, double *p1, double *p2, double *p3, double *p4);
+        _OrsayCameragetCCDStatus = _buildFunction(library.getCCDStatus, [c_void_p, POINTER(c_short), POINTER(c_double), POINTER(c_double), POINTER(c_double), POINTER(c_double)], None)
+        #double CAMERAS_EXPORT GetReadoutSpeed(void *o);
+        _OrsayCameraGetReadoutSpeed = _buildFunction(library.GetReadoutSpeed, [c_void_p], c_double)
+        #long CAMERAS_EXPORT GetPixelTime(void *o, short p, short v);
+        _OrsayCameraGetPixelTime = _buildFunction(library.GetPixelTime, [c_void_p, c_short, c_short], c_long)
+        #void CAMERAS_EXPORT AdjustOverscan(void *o, int sx, int sy);
+        _OrsayCameraAdjustOverscan = _buildFunction(library.AdjustOverscan, [c_void_p, c_int, c_int], None)
+        #void CAMERAS_EXPORT SetTurboMode(void *o, int active, short horizontalsize, short verticalsize);
+        _OrsayCameraSetTurboMode = _buildFunction(library.SetTurboMode, [c_void_p, c_short, c_short, c_short], None)
+        #int CAMERAS_EXPORT GetTurboMode(void *o, short *horizontalsize, short *verticalsize);
+        _OrsayCameraGetTurboMode = _buildFunction(library.GetTurboMode, [c_void_p, POINTER(c_short), POINTER(c_short)], c_int)
+        #bool CAMERAS_EXPORT SetExposureMode(void *o, short mode, short edge);
+        _OrsayCameraSetExposureMode = _buildFunction(library.SetExposureMode, [c_void_p, c_short, c_short], c_bool)
+        #short CAMERAS_EXPORT GetExposureMode(void *o, short *edge);
+        _OrsayCameraGetExposureMode = _buildFunction(library.GetExposureMode, [c_void_p, POINTER(c_short)], c_short)
+        #bool CAMERAS_EXPORT SetPulseMode(void *o, short mode);
+        _OrsayCameraSetPulseMode = _buildFunction(library.SetPulseMode, [c_void_p, c_int], c_bool)
+        #bool CAMERAS_EXPORT SetVerticalShift(void *o, double shift, int clear);
+        _OrsayCameraSetVerticalShift = _buildFunction(library.SetVerticalShift, [c_void_p, c_double, c_int], c_bool)
+        #bool CAMERAS_EXPORT SetFan(void *o, bool OnOff);
+        _OrsayCameraSetFan = _buildFunction(library.SetFan, [c_void_p, c_bool], c_bool)
+        #bool CAMERAS_EXPORT GetFan(void *o);
+        _OrsayCameraGetFan = _buildFunction(library.GetFan, [c_void_p], c_bool)
+        #	void CAMERAS_EXPORT SetVideoThreshold(void *o, unsigned short th);
+        _OrsayCameraSetVideoThreshold = _buildFunction(library.SetVideoThreshold, [c_void_p, c_ushort], None)
+        #	unsigned short CAMERAS_EXPORT GetVideoThreshold(void *o);
+        _OrsayCameraGetVideoThreshold = _buildFunction(library.GetVideoThreshold, [c_void_p], c_ushort)
+
+        globals().update((name, value) for name, value in locals().items() if name.startswith("_OrsayCamera"))
+        instrumentation.register_functions(globals(), "_OrsayCamera")
+        _library = library
+
+
+def __getattr__(name):
+    if name.startswith("_OrsayCamera"):
+        _initLibrary()
+        if name in globals():
+            return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 class orsayCamera(object):
     """
@@ -201,7 +253,9 @@ class orsayCamera(object):
         print(f"log: {_convertToString23(message)}")
 
     def __init__(self, manufacturer, model, sn, simul):
+        _initLibrary()
         self.manufacturer = manufacturer
+        self.cache = StateCache()  # settings of the camera, see state_cache
         self.fnlog = LOGGERFUNC(self.__logger)
 
         modelb = _toString23(model)
@@ -221,23 +275,33 @@ class orsayCamera(object):
         """
         _OrsayCameraRegisterLogger(fn)
 
-    def getImageSize(self) -> int:
+    def invalidateCache(self):
+        """
+        Forget the cached settings, read again from the dll by the next getter calls
+        """
+        self.cache.invalidate()
+
+    def getImageSize(self, refresh=False) -> int:
         """
         Read size of image given by the current setting
         """
-        sx = c_long()
-        sy = c_long()
-        _OrsayCameraGetImageSize(self.orsaycamera, byref(sx), byref(sy))
-        return sx.value, sy.value
+        def read():
+            sx = c_long()
+            sy = c_long()
+            _OrsayCameraGetImageSize(self.orsaycamera, byref(sx), byref(sy))
+            return sx.value, sy.value
+        return self.cache.get(('image_size',), read, refresh)
 
-    def getCCDSize(self) -> (int, int):
+    def getCCDSize(self, refresh=False) -> (int, int):
         """
         Size of the camera ccd chip
         """
-        sx = c_long()
-        sy = c_long()
-        _OrsayCameraGetCCDSize(self.orsaycamera, byref(sx), byref(sy))
-        return (sx.value, sy.value)
+        def read():
+            sx = c_long()
+            sy = c_long()
+            _OrsayCameraGetCCDSize(self.orsaycamera, byref(sx), byref(sy))
+            return (sx.value, sy.value)
+        return self.cache.get(('ccd_size',), read, refresh)
 
     def registerDataLocker(self, fn):
         """"
@@ -275,10 +339,17 @@ class orsayCamera(object):
         """
         _OrsayCameraRegisterSpectrumDataUnlocker(self.orsaycamera, fn)
 
+    def registerSpimUpdateInfo(self, fn):
+        """
+        Function called after each spectrum of a spectrum image readout with the current spectrum and running status
+        """
+        _OrsayCameraRegisterSpimUpdateLocker(self.orsaycamera, fn)
+
     def setCCDOverscan(self, sx, sy):
         """
         For roper CCD cameras changes the size of the chip artificially to do online baseline correction (should 0,0 or 128,0)
         """
+        self.cache.invalidate(('ccd_size',), ('image_size',))
         _OrsayCameraSetCCDOverscan(self.orsaycamera, sx, sy)
 
     def displayOverscan(self, displayed):
@@ -287,20 +358,23 @@ class orsayCamera(object):
         """
         _OrsayCameraDisplayOverscan(self.orsaycamera, displayed)
 
-    def getBinning(self):
+    def getBinning(self, refresh=False):
         """
         Return horizontal, vertical binning
         """
-        bx = c_ushort(1)
-        by = c_ushort(1)
-        _OrsayCameraGetBinning(self.orsaycamera, byref(bx), byref(by))
-        return bx.value, by.value
+        def read():
+            bx = c_ushort(1)
+            by = c_ushort(1)
+            _OrsayCameraGetBinning(self.orsaycamera, byref(bx), byref(by))
+            return bx.value, by.value
+        return self.cache.get(('binning',), read, refresh)
 
     def setBinning(self, bx, by):
         """
         Set  horizontal, vertical binning
         """
-        _OrsayCameraSetBinning(self.orsaycamera, bx, by, 0)
+        self.cache.set(('binning',), (bx, by), lambda: _OrsayCameraSetBinning(self.orsaycamera, bx, by, 0),
+                       exact=False, invalidates=[('image_size',)])
 
     def setMirror(self, mirror):
         """
@@ -312,13 +386,13 @@ class orsayCamera(object):
         """
         Define the number of images/spectra to sum (change to a property?
         """
-        _OrsayCameraSetNbCumul(self.orsaycamera, count)
+        self.cache.set(('accumulation',), count, lambda: _OrsayCameraSetNbCumul(self.orsaycamera, count))
 
-    def getAccumulateNumber(self):
+    def getAccumulateNumber(self, refresh=False):
         """
         Return the number of images/spectra to sum (change to a property?
         """
-        return _OrsayCameraGetNbCumul(self.orsaycamera)
+        return self.cache.get(('accumulation',), lambda: _OrsayCameraGetNbCumul(self.orsaycamera), refresh)
 
     def setSpimMode(self, mode):
         """
@@ -372,6 +446,7 @@ class orsayCamera(object):
         """
         Adjust binning using all current parameters and load it to camera
         """
+        self.cache.invalidate(('binning',), ('image_size',))
         _OrsayCameraSetupBinning(self.orsaycamera)
 
     def startFocus(self, exposure, displaymode, accumulate):
@@ -393,7 +468,8 @@ class orsayCamera(object):
         """
         Defines exposure time, usefull to get then frame rate including readout time
         """
-        return _OrsayCameraSetExposureTime(self.orsaycamera, exposure)
+        return self.cache.set(('exposure',), exposure, lambda: _OrsayCameraSetExposureTime(self.orsaycamera, exposure),
+                              exact=False)
 
     def getNumofSpeeds(self, cameraport):
         """
@@ -416,12 +492,13 @@ class orsayCamera(object):
                 speeds.append(str(speed) + " MHz")
         return speeds
 
-    def getCurrentSpeed(self, cameraport):
+    def getCurrentSpeed(self, cameraport, refresh=False):
         """
         Find the speed used
         """
         if isinstance(cameraport, int):
-            return _OrsayCameraGetCurrentSpeed(self.orsaycamera, c_short(cameraport))
+            return self.cache.get(('speed', cameraport),
+                                  lambda: _OrsayCameraGetCurrentSpeed(self.orsaycamera, c_short(cameraport)), refresh)
         else:
             return 0
 
@@ -460,7 +537,8 @@ class orsayCamera(object):
         """
         Select speed used on this port
         """
-        return _OrsayCameraSetSpeed(self.orsaycamera, cameraport, speed)
+        return self.cache.set(('speed', cameraport), speed,
+                              lambda: _OrsayCameraSetSpeed(self.orsaycamera, cameraport, speed))
 
     def getNumofGains(self, cameraport):
         """
@@ -512,13 +590,14 @@ class orsayCamera(object):
         """
         Find the number of cameras ports
         """
-        return _OrsayCameraGetNumOfPorts(self.orsaycamera)
+        return self.cache.get(('ports',), lambda: _OrsayCameraGetNumOfPorts(self.orsaycamera))
 
     def getPortName(self, portnb):
         """
         Find the label of the camera port
         """
-        return _convertToString23(_OrsayCameraGetPortName(self.orsaycamera, portnb))
+        return self.cache.get(('port_name', portnb),
+                              lambda: _convertToString23(_OrsayCameraGetPortName(self.orsaycamera, portnb)))
 
     def getPortNames(self):
         """
@@ -528,22 +607,24 @@ class orsayCamera(object):
         ports = ()
         k = 0
         while k < nbports:
-            ports = ports + (_convertToString23(_OrsayCameraGetPortName(self.orsaycamera, k)),)
+            ports = ports + (self.getPortName(k),)
             k = k + 1
         return ports
 
-    def getCurrentPort(self):
+    def getCurrentPort(self, refresh=False):
         """
         Returns the current port number
         """
-        return _OrsayCameraGetCurrentPort(self.orsaycamera)
+        return self.cache.get(('port',), lambda: _OrsayCameraGetCurrentPort(self.orsaycamera), refresh)
 
     def setCurrentPort(self, cameraport):
         """
         Choose the current port
         """
         if isinstance(cameraport, int):
-            return _OrsayCameraSetCameraPort(self.orsaycamera, c_long(cameraport))
+            return self.cache.set(('port',), cameraport,
+                                  lambda: _OrsayCameraSetCameraPort(self.orsaycamera, c_long(cameraport)),
+                                  invalidates=[('ccd_size',), ('image_size',), ('binning',), ('speed',)])
         else:
             print("cameraport not an integer")
             return False
@@ -608,12 +689,14 @@ class orsayCamera(object):
         """
         Extend the size of the cdd chip - tested only on horizontal axis
         """
+        self.cache.invalidate(('ccd_size',), ('image_size',))
         _OrsayCameraAdjustOverscan(self.orsaycamera, sizex, sizey)
 
     def setTurboMode(self, active, sizex, sizey):
         """"
         Roper ProEM specific - fast and ultra high speed readout
         """
+        self.cache.invalidate(('image_size',))
         _OrsayCameraSetTurboMode(self.orsaycamera, active, sizex, sizey)
 
     def getTurboMode(self):
@@ -667,6 +750,7 @@ class orsayCamera(object):
         """
         Set the ROI read on the camera (tof, left, bottom, right)
         """
+        self.cache.invalidate(('image_size',))
         return _OrsayCameraSetArea(self.orsaycamera, area[0], area[1], area[2], area[3])
 
     def getArea(self):
@@ -0,0 +1,622 @@
+"""
+Pure python/numpy simulation of the Cameras.dll library.
+
+Same idea as orsayscan_simulator: the module exposes the entry points bound by orsaycamera (OrsayCamerasInit,
+SetBinning, StartFocus, StartSpim...) and each handle is backed by a SimulatedCamera. The CCD size comes from the model
+name, ports and speeds define the pixel time (GetPixelTime, in ns) from which the readout time is modeled, the
+temperature relaxes towards its set point, and a worker thread fires the DATALOCK/SPIMLOCK/SPECTLOCK callbacks at the
+modeled frame rate (exposure + readout).
+"""
+import ctypes
+import itertools
+import math
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from .orsayscan_simulator import DATA_TYPES, _store
+
+#: multiplicative factor applied to exposure and readout durations (0 delivers data as fast as possible)
+time_scale = float(os.environ.get("ORSAY_SIMULATOR_TIME_SCALE", 1.))
+
+#: CCD (width, height) from the number found in the model name
+CCD_SIZES = {'100': (1340, 100), '256': (1024, 256), '400': (1340, 400), '512': (512, 512), '640': (640, 512),
+             '1024': (1024, 1024), '1200': (1200, 1200), '1300': (1340, 1300), '1600': (1600, 200),
+             '1608': (1608, 1608), '2048': (2048, 512), '2K': (2048, 512), '4096': (4096, 4096),
+             '4320': (4320, 4320)}
+DEFAULT_CCD_SIZE = (1024, 256)
+
+#: ports of the simulated cameras: (name, pixel times in ns for each speed (fastest first), gain names)
+CCD_PORTS = [("Low noise", (500, 1000, 10000), ("Low", "Medium", "High")),
+             ("Fast", (50, 100), ("Low", "High"))]
+EMCCD_PORTS = [("Electron multiplied", (50, 100, 200), ("Low", "Medium", "High"))] + CCD_PORTS
+CMOS_PORTS = [("sCMOS", (5, 10), ("Standard", "High dynamic"))]
+
+VERTICAL_SHIFT = 3.2e-6  # s per row shifted
+READOUT_OVERHEAD = 50e-6  # s per frame
+AMBIENT_TEMPERATURE = 20.
+COOLING_TIME_CONSTANT = 30.  # s
+
+# spim modes: 0:SPIMSTOPPED, 1:SPIMRUNNING, 2:SPIMPAUSED, 3:SPIMSTOPEOL, 4:SPIMSTOPEOF, 5:SPIMONLINE
+SPIM_STOPPED, SPIM_RUNNING, SPIM_PAUSED, SPIM_STOPEOL, SPIM_STOPEOF, SPIM_ONLINE = range(6)
+
+_handle_counter = itertools.count(0x2000)
+_devices = {}
+
+
+class SimulatedCamera:
+    """ State of one simulated camera, equivalent of the object returned by OrsayCamerasInit """
+
+    def __init__(self, manufacturer, model: str):
+        self.time_scale = time_scale
+        self.manufacturer = manufacturer
+        self.model = model
+        number = re.search(r':\s*(\d+K?)', model)
+        self.ccd_size = CCD_SIZES.get(number.group(1) if number else '', DEFAULT_CCD_SIZE)
+        if 'KURO' in model:  # square sCMOS sensors
+            self.ccd_size = (self.ccd_size[0], self.ccd_size[0])
+            self.ports = CMOS_PORTS
+        elif 'ProEM' in model or 'EM' in model.split(':')[-1]:
+            self.ports = EMCCD_PORTS
+        else:
+            self.ports = CCD_PORTS
+        self.port = 0
+        self.speeds = [0 for _ in self.ports]
+        self.gains = [0 for _ in self.ports]
+        self.area = (0, 0, self.ccd_size[1], self.ccd_size[0])  # top, left, bottom, right
+        self.binning = (1, 1)
+        self.overscan = (0, 0)
+        self.mirror = False
+        self.exposure = 0.1
+        self.nb_cumul = 1
+        self.multiplication = 1
+        self.turbo = (0, 0, 0)
+        self.exposure_mode = (0, 0)
+        self.fan = False
+        self.video_threshold = 0
+        self._target_temperature = AMBIENT_TEMPERATURE
+        self._temperature_origin = (time.perf_counter(), AMBIENT_TEMPERATURE)
+
+        self.logger = None
+        self.data_locker = None
+        self.data_unlocker = None
+        self.spim_locker = None
+        self.spim_unlocker = None
+        self.spectrum_locker = None
+        self.spectrum_unlocker = None
+        self.spim_update = None
+
+        self.mode = 0  # getCCDStatus mode: 0 idle, 3 focus, 4 cumul, 5 spim
+        self.frame_rate = 0.
+        self.accumulation_count = 0
+        self.spim_mode = SPIM_STOPPED
+        self.spim_total = 0
+        self.spim_current = 0
+        self._spim_armed = False
+        self._thread: threading.Thread = None
+        self._cancel = threading.Event()
+        self._resume = threading.Event()
+        self._profiles = {}
+
+    # geometry and timing model
+    def image_size(self):
+        top, left, bottom, right = self.area
+        bx, by = self.binning
+        return max(1, (right - left) // bx), max(1, (bottom - top) // by)
+
+    def pixel_time(self, port=None, speed=None):
+        port = self.port if port is None else port
+        speed = self.speeds[port] if speed is None else speed
+        return self.ports[port][1][speed]
+
+    def readout_time(self):
+        """ Vertical shift of every row of the area plus digitization of the binned pixels """
+        top, left, bottom, right = self.area
+        sx, sy = self.image_size()
+        return (bottom - top) * VERTICAL_SHIFT + sx * sy * self.pixel_time() * 1e-9 + READOUT_OVERHEAD
+
+    def frame_time(self):
+        return self.exposure + self.readout_time()
+
+    def temperature(self):
+        t0, temperature0 = self._temperature_origin
+        decay = math.exp(-(time.perf_counter() - t0) / COOLING_TIME_CONSTANT)
+        return self._target_temperature + (temperature0 - self._target_temperature) * decay
+
+    def set_temperature(self, target):
+        self._temperature_origin = (time.perf_counter(), self.temperature())
+        self._target_temperature = float(target)
+
+    def profile(self, sx, sy):
+        """ Synthetic float32 image: a few gaussian peaks along x, a gaussian spot along y """
+        key = (sx, sy)
+        if key not in self._profiles:
+            self._profiles.clear()
+            x = np.arange(sx, dtype=np.float32)
+            y = np.arange(sy, dtype=np.float32)
+            spectrum = 200 + 5000 * np.exp(-((x - 0.1 * sx) / (0.01 * sx + 1)) ** 2) \
+                + 800 * np.exp(-((x - 0.45 * sx) / (0.05 * sx + 1)) ** 2) \
+                + 300 * np.exp(-((x - 0.7 * sx) / (0.02 * sx + 1)) ** 2)
+            spot = np.exp(-((y - sy / 2) / (0.2 * sy + 1)) ** 2) if sy > 1 else np.ones((1,), dtype=np.float32)
+            self._profiles[key] = (spot[:, None] * spectrum[None, :]).astype(np.float32)
+        return self._profiles[key]
+
+    # acquisition
+    def _start(self, target, *args):
+        self.stop()
+        self._cancel.clear()
+        self._thread = threading.Thread(target=target, args=args, daemon=True, name="OrsayCameraSimulator")
+        self._thread.start()
+
+    def stop(self):
+        self._cancel.set()
+        self._resume.set()
+        if self._thread is not None and self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._resume.clear()
+        self.mode = 0
+
+    @staticmethod
+    def _view(address, dtype, count):
+        buffer = (ctypes.c_char * (count * dtype.itemsize)).from_address(address)
+        return np.frombuffer(buffer, dtype=dtype)
+
+    def _wait_frame(self, deadline):
+        """ Sleep until deadline, returns False if the acquisition has been cancelled """
+        return not self._cancel.wait(max(0., deadline - time.perf_counter()))
+
+    def _focus(self, accumulate):
+        self.mode = 4 if accumulate else 3
+        self.accumulation_count = 0
+        frame_time = self.frame_time() * self.time_scale
+        self.frame_rate = 1 / frame_time if frame_time > 0 else math.inf
+        deadline = time.perf_counter()
+        frame_index = 0
+        while True:
+            deadline += frame_time
+            if not self._wait_frame(deadline):
+                break
+            newdata = False
+            if self.data_locker is not None:
+                datatype, sx, sy, sz = ctypes.c_int(11), ctypes.c_int(0), ctypes.c_int(0), ctypes.c_int(1)
+                address = self.data_locker(0, ctypes.pointer(datatype), ctypes.pointer(sx), ctypes.pointer(sy),
+                                           ctypes.pointer(sz))
+                if address:
+                    data = self._view(address, np.dtype(DATA_TYPES[datatype.value % 100]),
+                                      sx.value * sy.value * sz.value).reshape((sz.value * sy.value, sx.value))
+                    image = self.profile(sx.value, sz.value * sy.value)
+                    scale = self.exposure * 10
+                    if accumulate and self.accumulation_count > 0:
+                        data += (image * scale + frame_index % 7).astype(data.dtype, copy=False)
+                    else:
+                        np.multiply(image, scale, out=data, casting='unsafe')
+                        data += frame_index % 7
+                    newdata = True
+            frame_index += 1
+            self.accumulation_count += 1
+            if self.data_unlocker is not None:
+                self.data_unlocker(0, newdata)
+            if accumulate and self.accumulation_count >= self.nb_cumul:
+                break
+        self.mode = 0
+
+    def _spim(self):
+        self.mode = 5
+        spectrum_time = self.frame_time() * self.time_scale
+        self.frame_rate = 1 / spectrum_time if spectrum_time > 0 else math.inf
+        deadline = time.perf_counter()
+        running = True
+        while running:
+            if self.spim_mode == SPIM_PAUSED:
+                self._resume.wait()
+                self._resume.clear()
+                deadline = time.perf_counter()
+                if self._cancel.is_set():
+                    break
+            deadline += spectrum_time
+            if not self._wait_frame(deadline):
+                break
+            self._spim_spectrum(self.spim_current)
+            self.spim_current += 1
+            if self.spim_current >= self.spim_total:
+                if self.spim_mode in (SPIM_RUNNING, SPIM_ONLINE):
+                    self.spim_current = 0
+                else:
+                    running = False
+            elif self.spim_mode == SPIM_STOPPED:
+                running = False
+            if self.spim_unlocker is not None:
+                self.spim_unlocker(0, True, running)
+            if self.spim_update is not None:
+                self.spim_update(self.spim_current, running)
+        if running and self.spim_unlocker is not None:  # cancelled
+            self.spim_unlocker(0, False, False)
+        self._spim_armed = False
+        self.mode = 0
+
+    def _spim_spectrum(self, index):
+        sx, sy = self.image_size()
+        spectrum = self.profile(sx, sy).sum(axis=0) if sy > 1 else self.profile(sx, 1)[0]
+        scale = self.exposure * 10
+        offset = index % 11
+        if self.spectrum_locker is not None:
+            datatype, size = ctypes.c_int(11), ctypes.c_int(0)
+            address = self.spectrum_locker(0, ctypes.pointer(datatype), ctypes.pointer(size))
+            if address:
+                data = self._view(address, np.dtype(DATA_TYPES[datatype.value % 100]), size.value)
+                np.multiply(spectrum[:size.value], scale, out=data, casting='unsafe')
+                data += offset
+            if self.spectrum_unlocker is not None:
+                self.spectrum_unlocker(0, bool(address))
+        if self.spim_locker is not None:
+            datatype, ssx, ssy, ssz = ctypes.c_int(11), ctypes.c_int(0), ctypes.c_int(0), ctypes.c_int(1)
+            address = self.spim_locker(0, ctypes.pointer(datatype), ctypes.pointer(ssx), ctypes.pointer(ssy),
+                                       ctypes.pointer(ssz))
+            if address:
+                count = ssx.value * ssy.value * ssz.value
+                dtype = np.dtype(DATA_TYPES[datatype.value % 100])
+                if datatype.value >= 100:  # spectrum data on first axis: one spectrum after the other
+                    cube = self._view(address, dtype, count).reshape((-1, ssx.value))
+                    length = ssx.value
+                else:  # energy is the slowest axis: (sz, sy, sx)
+                    cube = self._view(address, dtype, count).reshape((ssz.value, -1)).T
+                    length = ssz.value
+                if index < cube.shape[0]:
+                    np.multiply(spectrum[:length], scale, out=cube[index, :min(length, sx)], casting='unsafe')
+                    cube[index] += offset
+
+
+def get_device(o) -> SimulatedCamera:
+    """ Returns the simulated camera behind a handle, for instance to change its time_scale """
+    try:
+        return _devices[o]
+    except KeyError:
+        raise ValueError(f"Invalid simulated camera handle: {o}")
+
+
+def OrsayCamerasInit(manufacturer, model, sn, logger, simul):
+    handle = next(_handle_counter)
+    camera = SimulatedCamera(manufacturer, model.decode("utf-8") if isinstance(model, bytes) else model)
+    camera.logger = logger
+    _devices[handle] = camera
+    if logger is not None:
+        logger(f"Simulated camera {camera.model}: {camera.ccd_size[0]}x{camera.ccd_size[1]}".encode("utf-8"),
+               False)
+    return handle
+
+
+def OrsayCamerasClose(o):
+    camera = _devices.pop(o, None)
+    if camera is not None:
+        camera.stop()
+
+
+def RegisterLogger(o, fn):
+    get_device(o).logger = fn
+
+
+def RegisterDataLocker(o, fn):
+    get_device(o).data_locker = fn
+
+
+def RegisterDataUnlocker(o, fn):
+    get_device(o).data_unlocker = fn
+
+
+def RegisterSpimDataLocker(o, fn):
+    get_device(o).spim_locker = fn
+
+
+def RegisterSpimDataUnlocker(o, fn):
+    get_device(o).spim_unlocker = fn
+
+
+def RegisterSpectrumDataLocker(o, fn):
+    get_device(o).spectrum_locker = fn
+
+
+def RegisterSpectrumDataUnlocker(o, fn):
+    get_device(o).spectrum_unlocker = fn
+
+
+def RegisterSpimUpdateInfo(o, fn):
+    get_device(o).spim_update = fn
+
+
+def init_data_structures(o):
+    get_device(o)
+    return True
+
+
+def GetCCDSize(o, sx, sy):
+    camera = get_device(o)
+    _store(sx, camera.ccd_size[0] + camera.overscan[0])
+    _store(sy, camera.ccd_size[1] + camera.overscan[1])
+
+
+def GetImageSize(o, sx, sy):
+    size_x, size_y = get_device(o).image_size()
+    _store(sx, size_x)
+    _store(sy, size_y)
+
+
+def SetCameraArea(o, top, left, bottom, right):
+    camera = get_device(o)
+    width, height = camera.ccd_size
+    if not (0 <= top < bottom <= height and 0 <= left < right <= width):
+        return False
+    camera.area = (top, left, bottom, right)
+    return True
+
+
+def GetCameraArea(o, top, left, bottom, right):
+    for ref, value in zip((top, left, bottom, right), get_device(o).area):
+        _store(ref, value)
+    return True
+
+
+def SetCCDOverscan(o, x, y):
+    get_device(o).overscan = (x, y)
+
+
+def DisplayOverscan(o, on):
+    get_device(o)
+
+
+def GetBinning(o, bx, by):
+    camera = get_device(o)
+    _store(bx, camera.binning[0])
+    _store(by, camera.binning[1])
+
+
+def SetBinning(o, bx, by, estimatedark=True):
+    camera = get_device(o)
+    top, left, bottom, right = camera.area
+    camera.binning = (max(1, min(int(bx), right - left)), max(1, min(int(by), bottom - top)))
+    return True
+
+
+def SetMirror(o, on):
+    get_device(o).mirror = bool(on)
+
+
+def SetNbCumul(o, n):
+    get_device(o).nb_cumul = max(1, int(n))
+
+
+def GetNbCumul(o):
+    return get_device(o).nb_cumul
+
+
+def SetSpimMode(o, mode):
+    camera = get_device(o)
+    camera.spim_mode = mode
+    if mode != SPIM_PAUSED:
+        camera._resume.set()
+
+
+def StartSpim(o, nbSpectra, nbsp, pose, saveK):
+    camera = get_device(o)
+    camera.stop()
+    camera.exposure = float(pose)
+    camera.spim_total = int(nbSpectra)
+    camera.spim_current = 0
+    camera.spim_mode = SPIM_PAUSED
+    camera._spim_armed = True
+    return True
+
+
+def ResumeSpim(o, mode):
+    camera = get_device(o)
+    if not camera._spim_armed:
+        return False
+    camera.spim_mode = mode
+    if camera._thread is None or not camera._thread.is_alive():
+        camera._start(camera._spim)
+    else:
+        camera._resume.set()
+    return True
+
+
+def PauseSpim(o):
+    get_device(o).spim_mode = SPIM_PAUSED
+    return True
+
+
+def StopSpim(o, endofline=False):
+    camera = get_device(o)
+    camera.stop()
+    camera._spim_armed = False
+    return True
+
+
+def DisplayCCDInfos(o, filter):
+    get_device(o)
+
+
+def isCameraThere(o):
+    get_device(o)
+    return True
+
+
+def GetCameraTemperature(o, temperature, status):
+    camera = get_device(o)
+    value = camera.temperature()
+    _store(temperature, value)
+    _store(status, abs(value - camera._target_temperature) < 0.5)
+    return True
+
+
+def SetCameraTemperature(o, temperature):
+    get_device(o).set_temperature(temperature)
+    return True
+
+
+def SetupBinning(o):
+    get_device(o)
+    return True
+
+
+def StartFocus(o, pose, display, accumulate):
+    camera = get_device(o)
+    camera.exposure = float(pose)
+    camera._start(camera._focus, bool(accumulate))
+    return True
+
+
+def StopFocus(o):
+    get_device(o).stop()
+    return True
+
+
+def SetCameraExposureTime(o, pose):
+    get_device(o).exposure = float(pose)
+    return True
+
+
+def GetNumOfSpeed(o, p):
+    return len(get_device(o).ports[p][1])
+
+
+def GetCurrentSpeed(o, p):
+    return get_device(o).speeds[p]
+
+
+def SetSpeed(o, p, n):
+    camera = get_device(o)
+    camera.speeds[p] = max(0, min(int(n), len(camera.ports[p][1]) - 1))
+    return camera.speeds[p]
+
+
+def GetNumOfGains(o, p):
+    return len(get_device(o).ports[p][2])
+
+
+def GetGainName(o, p, g):
+    return get_device(o).ports[p][2][g].encode("utf-8")
+
+
+def SetGain(o, newgain):
+    camera = get_device(o)
+    camera.gains[camera.port] = max(0, min(int(newgain), len(camera.ports[camera.port][2]) - 1))
+    return True
+
+
+def GetGain(o, *args):
+    camera = get_device(o)
+    return camera.gains[camera.port]
+
+
+def GetReadOutTime(o):
+    return get_device(o).readout_time()
+
+
+def GetNumOfPorts(o):
+    return len(get_device(o).ports)
+
+
+def GetPortName(o, nb):
+    return get_device(o).ports[nb][0].encode("utf-8")
+
+
+def GetCurrentPort(o):
+    return get_device(o).port
+
+
+def SetCameraPort(o, n):
+    camera = get_device(o)
+    n = getattr(n, 'value', n)
+    if not 0 <= n < len(camera.ports):
+        return False
+    camera.port = n
+    return True
+
+
+def GetMultiplication(o, pmin, pmax):
+    _store(pmin, 1)
+    _store(pmax, 1000)
+    return get_device(o).multiplication
+
+
+def SetMultiplication(o, mult):
+    get_device(o).multiplication = int(mult)
+
+
+def getCCDStatus(o, mode, p1, p2, p3, p4):
+    camera = get_device(o)
+    values = (0., 0., 0., 0.)
+    if camera.mode == 0:
+        values = (camera.temperature(), camera._target_temperature, 0., 0.)
+    elif camera.mode == 3:
+        values = (camera.frame_rate, 0., 0., 0.)
+    elif camera.mode == 4:
+        values = (camera.accumulation_count, camera.nb_cumul, 0., 0.)
+    elif camera.mode == 5:
+        values = (camera.spim_current, camera.spim_total, 0., 0.)
+    _store(mode, camera.mode)
+    for ref, value in zip((p1, p2, p3, p4), values):
+        _store(ref, value)
+
+
+def GetReadoutSpeed(o):
+    return 1 / get_device(o).frame_time()
+
+
+def GetPixelTime(o, p, v):
+    return get_device(o).pixel_time(p, v)
+
+
+def AdjustOverscan(o, sx, sy):
+    get_device(o).overscan = (sx, sy)
+
+
+def SetTurboMode(o, active, horizontalsize, verticalsize):
+    get_device(o).turbo = (active, horizontalsize, verticalsize)
+
+
+def GetTurboMode(o, horizontalsize, verticalsize):
+    active, sx, sy = get_device(o).turbo
+    _store(horizontalsize, sx)
+    _store(verticalsize, sy)
+    return active
+
+
+def SetExposureMode(o, mode, edge):
+    get_device(o).exposure_mode = (mode, edge)
+    return True
+
+
+def GetExposureMode(o, edge):
+    mode, edge_value = get_device(o).exposure_mode
+    _store(edge, edge_value)
+    return mode
+
+
+def SetPulseMode(o, mode):
+    get_device(o)
+    return True
+
+
+def SetVerticalShift(o, shift, clear):
+    get_device(o)
+    return True
+
+
+def SetFan(o, OnOff):
+    get_device(o).fan = bool(OnOff)
+    return True
+
+
+def GetFan(o):
+    return get_device(o).fan
+
+
+def SetVideoThreshold(o, th):
+    get_device(o).video_threshold = int(th)
+
+
+def GetVideoThreshold(o):
+    return get_device(o).video_threshold
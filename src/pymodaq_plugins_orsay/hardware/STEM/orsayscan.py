@@ -3,8 +3,16 @@ Class controlling orsay scan hardware.
 """
 import sys
 from ctypes import cdll, create_string_buffer, POINTER, byref
-from ctypes import c_uint, c_int, c_char, c_char_p, c_void_p, c_short, c_long, c_bool, c_double, c_uint64, c_uint32, Array, CFUNCTYPE, WINFUNCTYPE
+from ctypes import c_uint, c_int, c_char, c_char_p, c_void_p, c_short, c_long, c_bool, c_double, c_uint64, c_uint32, Array, CFUNCTYPE
 import os
+import threading
+from .instrumentation import instrumentation
+from .scan_executor import ScanExecutor
+from .state_cache import StateCache
+try:
+    from ctypes import WINFUNCTYPE
+except ImportError:  # not on windows, only the simulated library can be used
+    WINFUNCTYPE = CFUNCTYPE
 
 __author__  = "Marcel Tence"
 __status__  = "alpha"
@@ -33,198 +41,308 @@ def _toString23(string):
         return string.encode("utf-8")
     return string
 
-#is64bit = sys.maxsize > 2**32
-if (sys.maxsize > 2**32):
-    libname = os.path.dirname(__file__)
-    libname = os.path.join(libname, "Scan.dll")
-    _library = cdll.LoadLibrary(libname)
-    #print(f"OrsayScan library: {_library}")
-else:
-    raise Exception("It must a python 64 bit version")
+def _serializedFunction(function):
+    """
+    Route the calls of a dll function to the executor of their handle (first argument), see scan_executor.
+    """
+    def serialized(handle, *args):
+        executor = _executors.get(handle, None)
+        if executor is None:
+            return function(handle, *args)
+        return executor.call(function, handle, *args)
+    serialized.__wrapped__ = function
+    return serialized
+
+def _loadLibrary():
+    """
+    Load Scan.dll, or its pure python simulation (orsayscan_simulator) when the ORSAY_SCAN_BACKEND
+    environment variable is set to "simulator". The simulation is the default outside windows.
+    With ORSAY_SCAN_BACKEND set to "replay", the simulation plays the callbacks recorded in the
+    ORSAY_SCAN_REPLAY file, see callback_recording.
+    """
+    backend = os.environ.get("ORSAY_SCAN_BACKEND", "dll" if sys.platform == "win32" else "simulator")
+    if backend == "simulator":
+        from . import orsayscan_simulator
+        return orsayscan_simulator
+    if backend == "replay":
+        from .callback_recording import scan_replay_library
+        return scan_replay_library(os.environ["ORSAY_SCAN_REPLAY"])
+    #is64bit = sys.maxsize > 2**32
+    if (sys.maxsize > 2**32):
+        libname = os.path.dirname(__file__)
+        libname = os.path.join(libname, "Scan.dll")
+        return cdll.LoadLibrary(libname)
+        #print(f"OrsayScan library: {_library}")
+    else:
+        raise Exception("It must a python 64 bit version")
+
+_library = None
+_libraryLock = threading.Lock()
+_executors = {}  # handle: ScanExecutor of its calls
+_caches = {}  # handle: StateCache of its settings
 
-#void SCAN_EXPORT *OrsayScanInit();
-_OrsayScanInit = _buildFunction(_library.OrsayScanInit, [], c_void_p)
+#void *(*LockScanDataPointer)(int gene, int *datatype, int *sx, int *sy, int *sz);
+LOCKERFUNC = WINFUNCTYPE(c_void_p, c_int, POINTER(c_int), POINTER(c_int), POINTER(c_int), POINTER(c_int))
+#void(*UnLockScanDataPointer)(int gene, bool newdata);
+UNLOCKERFUNC = WINFUNCTYPE(None, c_int, c_bool)
+UNLOCKERFUNCA = WINFUNCTYPE(None, c_int, c_int, c_int, POINTER(c_int))
 
-#void SCAN_EXPORT OrsayScanClose(void* o)
-_OrsayScanClose = _buildFunction(_library.OrsayScanClose, [c_void_p], None)
 
-#void SCAN_EXPORT OrsayScangetVersion(void* o, short *product, short *revision, short *serialnumber, short *major, short *minor);
-_OrsayScangetVersion = _buildFunction(_library.OrsayScangetVersion, [c_void_p, POINTER(c_short), POINTER(c_short), POINTER(c_short), POINTER(c_short), POINTER(c_short)], None)
+def _initLibrary():
+    """
+    Load the library and build the function prototypes. Called on first orsayScan construction so that
+    importing this module (e.g. during pymodaq plugin discovery) neither requires nor loads Scan.dll.
+    """
+    global _library
+    with _libraryLock:
+        if _library is not None:
+            return
+        library = _loadLibrary()
+        if os.environ.get("ORSAY_SCAN_RECORD", ""):  # record the callbacks, see callback_recording
+            from .callback_recording import RecordingLibrary, SCAN
+            library = RecordingLibrary(library, SCAN, os.environ["ORSAY_SCAN_RECORD"])
 
-#int SCAN_EXPORT OrsayScanGetInputsCount(void* o);
-_OrsayScangetInputsCount = _buildFunction(_library.OrsayScanGetInputsCount, [c_void_p], c_int)
+        #void SCAN_EXPORT *OrsayScanInit();
+        _OrsayScanInit = _buildFunction(library.OrsayScanInit, [], c_void_p)
 
-#int SCAN_EXPORT OrsayScanGetInputProperties(void* o, int nb, bool &unipolar, double &offset, char *buffer);
-_OrsayScanGetInputProperties =  _buildFunction(_library.OrsayScanGetInputProperties, [c_void_p, c_int, POINTER(c_bool), POINTER(c_double), c_char_p], c_int)
+        #void SCAN_EXPORT OrsayScanClose(void* o)
+        _OrsayScanClose = _buildFunction(library.OrsayScanClose, [c_void_p], None)
 
-#	bool SCAN_EXPORT OrsayScanSetInputProperties(void* o, int nb, bool unipolar, double offset);
-_OrsayScanSetInputProperties = _buildFunction(_library.OrsayScanSetInputProperties, [c_void_p, c_int, c_bool, c_double], c_bool)
+        #void SCAN_EXPORT OrsayScangetVersion(void* o, short *product, short *revision, short *serialnumber, short *major, short *minor);
+        _OrsayScangetVersion = _buildFunction(library.OrsayScangetVersion, [c_void_p, POINTER(c_short), POINTER(c_short), POINTER(c_short), POINTER(c_short), POINTER(c_short)], None)
 
-#bool SCAN_EXPORT OrsayScansetImageSize(void *o, int gene, int x, int y);
-_OrsayScansetImageSize = _buildFunction(_library.OrsayScansetImageSize, [c_void_p, c_int, c_int, c_int], c_bool)
+        #int SCAN_EXPORT OrsayScanGetInputsCount(void* o);
+        _OrsayScangetInputsCount = _buildFunction(library.OrsayScanGetInputsCount, [c_void_p], c_int)
 
-#	bool SCAN_EXPORT OrsayScangetImageSize(void *o, int gene, int *x, int *y);
-_OrsayScangetImageSize = _buildFunction(_library.OrsayScangetImageSize, [c_void_p, c_int, POINTER(c_int), POINTER(c_int)], c_bool)
+        #int SCAN_EXPORT OrsayScanGetInputProperties(void* o, int nb, bool &unipolar, double &offset, char *buffer);
+        _OrsayScanGetInputProperties =  _buildFunction(library.OrsayScanGetInputProperties, [c_void_p, c_int, POINTER(c_bool), POINTER(c_double), c_char_p], c_int)
 
-#bool SCAN_EXPORT OrsayScansetImageArea(void* o, int gene, int sx, int sy, int xd, int xf, int yd, int yf);
-_OrsayScansetImageArea = _buildFunction(_library.OrsayScansetImageArea, [c_void_p, c_int, c_int, c_int, c_int, c_int, c_int, c_int], c_bool)
+        #	bool SCAN_EXPORT OrsayScanSetInputProperties(void* o, int nb, bool unipolar, double offset);
+        _OrsayScanSetInputProperties = _buildFunction(library.OrsayScanSetInputProperties, [c_void_p, c_int, c_bool, c_double], c_bool)
 
-#bool SCAN_EXPORT OrsayScangetImageArea(void* o, int gene, int *sx, int *sy, int *xd, int *xf, int *yd, int *yf);
-_OrsayScangetImageArea = _buildFunction(_library.OrsayScangetImageArea, [c_void_p, c_int, POINTER(c_int), POINTER(c_int), POINTER(c_int), POINTER(c_int), POINTER(c_int), POINTER(c_int)], bool)
+        #bool SCAN_EXPORT OrsayScansetImageSize(void *o, int gene, int x, int y);
+        _OrsayScansetImageSize = _buildFunction(library.OrsayScansetImageSize, [c_void_p, c_int, c_int, c_int], c_bool)
 
-#double SCAN_EXPORT OrsayScangetPose(void* o, int gene);
-_OrsayScangetPose = _buildFunction(_library.OrsayScangetPose, [c_void_p, c_int], c_double)
+        #	bool SCAN_EXPORT OrsayScangetImageSize(void *o, int gene, int *x, int *y);
+        _OrsayScangetImageSize = _buildFunction(library.OrsayScangetImageSize, [c_void_p, c_int, POINTER(c_int), POINTER(c_int)], c_bool)
 
-#bool SCAN_EXPORT OrsayScansetPose(void* o, int gene, double time);
-_OrsayScansetPose = _buildFunction(_library.OrsayScansetPose, [c_void_p, c_int, c_double], c_bool)
+        #bool SCAN_EXPORT OrsayScansetImageArea(void* o, int gene, int sx, int sy, int xd, int xf, int yd, int yf);
+        _OrsayScansetImageArea = _buildFunction(library.OrsayScansetImageArea, [c_void_p, c_int, c_int, c_int, c_int, c_int, c_int, c_int], c_bool)
 
-#double SCAN_EXPORT OrsayScanGetImageTime(void* o, int gene);
-_OrsayScanGetImageTime = _buildFunction(_library.OrsayScanGetImageTime, [c_void_p, c_int], c_double)
+        #bool SCAN_EXPORT OrsayScangetImageArea(void* o, int gene, int *sx, int *sy, int *xd, int *xf, int *yd, int *yf);
+        _OrsayScangetImageArea = _buildFunction(library.OrsayScangetImageArea, [c_void_p, c_int, POINTER(c_int), POINTER(c_int), POINTER(c_int), POINTER(c_int), POINTER(c_int), POINTER(c_int)], bool)
 
-#bool SCAN_EXPORT OrsayScanSetInputs(void* o, int gene, int nb, int *inputs);
-_OrsayScanSetInputs =_buildFunction(_library.OrsayScanSetInputs, [c_void_p, c_int, c_int, POINTER(c_int)], c_bool)
+        #double SCAN_EXPORT OrsayScangetPose(void* o, int gene);
+        _OrsayScangetPose = _buildFunction(library.OrsayScangetPose, [c_void_p, c_int], c_double)
 
-#int SCAN_EXPORT OrsayScanGetInputs(void* o, int gene, int *inputs);
-_OrsayScanGetInputs =_buildFunction(_library.OrsayScanGetInputs, [c_void_p, c_int, POINTER(c_int)], c_int)
+        #bool SCAN_EXPORT OrsayScansetPose(void* o, int gene, double time);
+        _OrsayScansetPose = _buildFunction(library.OrsayScansetPose, [c_void_p, c_int, c_double], c_bool)
 
-#void SCAN_EXPORT OrsayScanSetRotation(void* o, double angle);
-_OrsayScanSetRotation = _buildFunction(_library.OrsayScanSetRotation,  [c_void_p, c_double], None)
+        #double SCAN_EXPORT OrsayScanGetImageTime(void* o, int gene);
+        _OrsayScanGetImageTime = _buildFunction(library.OrsayScanGetImageTime, [c_void_p, c_int], c_double)
 
-#double SCAN_EXPORT OrsayScanGetRotation(void* o);
-_OrsayScanGetRotation = _buildFunction(_library.OrsayScanGetRotation, [c_void_p], c_double)
+        #bool SCAN_EXPORT OrsayScanSetInputs(void* o, int gene, int nb, int *inputs);
+        _OrsayScanSetInputs =_buildFunction(library.OrsayScanSetInputs, [c_void_p, c_int, c_int, POINTER(c_int)], c_bool)
 
-#bool SCAN_EXPORT OrsayScanStartImaging(void* o, short gene, short mode, short lineaverage);
-_OrsayScanStartImaging = _buildFunction(_library.OrsayScanStartImaging, [c_void_p, c_short, c_short, c_short], c_bool)
+        #int SCAN_EXPORT OrsayScanGetInputs(void* o, int gene, int *inputs);
+        _OrsayScanGetInputs =_buildFunction(library.OrsayScanGetInputs, [c_void_p, c_int, POINTER(c_int)], c_int)
 
-#bool SCAN_EXPORT OrsayScanStartSpim(void* o, short gene, short mode, short lineaverage, int nbspectraperpixel, bool sumpectra);
-_OrsayScanStartSpim = _buildFunction(_library.OrsayScanStartSpim, [c_void_p, c_short, c_short, c_short, c_int, c_bool], c_bool)
+        #void SCAN_EXPORT OrsayScanSetRotation(void* o, double angle);
+        _OrsayScanSetRotation = _buildFunction(library.OrsayScanSetRotation,  [c_void_p, c_double], None)
 
-#bool SCAN_EXPORT OrsayScanStopImaging(void* o, int gene, bool cancel);
-_OrsayScanStopImaging = _buildFunction(_library.OrsayScanStopImaging, [c_void_p, c_int, c_bool], c_bool)
+        #double SCAN_EXPORT OrsayScanGetRotation(void* o);
+        _OrsayScanGetRotation = _buildFunction(library.OrsayScanGetRotation, [c_void_p], c_double)
 
-#bool SCAN_EXPORT OrsayScanStopImagingA(void* o, int gene, bool immediate);
-_OrsayScanStopImagingA = _buildFunction(_library.OrsayScanStopImagingA, [c_void_p, c_int, c_bool], c_bool)
+        #bool SCAN_EXPORT OrsayScanStartImaging(void* o, short gene, short mode, short lineaverage);
+        _OrsayScanStartImaging = _buildFunction(library.OrsayScanStartImaging, [c_void_p, c_short, c_short, c_short], c_bool)
 
-#void SCAN_EXPORT OrsayScanSetImagingMode(void* o, int gene, int stripes);
-_OrsayScanSetImagingMode = _buildFunction(_library.OrsayScanSetImagingMode, [c_void_p, c_int, c_int], None);
+        #bool SCAN_EXPORT OrsayScanStartSpim(void* o, short gene, short mode, short lineaverage, int nbspectraperpixel, bool sumpectra);
+        _OrsayScanStartSpim = _buildFunction(library.OrsayScanStartSpim, [c_void_p, c_short, c_short, c_short, c_int, c_bool], c_bool)
 
-#bool SCAN_EXPORT OrsayScanSetScanClock(void* o, int gene, int mode);
-_OrsayScanSetScanClock = _buildFunction(_library.OrsayScanSetScanClock, [c_void_p, c_int, c_int], c_bool)
+        #bool SCAN_EXPORT OrsayScanStopImaging(void* o, int gene, bool cancel);
+        _OrsayScanStopImaging = _buildFunction(library.OrsayScanStopImaging, [c_void_p, c_int, c_bool], c_bool)
 
-#unsigned long SCAN_EXPORT OrsayScanGetScansCount(void* o);
-_OrsayScanGetScansCount = _buildFunction(_library.OrsayScanGetScansCount, [c_void_p], c_uint32)
+        #bool SCAN_EXPORT OrsayScanStopImagingA(void* o, int gene, bool immediate);
+        _OrsayScanStopImagingA = _buildFunction(library.OrsayScanStopImagingA, [c_void_p, c_int, c_bool], c_bool)
 
-#void SCAN_EXPORT OrsayScanSetScale(void* o, int sortie, double vx, double vy);
-_OrsayScanSetScale = _buildFunction(_library.OrsayScanSetScale, [c_void_p, c_int, c_double, c_double], None)
+        #void SCAN_EXPORT OrsayScanSetImagingMode(void* o, int gene, int stripes);
+        _OrsayScanSetImagingMode = _buildFunction(library.OrsayScanSetImagingMode, [c_void_p, c_int, c_int], None)
 
-#void SCAN_EXPORT OrsayScanSetImagingKind(void *o, int gene, int kind);
-_OrsayScanSetImagingKind = _buildFunction(_library.OrsayScanSetImagingKind, [c_void_p, c_int, c_int], None)
+        #bool SCAN_EXPORT OrsayScanSetScanClock(void* o, int gene, int mode);
+        _OrsayScanSetScanClock = _buildFunction(library.OrsayScanSetScanClock, [c_void_p, c_int, c_int], c_bool)
 
-#int SCAN_EXPORT OrsayScanGetImagingKind(void *o, int gene);
-_OrsayScanGetImagingKind = _buildFunction(_library.OrsayScanGetImagingKind, [c_void_p, c_int], c_int)
+        #unsigned long SCAN_EXPORT OrsayScanGetScansCount(void* o);
+        _OrsayScanGetScansCount = _buildFunction(library.OrsayScanGetScansCount, [c_void_p], c_uint32)
 
-#double SCAN_EXPORT OrsayScanGetVideoOffset(void *o, int index);
-_OrsayScanGetVideoOffset = _buildFunction(_library.OrsayScanGetVideoOffset, [c_void_p, c_int], c_double)
+        #void SCAN_EXPORT OrsayScanSetScale(void* o, int sortie, double vx, double vy);
+        _OrsayScanSetScale = _buildFunction(library.OrsayScanSetScale, [c_void_p, c_int, c_double, c_double], None)
 
-#void SCAN_EXPORT OrsayScanSetVideoOffset(void *o, int index, double value);
-_OrsayScanSetVideoOffset = _buildFunction(_library.OrsayScanSetVideoOffset, [c_void_p, c_int, c_double], None)
-#bool SCAN_EXPORT OrsayScanSetFieldSize(self.orsayscan, double field);
-_OrsayScanSetFieldSize = _buildFunction(_library.OrsayScanSetFieldSize, [c_void_p, c_double], c_bool)
+        #void SCAN_EXPORT OrsayScanSetImagingKind(void *o, int gene, int kind);
+        _OrsayScanSetImagingKind = _buildFunction(library.OrsayScanSetImagingKind, [c_void_p, c_int, c_int], None)
 
-#void *(*LockScanDataPointer)(int gene, int *datatype, int *sx, int *sy, int *sz);
-LOCKERFUNC = WINFUNCTYPE(c_void_p, c_int, POINTER(c_int), POINTER(c_int), POINTER(c_int), POINTER(c_int))
-#void SCAN_EXPORT OrsayScanRegisterDataLocker(void * o, void *(*LockScanDataPointer)(int gene, int *datatype, int *sx, int *sy, int *sz));
-_OrsayScanregisterLocker = _buildFunction(_library.OrsayScanRegisterDataLocker, [c_void_p, LOCKERFUNC], None)
+        #int SCAN_EXPORT OrsayScanGetImagingKind(void *o, int gene);
+        _OrsayScanGetImagingKind = _buildFunction(library.OrsayScanGetImagingKind, [c_void_p, c_int], c_int)
 
-#void(*UnLockScanDataPointer)(int gene, bool newdata);
-UNLOCKERFUNC = WINFUNCTYPE(None, c_int, c_bool)
-UNLOCKERFUNCA = WINFUNCTYPE(None, c_int, c_int, c_int, POINTER(c_int))
+        #double SCAN_EXPORT OrsayScanGetVideoOffset(void *o, int index);
+        _OrsayScanGetVideoOffset = _buildFunction(library.OrsayScanGetVideoOffset, [c_void_p, c_int], c_double)
+
+        #void SCAN_EXPORT OrsayScanSetVideoOffset(void *o, int index, double value);
+        _OrsayScanSetVideoOffset = _buildFunction(library.OrsayScanSetVideoOffset, [c_void_p, c_int, c_double], None)
+        #bool SCAN_EXPORT OrsayScanSetFieldSize(self.orsayscan, double field);
+        _OrsayScanSetFieldSize = _buildFunction(library.OrsayScanSetFieldSize, [c_void_p, c_double], c_bool)
+
+        #void SCAN_EXPORT OrsayScanRegisterDataLocker(void * o, void *(*LockScanDataPointer)(int gene, int *datatype, int *sx, int *sy, int *sz));
+        _OrsayScanregisterLocker = _buildFunction(library.OrsayScanRegisterDataLocker, [c_void_p, LOCKERFUNC], None)
+
+
+        #void SCAN_EXPORT OrsayScanRegisterDataUnlocker(void *o, void(*UnLockScanDataPointer)(int gene, bool newdata));
+        _OrsayScanregisterUnlocker = _buildFunction(library.OrsayScanRegisterDataUnlocker, [c_void_p, UNLOCKERFUNC], None)
+        _OrsayScanregisterUnlockerA = _buildFunction(library.OrsayScanRegisterDataUnlockerA, [c_void_p, UNLOCKERFUNCA], None)
 
-#void SCAN_EXPORT OrsayScanRegisterDataUnlocker(void *o, void(*UnLockScanDataPointer)(int gene, bool newdata));
-_OrsayScanregisterUnlocker = _buildFunction(_library.OrsayScanRegisterDataUnlocker, [c_void_p, UNLOCKERFUNC], None)
-_OrsayScanregisterUnlockerA = _buildFunction(_library.OrsayScanRegisterDataUnlockerA, [c_void_p, UNLOCKERFUNCA], None)
+        #bool SCAN_EXPORT OrsayScanSetProbeAt(self.orsayscan, int gene, int px, int py);
+        _OrsayScanSetProbeAt = _buildFunction(library.OrsayScanSetProbeAt, [c_void_p, c_int, c_int, c_int], c_bool)
 
-#bool SCAN_EXPORT OrsayScanSetProbeAt(self.orsayscan, int gene, int px, int py);
-_OrsayScanSetProbeAt = _buildFunction(_library.OrsayScanSetProbeAt, [c_void_p, c_int, c_int, c_int], c_bool)
+        #void SCAN_EXPORT OrsayScanSetEHT(self.orsayscan, double val);
+        _OrsayScanSetEHT = _buildFunction(library.OrsayScanSetEHT, [c_void_p, c_double], None)
 
-#void SCAN_EXPORT OrsayScanSetEHT(self.orsayscan, double val);
-_OrsayScanSetEHT = _buildFunction(_library.OrsayScanSetEHT, [c_void_p, c_double], None)
+        #double SCAN_EXPORT OrsayScanGetEHT(self.orsayscan);
+        _OrsayScanGetEHT = _buildFunction(library.OrsayScanGetEHT, [c_void_p], c_double)
 
-#double SCAN_EXPORT OrsayScanGetEHT(self.orsayscan);
-_OrsayScanGetEHT = _buildFunction(_library.OrsayScanGetEHT, [c_void_p], c_double)
+        #double SCAN_EXPORT OrsayScanGetMaxFieldSize(self.orsayscan);
+        _OrsayScanGetMaxFieldSize = _buildFunction(library.OrsayScanGetMaxFieldSize, [c_void_p], c_double)
 
-#double SCAN_EXPORT OrsayScanGetMaxFieldSize(self.orsayscan);
-_OrsayScanGetMaxFieldSize = _buildFunction(_library.OrsayScanGetMaxFieldSize, [c_void_p], c_double)
+        #double SCAN_EXPORT OrsayScanGetFieldSize(self.orsayscan);
+        _OrsayScanGetFieldSize = _buildFunction(library.OrsayScanGetFieldSize, [c_void_p], c_double)
 
-#double SCAN_EXPORT OrsayScanGetFieldSize(self.orsayscan);
-_OrsayScanGetFieldSize = _buildFunction(_library.OrsayScanGetFieldSize, [c_void_p], c_double)
+        #double SCAN_EXPORT OrsayScanGetScanAngle(self.orsayscan, short *mirror);
+        _OrsayScanGetScanAngle = _buildFunction(library.OrsayScanGetScanAngle, [c_void_p, c_short], c_double)
 
-#double SCAN_EXPORT OrsayScanGetScanAngle(self.orsayscan, short *mirror);
-_OrsayScanGetScanAngle = _buildFunction(_library.OrsayScanGetScanAngle, [c_void_p, c_short], c_double)
 
+        #bool SCAN_EXPORT OrsayScanSetFieldSize(self.orsayscan, double field);
+        _OrsayScanSetFieldSize = _buildFunction(library.OrsayScanSetFieldSize, [c_void_p, c_double], c_bool)
 
-#bool SCAN_EXPORT OrsayScanSetFieldSize(self.orsayscan, double field);
-_OrsayScanSetFieldSize = _buildFunction(_library.OrsayScanSetFieldSize, [c_void_p, c_double], c_bool);
 
+        #bool SCAN_EXPORT OrsayScanSetBottomBlanking(self.orsayscan, short mode, short source, double beamontime, bool risingedge, unsigned int nbpulses, double delay);
+        _OrsayScanSetBottomBlanking = _buildFunction(library.OrsayScanSetBottomBlanking, [c_void_p, c_short, c_double, c_bool, c_uint, c_double], c_bool)
 
-#bool SCAN_EXPORT OrsayScanSetBottomBlanking(self.orsayscan, short mode, short source, double beamontime, bool risingedge, unsigned int nbpulses, double delay);
-_OrsayScanSetBottomBlanking = _buildFunction(_library.OrsayScanSetBottomBlanking, [c_void_p, c_short, c_double, c_bool, c_uint, c_double], c_bool)
+        #bool SCAN_EXPORT OrsayScanSetTopBlanking(self.orsayscan, short mode, short source, double beamontime, bool risingedge, unsigned int nbpulses, double delay);
+        _OrsayScanSetTopBlanking = _buildFunction(library.OrsayScanSetTopBlanking, [c_void_p, c_short, c_double, c_bool, c_uint, c_double], c_bool)
 
-#bool SCAN_EXPORT OrsayScanSetTopBlanking(self.orsayscan, short mode, short source, double beamontime, bool risingedge, unsigned int nbpulses, double delay);
-_OrsayScanSetTopBlanking = _buildFunction(_library.OrsayScanSetTopBlanking, [c_void_p, c_short, c_double, c_bool, c_uint, c_double], c_bool)
 
+        #bool SCAN_EXPORT OrsayScanSetCameraSync(self.orsayscan, bool eels, int divider, double width, bool risingedge);
+        _OrsayScanSetCameraSync = _buildFunction(library.OrsayScanSetCameraSync, [c_void_p, c_bool, c_int, c_double, c_bool], c_bool)
 
-#bool SCAN_EXPORT OrsayScanSetCameraSync(self.orsayscan, bool eels, int divider, double width, bool risingedge);
-_OrsayScanSetCameraSync = _buildFunction(_library.OrsayScanSetCameraSync, [c_void_p, c_bool, c_int, c_double, c_bool], c_bool)
+        #void SCAN_EXPORT OrsayScanObjectiveStigmateur(self.orsayscan, double x, double y);
+        _OrsayScanObjectiveStigmateur = _buildFunction(library.OrsayScanObjectiveStigmateur, [c_void_p, c_double, c_double], None)
 
-#void SCAN_EXPORT OrsayScanObjectiveStigmateur(self.orsayscan, double x, double y);
-_OrsayScanObjectiveStigmateur = _buildFunction(_library.OrsayScanObjectiveStigmateur, [c_void_p, c_double, c_double], None)
+        #void SCAN_EXPORT OrsayScanObjectiveStigmateurCentre(self.orsayscan, double xcx, double xcy, double ycx, double ycy);
+        _OrsayScanObjectiveStigmateurCentre = _buildFunction(library.OrsayScanObjectiveStigmateurCentre, [c_void_p, c_double, c_double, c_double, c_double], None)
 
-#void SCAN_EXPORT OrsayScanObjectiveStigmateurCentre(self.orsayscan, double xcx, double xcy, double ycx, double ycy);
-_OrsayScanObjectiveStigmateurCentre = _buildFunction(_library.OrsayScanObjectiveStigmateurCentre, [c_void_p, c_double, c_double, c_double, c_double], None)
+        #void SCAN_EXPORT OrsayScanCondensorStigmateur(self.orsayscan, double x, double y);
+        _OrsayScanCondensorStigmateur = _buildFunction(library.OrsayScanCondensorStigmateur, [c_void_p, c_double, c_double], None)
 
-#void SCAN_EXPORT OrsayScanCondensorStigmateur(self.orsayscan, double x, double y);
-_OrsayScanCondensorStigmateur = _buildFunction(_library.OrsayScanCondensorStigmateur, [c_void_p, c_double, c_double], None)
+        #void SCAN_EXPORT OrsayScanGrigson(self.orsayscan, double x1, double x2, double y1, double y2);
+        _OrsayScanGrigson = _buildFunction(library.OrsayScanGrigson, [c_void_p, c_double, c_double, c_double, c_double], None)
 
-#void SCAN_EXPORT OrsayScanGrigson(self.orsayscan, double x1, double x2, double y1, double y2);
-_OrsayScanGrigson = _buildFunction(_library.OrsayScanGrigson, [c_void_p, c_double, c_double, c_double, c_double], None)
+        #void SCAN_EXPORT OrsayScanAlObjective(self.orsayscan, double x1, double x2, double y1, double y2);
+        _OrsayScanAlObjective = _buildFunction(library.OrsayScanAlObjective, [c_void_p, c_double, c_double, c_double, c_double], None)
 
-#void SCAN_EXPORT OrsayScanAlObjective(self.orsayscan, double x1, double x2, double y1, double y2);
-_OrsayScanAlObjective = _buildFunction(_library.OrsayScanAlObjective, [c_void_p, c_double, c_double, c_double, c_double], None)
+        #void SCAN_EXPORT OrsayScanAlGun(self.orsayscan, double x1, double x2, double y1, double y2);
+        _OrsayScanAlGun = _buildFunction(library.OrsayScanAlGun, [c_void_p, c_double, c_double, c_double, c_double], None)
 
-#void SCAN_EXPORT OrsayScanAlGun(self.orsayscan, double x1, double x2, double y1, double y2);
-_OrsayScanAlGun = _buildFunction(_library.OrsayScanAlGun, [c_void_p, c_double, c_double, c_double, c_double], None)
+        #void SCAN_EXPORT OrsayScanAlStigObjective(self.orsayscan, double x1, double x2, double y1, double y2);
+        _OrsayScanAlStigObjective = _buildFunction(library.OrsayScanAlStigObjective, [c_void_p, c_double, c_double, c_double, c_double], None)
 
-#void SCAN_EXPORT OrsayScanAlStigObjective(self.orsayscan, double x1, double x2, double y1, double y2);
-_OrsayScanAlStigObjective = _buildFunction(_library.OrsayScanAlStigObjective, [c_void_p, c_double, c_double, c_double, c_double], None)
 
+        #void SCAN_EXPORT OrsayScanSetLaser(self.orsayscan, double frequency, int nbpulses, bool bottomblanking, short sync);
+        _OrsayScanSetLaser = _buildFunction(library.OrsayScanSetLaser, [c_void_p, c_double, c_int, c_bool, c_short], None)
 
-#void SCAN_EXPORT OrsayScanSetLaser(self.orsayscan, double frequency, int nbpulses, bool bottomblanking, short sync);
-_OrsayScanSetLaser = _buildFunction(_library.OrsayScanSetLaser, [c_void_p, c_double, c_int, c_bool, c_short], None)
+        #void SCAN_EXPORT OrsayScanStartLaser(self.orsayscan, int mode);
+        _OrsayScanStartLaser = _buildFunction(library.OrsayScanStartLaser, [c_void_p, c_int], None)
 
-#void SCAN_EXPORT OrsayScanStartLaser(self.orsayscan, int mode);
-_OrsayScanStartLaser = _buildFunction(_library.OrsayScanStartLaser, [c_void_p, c_int], None)
+        #void SCAN_EXPORT OrsayScanCancelLaser(self.orsayscan);
+        _OrsayScanCancelLaser = _buildFunction(library.OrsayScanCancelLaser, [c_void_p], None)
 
-#void SCAN_EXPORT OrsayScanCancelLaser(self.orsayscan);
-_OrsayScanCancelLaser = _buildFunction(_library.OrsayScanCancelLaser, [c_void_p], None)
+        #int SCAN_EXPORT OrsayScanGetLaserCount(self.orsayscan);
+        _OrsayScanGetLaserCount = _buildFunction(library.OrsayScanGetLaserCount, [c_void_p], c_int)
 
-#int SCAN_EXPORT OrsayScanGetLaserCount(self.orsayscan);
-_OrsayScanGetLaserCount = _buildFunction(_library.OrsayScanGetLaserCount, [c_void_p], c_int)
+        globals().update((name, value if name == "_OrsayScanInit" else _serializedFunction(value))
+                         for name, value in locals().items() if name.startswith("_OrsayScan"))
+        instrumentation.register_functions(globals(), "_OrsayScan")
+        _library = library
+
+
+def __getattr__(name):
+    if name.startswith("_OrsayScan"):
+        _initLibrary()
+        if name in globals():
+            return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+_sharedHandle = None  # handle of the scan device shared by the orsayScan(1, shared=True) objects
+_sharedUsers = 0
+_sharedLock = threading.Lock()
+
+def acquireScanHandle():
+    """
+    Handle of the scan device shared by the plugins of the process, initialized by the first call.
+    Each call must be balanced by a call to releaseScanHandle, the last one closes the handle.
+    """
+    global _sharedHandle, _sharedUsers
+    _initLibrary()
+    with _sharedLock:
+        if _sharedHandle is None:
+            _sharedHandle = _openHandle()
+        _sharedUsers += 1
+        return _sharedHandle
+
+def releaseScanHandle(handle):
+    global _sharedHandle, _sharedUsers
+    with _sharedLock:
+        if handle is None or handle != _sharedHandle:
+            raise ValueError("Not the shared scan handle")
+        _sharedUsers -= 1
+        if _sharedUsers > 0:
+            return
+        _sharedHandle = None
+    _closeHandle(handle)
+
+def _openHandle():
+    """
+    Initialize a handle of the scan device, with the executor of its calls.
+    """
+    handle = _OrsayScanInit()
+    _executors[handle] = ScanExecutor()
+    _caches[handle] = StateCache(_executors[handle].lock)
+    return handle
+
+def _closeHandle(handle):
+    _OrsayScanClose(handle)
+    _caches.pop(handle, None)
+    executor = _executors.pop(handle, None)
+    if executor is not None:
+        executor.stop()
 
 class orsayScan(object):
     """Class controlling orsay scan hardware
        Requires Scan.dll library to run.
     """
 
-    def __init__(self, gene, scandllobject = 0):
+    def __init__(self, gene, scandllobject = 0, shared = False):
+        """
+        gene 1 opens the scan device, with the handle shared by the plugins of the process if shared (see
+        acquireScanHandle). gene 2 (SPIM) uses the handle scandllobject of a gene 1 object and does not close it.
+        """
+        _initLibrary()
         self.gene = gene
+        self.shared = shared and gene < 2
         cproduct = c_short()
         crevision = c_short()
         cserialnumber = c_short()
         cmajor = c_short()
         cminor = c_short()
         if (gene < 2):
-            self.orsayscan = _OrsayScanInit()
+            self.orsayscan = acquireScanHandle() if self.shared else _openHandle()
         if (gene > 1):
             self.orsayscan = scandllobject
         _OrsayScangetVersion(self.orsayscan, byref(cproduct), byref(crevision), byref(cserialnumber), byref(cmajor), byref(cminor))
@@ -234,11 +352,60 @@ class orsayScan(object):
         self._major = cmajor.value
         self._minor = cminor.value
         if self._major < 5:
+            self.close()
             raise AttributeError("No device connected")
 
     def close(self):
-        _OrsayScanClose(self.orsayscan)
-        self.orsaycamera = None
+        """
+        Release the handle, closed if not shared with other users. Further calls do nothing.
+        """
+        if self.orsayscan is None:
+            return
+        if self.gene < 2:
+            if self.shared:
+                releaseScanHandle(self.orsayscan)
+            else:
+                _closeHandle(self.orsayscan)
+        self.orsayscan = None
+
+    @property
+    def executor(self) -> ScanExecutor:
+        """
+        Thread executing the dll calls of the handle, see scan_executor.
+        """
+        executor = _executors.get(self.orsayscan, None)
+        if executor is None:
+            raise RuntimeError("The scan handle is closed")
+        return executor
+
+    @property
+    def cache(self) -> StateCache:
+        """
+        Settings of the handle, shared by its users, see state_cache.
+        """
+        cache = _caches.get(self.orsayscan, None)
+        return cache if cache is not None else StateCache()  # closed handle, nothing cached
+
+    def invalidateCache(self):
+        """
+        Forget the cached settings, read again from the dll by the next getter calls.
+        """
+        self.cache.invalidate()
+
+    def submit(self, function, *args):
+        """
+        Queue function(*args) (e.g. a method of this object) in the executor, returns a concurrent.futures.Future.
+        """
+        return self.executor.submit(function, *args)
+
+    def batch(self, wait = True):
+        """
+        Context manager giving a ScanBatch, whose calls are executed as a single job of the executor:
+            with scan.batch() as batch:
+                batch.submit(scan.setImageSize, 512, 512)
+                batch.submit(scan.setScanRotation, 0.)
+        """
+        return self.executor.batch(wait)
 
     def __verifyUnsigned32Bit(self, value):
         """
@@ -268,28 +435,31 @@ class orsayScan(object):
         if(value < 0 or value > 0x7fffffff):
             raise AttributeError("Argument out of range (must be positive 32bit signed).")
 
-    def getInputsCount(self) -> int:
+    def getInputsCount(self, refresh = False) -> int:
         """
         Donne le nombre d'entrées vidéo actives
         """
-        return _OrsayScangetInputsCount(self.orsayscan)
+        return self.cache.get(('inputs_count',), lambda: _OrsayScangetInputsCount(self.orsayscan), refresh)
 
-    def getInputProperties(self, input : int) -> (int, float, str, int):
+    def getInputProperties(self, input : int, refresh = False) -> (int, float, str, int):
         """
         Lit les propriétés de l'entrée vidéo
         Retourne 3 valeurs: bool vrai si unipolaire, double offset, string nom, index de l'entrée.
         """
-        unipolar = c_bool()
-        offset = c_double()
-        buffer = _createCharBuffer23(100)
-        res = _OrsayScanGetInputProperties(self.orsayscan, input, byref(unipolar), byref(offset), buffer)
-        return unipolar.value, offset.value, _convertToString23(buffer.value), input
+        def read():
+            unipolar = c_bool()
+            offset = c_double()
+            buffer = _createCharBuffer23(100)
+            res = _OrsayScanGetInputProperties(self.orsayscan, input, byref(unipolar), byref(offset), buffer)
+            return unipolar.value, offset.value, _convertToString23(buffer.value), input
+        return self.cache.get(('input_properties', input), read, refresh)
 
     def setInputProperties(self, input : int, unipolar : bool, offset : float) -> bool:
         """
         change les propriétés de l'entrée vidéo
         Pour le moment, seul l'offset est utilisé.
         """
+        self.cache.invalidate(('input_properties', input))
         res =_OrsayScanSetInputProperties(self.orsayscan, input, offset)
         if (not res):
             raise Exception("Failed to set orsayscan input properties")
@@ -311,18 +481,23 @@ class orsayScan(object):
         while (k < len(inputs)):
             inputarray[k] = inputs[k]
             k = k +1
-        return _OrsayScanSetInputs(self.orsayscan, self.gene, len(inputarray), inputarray)
+        return self.cache.set(('inputs', self.gene), list(inputs),
+                              lambda: _OrsayScanSetInputs(self.orsayscan, self.gene, len(inputarray), inputarray),
+                              exact=False)
 
-    def GetInputs(self) ->(int, []):
+    def GetInputs(self, refresh = False) ->(int, []):
         """
         Donne la liste des entrées utilisées
         """
-        inputarray = (c_int * 20)()
-        nbinputs = _OrsayScanGetInputs(self.orsayscan, self.gene, inputarray)
-        inputs = []
-        for inp in range(0, nbinputs):
-            inputs.append(inputarray[inp])
-        return nbinputs, inputs
+        def read():
+            inputarray = (c_int * 20)()
+            nbinputs = _OrsayScanGetInputs(self.orsayscan, self.gene, inputarray)
+            inputs = []
+            for inp in range(0, nbinputs):
+                inputs.append(inputarray[inp])
+            return nbinputs, inputs
+        nbinputs, inputs = self.cache.get(('inputs', self.gene), read, refresh)
+        return nbinputs, list(inputs)
 
     def setImageSize(self, sizex : int, sizey : int) -> bool:
         """
@@ -331,22 +506,26 @@ class orsayScan(object):
         """
         self.__verifyPositiveInt(sizex)
         self.__verifyPositiveInt(sizey)
-        res = _OrsayScansetImageSize(self.orsayscan, self.gene, sizex, sizey)
-        if (not res):
-            raise Exception("Failed to set orsayscan image size")
+        def write():
+            res = _OrsayScansetImageSize(self.orsayscan, self.gene, sizex, sizey)
+            if (not res):
+                raise Exception("Failed to set orsayscan image size")
+        self.cache.set(('image_size', self.gene), (sizex, sizey), write, invalidates=[('image_area', self.gene)])
 
-    def getImageSize(self) -> (int, int):
+    def getImageSize(self, refresh = False) -> (int, int):
         """
         Donne la taille de l'image
         *** il est impératif que le tableau passé à la callback ait cette taille
             multiplié par le nombre d'entrées, multiplié par le paramètre lineaveragng ***
         """
-        sx = c_int()
-        sy = c_int()
-        res = _OrsayScangetImageSize(self.orsayscan, self.gene, byref(sx), byref(sy))
-        if (not res):
-            raise Exception("Failed to get orsayscan image size")
-        return int(sx.value), int(sy.value)
+        def read():
+            sx = c_int()
+            sy = c_int()
+            res = _OrsayScangetImageSize(self.orsayscan, self.gene, byref(sx), byref(sy))
+            if (not res):
+                raise Exception("Failed to get orsayscan image size")
+            return int(sx.value), int(sy.value)
+        return self.cache.get(('image_size', self.gene), read, refresh)
 
     def setImageArea(self, sizex : int, sizey : int, startx : int, endx : int, starty : int, endy : int) -> bool:
         """
@@ -357,30 +536,36 @@ class orsayScan(object):
         """
 #        self.__verifyStrictlyPositiveInt(sizex)
 #        self.__verifyStrictlyPositiveInt(sizey)
-        return _OrsayScansetImageArea(self.orsayscan, self.gene, sizex, sizey, startx, endx, starty, endy)
+        return self.cache.set(('image_area', self.gene), (sizex, sizey, startx, endx, starty, endy),
+                              lambda: _OrsayScansetImageArea(self.orsayscan, self.gene, sizex, sizey,
+                                                             startx, endx, starty, endy),
+                              exact=False, invalidates=[('image_size', self.gene)])
 
-    def getImageArea(self) -> (bool, int, int, int, int, int, int):
+    def getImageArea(self, refresh = False) -> (bool, int, int, int, int, int, int):
         """
         Donne l'aire réduite utilisée,
         retourne les paramètres donnés à la fonction setImageArea ou ceux les plus proches valides.
         """
-        sx, sy, stx, ex, sty, ey = c_int(), c_int(), c_int(), c_int(), c_int(), c_int()
-        res = _OrsayScangetImageArea(self.orsayscan, self.gene, byref(sx), byref(sy), byref(stx), byref(ex), byref(sty), byref(ey))
-        return res, int(sx.value), int(sy.value), int(stx.value), int(ex.value), int(sty.value), int(ey.value)
+        def read():
+            sx, sy, stx, ex, sty, ey = c_int(), c_int(), c_int(), c_int(), c_int(), c_int()
+            res = _OrsayScangetImageArea(self.orsayscan, self.gene, byref(sx), byref(sy), byref(stx), byref(ex), byref(sty), byref(ey))
+            return res, int(sx.value), int(sy.value), int(stx.value), int(ex.value), int(sty.value), int(ey.value)
+        return self.cache.get(('image_area', self.gene), read, refresh)
 
     @property
     def pixelTime(self) -> float:
         """
         Donne le temps par pixel
         """
-        return _OrsayScangetPose(self.orsayscan, self.gene)
+        return self.cache.get(('pixel_time', self.gene), lambda: _OrsayScangetPose(self.orsayscan, self.gene))
 
     @pixelTime.setter
     def pixelTime(self, value : float):
         """
         Définit le temps par pixel
         """
-        _OrsayScansetPose(self.orsayscan, self.gene, value)
+        self.cache.set(('pixel_time', self.gene), value, lambda: _OrsayScansetPose(self.orsayscan, self.gene, value),
+                       exact=False)
 
 
     #
@@ -460,18 +645,20 @@ class orsayScan(object):
         """
         Définit l'angle de rotation du balayage de l'image
         """
-        _OrsayScanSetRotation(self.orsayscan, angle)
+        self.cache.set(('rotation',), angle, lambda: _OrsayScanSetRotation(self.orsayscan, angle), exact=False,
+                       invalidates=[('max_field',), ('field',)])
 
-    def getScanRotation(self) -> float:
+    def getScanRotation(self, refresh = False) -> float:
         """
         Relit la valeur de l'angle de rotation du balayage de l'image
         """
-        return _OrsayScanGetRotation(self.orsayscan)
+        return self.cache.get(('rotation',), lambda: _OrsayScanGetRotation(self.orsayscan), refresh)
 
     def setScanScale(self, plug, xamp : float, yamp : float):
         """
         Ajuste la taille des signaux analogiques de balayage valeur >0 et inf"rieure à 1.
         """
+        self.cache.invalidate(('max_field',), ('field',))
         _OrsayScanSetScale(self.orsayscan, plug, xamp, yamp)
 
     def getImagingKind(self) -> int:
@@ -497,25 +684,26 @@ class orsayScan(object):
 
    #void SCAN_EXPORT OrsayScanSetEHT(self.orsayscan, double val);
     def SetEHT(self, val):
+        self.cache.invalidate(('max_field',), ('field',))
         _OrsayScanSetEHT(self.orsayscan,val)
 
     def GetEHT(self, val):
         return _OrsayScanGetEHT(self.orsayscan,val)
 
    #double SCAN_EXPORT OrsayScanGetMaxFieldSize(self.orsayscan);
-    def GetMaxFieldSize(self):
-        return _OrsayScanGetMaxFieldSize(self.orsayscan)
+    def GetMaxFieldSize(self, refresh = False):
+        return self.cache.get(('max_field',), lambda: _OrsayScanGetMaxFieldSize(self.orsayscan), refresh)
 
    #double SCAN_EXPORT OrsayScanGetFieldSize(self.orsayscan);
-    def GetFieldSize(self):
-        return _OrsayScanGetFieldSize(self.orsayscan)
+    def GetFieldSize(self, refresh = False):
+        return self.cache.get(('field',), lambda: _OrsayScanGetFieldSize(self.orsayscan), refresh)
 
    #double SCAN_EXPORT OrsayScanGetScanAngle(self.orsayscan, short *mirror);
     def GetScanAngle(self,mirror):
         return _OrsayScanGetScanAngle(self.orsayscan, mirror)
    #bool SCAN_EXPORT OrsayScanSetFieldSize(self.orsayscan, double field);
     def SetFieldSize(self,field):
-        return _OrsayScanSetFieldSize(self.orsayscan,  field)
+        return self.cache.set(('field',), field, lambda: _OrsayScanSetFieldSize(self.orsayscan,  field), exact=False)
 
    #bool SCAN_EXPORT OrsayScanSetBottomBlanking(self.orsayscan, short mode, short source, double beamontime, bool risingedge, unsigned int nbpulses, double delay);
     def SetBottomBlanking(self,mode,source,beamontime=0,risingedge=True,nbpulses=0,delay=0):
@@ -3,8 +3,8 @@ from . import orsayscan
 
 class OrsayScanPosition(orsayscan.orsayScan):
 
-    def __init__(self, gene, scandllobject=0):
-        super().__init__(gene, scandllobject)
+    def __init__(self, gene, scandllobject=0, shared=False):
+        super().__init__(gene, scandllobject, shared)
 
         self.x = 0
         self.y = 0
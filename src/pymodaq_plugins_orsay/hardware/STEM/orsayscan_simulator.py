@@ -0,0 +1,474 @@
+"""
+Pure python/numpy simulation of the Scan.dll library.
+
+The module exposes the same entry points as the dll (OrsayScanInit, OrsayScansetImageSize, OrsayScanStartImaging...)
+so that orsayscan can bind its prototypes to it instead of the vendor library. Each handle returned by OrsayScanInit
+is backed by a SimulatedScanDevice whose worker threads fill the buffer given by the locker callback and call the
+unlocker callbacks with the same rect/imagenb sequencing as the hardware, paced by the pixel time.
+"""
+import ctypes
+import itertools
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+#: numpy equivalent of the data type codes returned by the locker callbacks
+DATA_TYPES = {1: np.int8, 2: np.int16, 3: np.int32, 5: np.uint8, 6: np.uint16, 7: np.uint32,
+              11: np.float32, 12: np.float64}
+
+#: simulated video inputs: (name, unipolar, offset)
+INPUTS = [("BF", False, 0.), ("HADF", True, 0.), ("MADF", True, 0.), ("SE", True, 0.),
+          ("EELS", True, 0.), ("CL", True, 0.), ("X ramp", False, 0.), ("Y ramp", False, 0.)]
+
+VERSION = (2, 1, 1234, 5, 3)  # product, revision, serial number, major, minor
+MAX_FIELD = 4e-6
+SPIM_GENE = 2
+
+#: multiplicative factor applied to the scan duration (0 delivers the frames as fast as possible)
+time_scale = float(os.environ.get("ORSAY_SIMULATOR_TIME_SCALE", 1.))
+#: minimum time between two unlocker calls while a frame is being scanned
+update_period = 0.02
+
+_handle_counter = itertools.count(0x1000)
+_devices = {}
+
+
+def _store(ref, value):
+    """ Write value into a c object passed as byref, pointer or directly """
+    obj = getattr(ref, "_obj", None)
+    if obj is None:
+        obj = ref.contents if hasattr(ref, "contents") else ref
+    obj.value = value
+
+
+class _Generator:
+    """ Scan parameters of one generator (gene) """
+    def __init__(self):
+        self.size = (512, 512)
+        self.area = (512, 512, 0, 512, 0, 512)
+        self.pose = 1e-5
+        self.inputs = [1, 0]
+        self.clock = 0
+        self.imaging_mode = 0
+        self.kind = 0
+        self.thread: threading.Thread = None
+        self.cancel = threading.Event()
+        self.stop_at_end_of_frame = False
+
+
+class SimulatedScanDevice:
+    """ State of one simulated scan unit, equivalent of the object returned by OrsayScanInit """
+
+    def __init__(self):
+        self.time_scale = time_scale
+        self.update_period = update_period
+        self.inputs = list(INPUTS)
+        self.genes = {0: _Generator(), 1: _Generator(), SPIM_GENE: _Generator()}
+        self.rotation = 0.
+        self.field = MAX_FIELD / 10
+        self.eht = 100.
+        self.scale = {}
+        self.probe = (0, 0)
+        self.scans_count = 0
+        self.laser_count = 0
+        self.locker = None
+        self.unlocker = None
+        self.unlockerA = None
+        self._patterns = {}
+        self._lock = threading.Lock()
+
+    def gene(self, gene) -> _Generator:
+        if gene not in self.genes:
+            self.genes[gene] = _Generator()
+        return self.genes[gene]
+
+    def pattern(self, input_index, sx, sy):
+        """ Synthetic int32 image of an input, depending on field and rotation, cached between frames """
+        key = (input_index, sx, sy, self.field, self.rotation)
+        if key not in self._patterns:
+            if len(self._patterns) > 32:
+                self._patterns.clear()
+            name = self.inputs[input_index][0] if input_index < len(self.inputs) else ''
+            y, x = np.mgrid[0:sy, 0:sx].astype(np.float32)
+            if name == "X ramp":
+                image = x * (32000 / max(1, sx - 1))
+            elif name == "Y ramp":
+                image = y * (32000 / max(1, sy - 1))
+            else:
+                angle = np.deg2rad(self.rotation)
+                period = 8 * MAX_FIELD / max(self.field, 1e-12) * max(sx, sy) / 512
+                u = (np.cos(angle) * x + np.sin(angle) * y) * 2 * np.pi / period
+                v = (-np.sin(angle) * x + np.cos(angle) * y) * 2 * np.pi / period
+                image = (np.cos(u) * np.cos(v)) ** 2 * 12000 * (1 + input_index % 3)
+                if name == "BF":
+                    image = 30000 - image
+            self._patterns[key] = image.astype(np.int32)
+        return self._patterns[key]
+
+    def start(self, gene, spim=False):
+        gen = self.gene(gene)
+        if gen.thread is not None and gen.thread.is_alive():
+            if gen.thread is threading.current_thread():
+                return False
+            gen.cancel.set()
+            gen.thread.join()
+        gen.cancel.clear()
+        gen.stop_at_end_of_frame = spim
+        gen.kind = 2 if spim else 1
+        gen.thread = threading.Thread(target=self._scan, args=(gene, gen), daemon=True,
+                                      name=f"OrsayScanSimulator gene {gene}")
+        gen.thread.start()
+        return True
+
+    def stop(self, gene, cancel):
+        gen = self.gene(gene)
+        if cancel:
+            gen.cancel.set()
+        else:
+            gen.stop_at_end_of_frame = True
+        return True
+
+    def close(self):
+        for gen in self.genes.values():
+            gen.cancel.set()
+        for gen in self.genes.values():
+            if gen.thread is not None and gen.thread is not threading.current_thread():
+                gen.thread.join()
+
+    def _lock_buffer(self, gene):
+        """ Call the locker callback, returns a (sz, sy, sx) view of the user buffer or None """
+        if self.locker is None:
+            return None
+        datatype, sx, sy, sz = ctypes.c_int(2), ctypes.c_int(0), ctypes.c_int(0), ctypes.c_int(1)
+        address = self.locker(gene, ctypes.pointer(datatype), ctypes.pointer(sx), ctypes.pointer(sy),
+                              ctypes.pointer(sz))
+        if not address:
+            return None
+        dtype = np.dtype(DATA_TYPES[datatype.value % 100])
+        shape = (sz.value, sy.value, sx.value)
+        buffer = (ctypes.c_char * (int(np.prod(shape)) * dtype.itemsize)).from_address(address)
+        return np.frombuffer(buffer, dtype=dtype).reshape(shape)
+
+    def _unlock(self, gene, newdata, imagenb, rect):
+        if self.unlockerA is not None:
+            self.unlockerA(gene, newdata, imagenb, (ctypes.c_int * 4)(*rect))
+        if self.unlocker is not None:
+            self.unlocker(gene, newdata)
+
+    def _scan(self, gene, gen: _Generator):
+        imagenb = 0
+        deadline = time.perf_counter()
+        while not gen.cancel.is_set():
+            deadline = self._scan_frame(gene, gen, imagenb, deadline)
+            if deadline is None:
+                break
+            imagenb += 1
+            self.scans_count += 1
+            if gen.stop_at_end_of_frame:
+                break
+            deadline = max(deadline, time.perf_counter())
+        gen.kind = 0
+
+    def _scan_frame(self, gene, gen: _Generator, imagenb, deadline):
+        """ Scan one frame by bands of lines, returns the updated deadline or None if cancelled """
+        with self._lock:
+            size_x, size_y, xd, xf, yd, yf = gen.area
+            inputs = list(gen.inputs)
+            pose = gen.pose
+        width = xf - xd
+        line_time = width * pose * self.time_scale
+        nrows = max(1, math.ceil(self.update_period / line_time)) if line_time > 0 else yf - yd
+        for y0 in range(yd, yf, nrows):
+            y1 = min(yf, y0 + nrows)
+            deadline += (y1 - y0) * line_time
+            if gen.cancel.wait(max(0., deadline - time.perf_counter())):
+                return None
+            frame = self._lock_buffer(gene)
+            if frame is None:
+                self._unlock(gene, False, imagenb, (xd, y0, width, 0))
+                continue
+            rows, cols = slice(y0, min(y1, frame.shape[1])), slice(xd, min(xf, frame.shape[2]))
+            for ind in range(frame.shape[0]):
+                pattern = self.pattern(inputs[min(ind, len(inputs) - 1)], size_x, size_y)
+                np.add(pattern[rows, cols], imagenb % 64, out=frame[ind, rows, cols], casting='unsafe')
+            # the band completing the frame already reports the incremented image number
+            self._unlock(gene, True, imagenb + 1 if y1 == yf else imagenb, (xd, y0, width, y1 - y0))
+        return deadline
+
+
+def get_device(o) -> SimulatedScanDevice:
+    """ Returns the simulated device behind a handle, for instance to change its time_scale """
+    try:
+        return _devices[o]
+    except KeyError:
+        raise ValueError(f"Invalid simulated scan handle: {o}")
+
+
+def OrsayScanInit():
+    handle = next(_handle_counter)
+    _devices[handle] = SimulatedScanDevice()
+    return handle
+
+
+def OrsayScanClose(o):
+    device = _devices.pop(o, None)
+    if device is not None:
+        device.close()
+
+
+def OrsayScangetVersion(o, product, revision, serialnumber, major, minor):
+    get_device(o)
+    for ref, value in zip((product, revision, serialnumber, major, minor), VERSION):
+        _store(ref, value)
+
+
+def OrsayScanGetInputsCount(o):
+    return len(get_device(o).inputs)
+
+
+def OrsayScanGetInputProperties(o, nb, unipolar, offset, buffer):
+    name, unipolar_value, offset_value = get_device(o).inputs[nb]
+    _store(unipolar, unipolar_value)
+    _store(offset, offset_value)
+    buffer.value = name.encode("utf-8")
+    return nb
+
+
+def OrsayScanSetInputProperties(o, nb, unipolar, offset):
+    device = get_device(o)
+    device.inputs[nb] = (device.inputs[nb][0], bool(unipolar), float(offset))
+    return True
+
+
+def OrsayScansetImageSize(o, gene, x, y):
+    if not (1 <= x <= 8192 and 1 <= y <= 8192):
+        return False
+    device = get_device(o)
+    with device._lock:
+        gen = device.gene(gene)
+        gen.size = (x, y)
+        gen.area = (x, y, 0, x, 0, y)
+    return True
+
+
+def OrsayScangetImageSize(o, gene, x, y):
+    sx, sy = get_device(o).gene(gene).size
+    _store(x, sx)
+    _store(y, sy)
+    return True
+
+
+def OrsayScansetImageArea(o, gene, sx, sy, xd, xf, yd, yf):
+    xd, yd = max(0, min(xd, sx - 1)), max(0, min(yd, sy - 1))
+    xf, yf = max(xd + 1, min(xf, sx)), max(yd + 1, min(yf, sy))
+    device = get_device(o)
+    with device._lock:
+        gen = device.gene(gene)
+        gen.size = (sx, sy)
+        gen.area = (sx, sy, xd, xf, yd, yf)
+    return True
+
+
+def OrsayScangetImageArea(o, gene, sx, sy, xd, xf, yd, yf):
+    for ref, value in zip((sx, sy, xd, xf, yd, yf), get_device(o).gene(gene).area):
+        _store(ref, value)
+    return True
+
+
+def OrsayScangetPose(o, gene):
+    return get_device(o).gene(gene).pose
+
+
+def OrsayScansetPose(o, gene, time):
+    get_device(o).gene(gene).pose = max(1e-8, float(time))
+    return True
+
+
+def OrsayScanGetImageTime(o, gene):
+    gen = get_device(o).gene(gene)
+    _, _, xd, xf, yd, yf = gen.area
+    return (xf - xd) * (yf - yd) * gen.pose
+
+
+def OrsayScanSetInputs(o, gene, nb, inputs):
+    device = get_device(o)
+    with device._lock:
+        device.gene(gene).inputs = [inputs[ind] for ind in range(nb)]
+    return True
+
+
+def OrsayScanGetInputs(o, gene, inputs):
+    used = get_device(o).gene(gene).inputs
+    for ind, value in enumerate(used):
+        inputs[ind] = value
+    return len(used)
+
+
+def OrsayScanSetRotation(o, angle):
+    get_device(o).rotation = float(angle)
+
+
+def OrsayScanGetRotation(o):
+    return get_device(o).rotation
+
+
+def OrsayScanStartImaging(o, gene, mode, lineaverage):
+    device = get_device(o)
+    device.gene(gene).imaging_mode = mode
+    return device.start(gene)
+
+
+def OrsayScanStartSpim(o, gene, mode, lineaverage, nbspectraperpixel, sumspectra):
+    device = get_device(o)
+    device.gene(gene).imaging_mode = mode
+    return device.start(gene, spim=True)
+
+
+def OrsayScanStopImaging(o, gene, cancel):
+    return get_device(o).stop(gene, cancel)
+
+
+def OrsayScanStopImagingA(o, gene, immediate):
+    return get_device(o).stop(gene, immediate)
+
+
+def OrsayScanSetImagingMode(o, gene, stripes):
+    get_device(o).gene(gene).imaging_mode = stripes
+
+
+def OrsayScanSetScanClock(o, gene, mode):
+    get_device(o).gene(gene).clock = mode
+    return True
+
+
+def OrsayScanGetScansCount(o):
+    return get_device(o).scans_count
+
+
+def OrsayScanSetScale(o, sortie, vx, vy):
+    get_device(o).scale[sortie] = (vx, vy)
+
+
+def OrsayScanSetImagingKind(o, gene, kind):
+    get_device(o).gene(gene).kind = kind
+
+
+def OrsayScanGetImagingKind(o, gene):
+    return get_device(o).gene(gene).kind
+
+
+def OrsayScanGetVideoOffset(o, index):
+    return get_device(o).inputs[index][2]
+
+
+def OrsayScanSetVideoOffset(o, index, value):
+    device = get_device(o)
+    device.inputs[index] = (device.inputs[index][0], device.inputs[index][1], float(value))
+
+
+def OrsayScanSetFieldSize(o, field):
+    device = get_device(o)
+    if not 0 < field <= MAX_FIELD:
+        return False
+    device.field = float(field)
+    return True
+
+
+def OrsayScanRegisterDataLocker(o, locker):
+    get_device(o).locker = locker
+
+
+def OrsayScanRegisterDataUnlocker(o, unlocker):
+    get_device(o).unlocker = unlocker
+
+
+def OrsayScanRegisterDataUnlockerA(o, unlocker):
+    get_device(o).unlockerA = unlocker
+
+
+def OrsayScanSetProbeAt(o, gene, px, py):
+    get_device(o).probe = (px, py)
+    return True
+
+
+def OrsayScanSetEHT(o, val):
+    get_device(o).eht = float(val)
+
+
+def OrsayScanGetEHT(o):
+    return get_device(o).eht
+
+
+def OrsayScanGetMaxFieldSize(o):
+    get_device(o)
+    return MAX_FIELD
+
+
+def OrsayScanGetFieldSize(o):
+    return get_device(o).field
+
+
+def OrsayScanGetScanAngle(o, mirror):
+    return get_device(o).rotation
+
+
+def OrsayScanSetBottomBlanking(o, *args):
+    get_device(o)
+    return True
+
+
+def OrsayScanSetTopBlanking(o, *args):
+    get_device(o)
+    return True
+
+
+def OrsayScanSetCameraSync(o, eels, divider, width, risingedge):
+    get_device(o)
+    return True
+
+
+def OrsayScanObjectiveStigmateur(o, x, y):
+    get_device(o)
+
+
+def OrsayScanObjectiveStigmateurCentre(o, xcx, xcy, ycx, ycy):
+    get_device(o)
+
+
+def OrsayScanCondensorStigmateur(o, x, y):
+    get_device(o)
+
+
+def OrsayScanGrigson(o, x1, x2, y1, y2):
+    get_device(o)
+
+
+def OrsayScanAlObjective(o, x1, x2, y1, y2):
+    get_device(o)
+
+
+def OrsayScanAlGun(o, x1, x2, y1, y2):
+    get_device(o)
+
+
+def OrsayScanAlStigObjective(o, x1, x2, y1, y2):
+    get_device(o)
+
+
+def OrsayScanSetLaser(o, frequency, nbpulses, bottomblanking, sync):
+    get_device(o)
+
+
+def OrsayScanStartLaser(o, mode):
+    get_device(o).laser_count += 1
+
+
+def OrsayScanCancelLaser(o):
+    get_device(o)
+
+
+def OrsayScanGetLaserCount(o):
+    return get_device(o).laser_count
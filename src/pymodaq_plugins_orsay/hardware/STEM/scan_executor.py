@@ -0,0 +1,126 @@
+"""
+Serialized access to a Scan.dll handle.
+
+A handle is used from the Qt thread (settings, timers of the actuators), from the plugin threads and from the callback
+queues, possibly by several plugins sharing it (see orsayscan.acquireScanHandle). One ScanExecutor per handle
+serializes its dll calls: orsayscan routes every call made with the handle to its executor.
+
+submit queues a call to the executor thread and returns a concurrent.futures.Future. batch groups a burst of calls
+(image size, area, rotation, field...) in a single job: one round trip of the queue instead of one per call, and no
+call of another thread in between. The synchronous calls (the orsayScan methods) and the batches waited for are
+executed in the calling thread while holding the lock of the executor, also held by its thread while executing a job:
+waking the executor thread for them would add its latency to every dll call while the caller waits anyway (a third of
+the capture rate of the STEM viewer on the simulator, whose thread holds the GIL while scanning).
+"""
+from concurrent.futures import Future
+from contextlib import contextmanager
+import queue
+import threading
+
+
+def _execute(future: Future, function, args, kwargs):
+    if not future.set_running_or_notify_cancel():
+        return
+    try:
+        result = function(*args, **kwargs)
+    except BaseException as e:
+        future.set_exception(e)
+    else:
+        future.set_result(result)
+
+
+class ScanBatch:
+    """ Calls collected by ScanExecutor.batch, executed in order in a single job of the executor """
+
+    def __init__(self):
+        self.calls = []  # (future, function, args, kwargs)
+
+    def submit(self, function, *args, **kwargs) -> Future:
+        future = Future()
+        self.calls.append((future, function, args, kwargs))
+        return future
+
+    def run(self):
+        for call in self.calls:
+            _execute(*call)
+
+
+class ScanExecutor:
+    """ Thread executing the submitted calls in the order of submission, one at a time with the synchronous calls """
+
+    def __init__(self, name='OrsayScanExecutor'):
+        self.jobs = 0
+        self._queue = queue.SimpleQueue()
+        self._running = True
+        self._lock = threading.Lock()  # no job is queued after the end of the thread
+        self._call_lock = threading.RLock()  # held during each dll call or job
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            with self._call_lock:
+                job.run()
+            self.jobs += 1
+
+    @property
+    def lock(self) -> threading.RLock:
+        """ Lock held during each dll call or job """
+        return self._call_lock
+
+    @property
+    def in_executor_thread(self) -> bool:
+        return threading.get_ident() == self._thread.ident
+
+    def _submit_job(self, job: ScanBatch):
+        if not self.in_executor_thread:
+            with self._lock:
+                if self._running:
+                    self._queue.put(job)
+                    return
+        with self._call_lock:  # nested calls, or calls after stop that would never be executed
+            job.run()
+
+    def submit(self, function, *args, **kwargs) -> Future:
+        """ Queue function(*args, **kwargs), the returned future holds its result or exception """
+        job = ScanBatch()
+        future = job.submit(function, *args, **kwargs)
+        self._submit_job(job)
+        return future
+
+    def call(self, function, *args):
+        """ Execute function(*args) in the calling thread, not concurrently with the other calls and jobs """
+        with self._call_lock:
+            return function(*args)
+
+    @contextmanager
+    def batch(self, wait=True):
+        """ Context manager giving a ScanBatch whose calls are executed as one job when leaving the context
+
+        If wait, the job is executed by the calling thread, raising the first exception raised by its calls, else it
+        is queued to the executor thread.
+        """
+        job = ScanBatch()
+        yield job
+        if not job.calls:
+            return
+        if not wait:
+            self._submit_job(job)
+            return
+        with self._call_lock:
+            job.run()
+        for future, *_ in job.calls:
+            future.result()
+
+    def stop(self):
+        """ Execute the queued jobs and stop the thread, the next calls are executed directly """
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+            self._queue.put(None)
+        if not self.in_executor_thread:
+            self._thread.join(5.)
@@ -0,0 +1,123 @@
+"""
+Streaming of SPIM spectra to a HDF5 file while the acquisition is running.
+
+The spectra given by the camera callbacks are copied into blocks taken from a fixed pool. Full blocks are appended by a
+writer thread to a chunked, extendable dataset (one row per spectrum) and the file is flushed after each block, so
+that the memory used is bounded by the pool and the spectra already acquired are on disk if the acquisition or the
+program stops unexpectedly.
+"""
+import queue
+import threading
+
+import numpy as np
+import tables
+
+
+class SpimWriter:
+    """ Append spectra to the /spim dataset of a HDF5 file from a background thread
+
+    Parameters
+    ----------
+    path: str or Path
+        HDF5 file to be created (overwritten if it exists)
+    spectrum_length: int
+        number of points of each spectrum
+    nspectra: int
+        expected number of spectra (used to size the chunks), more can be added
+    spim_shape: tuple of int
+        shape of the scan (ny, nx) saved as attribute of the dataset
+    dtype: numpy dtype of the saved data
+    block_spectra: int
+        number of spectra written at once
+    max_blocks: int
+        number of blocks in the pool, add_spectrum waits for a block to be written if they are all in use
+    attributes: dict
+        saved as attributes of the dataset
+    """
+
+    def __init__(self, path, spectrum_length, nspectra, spim_shape=None, dtype=np.float32, block_spectra=64,
+                 max_blocks=16, attributes=None):
+        self.path = str(path)
+        self.spectrum_length = spectrum_length
+        self.nspectra = nspectra
+        self.spim_shape = spim_shape
+        self.dtype = np.dtype(dtype)
+        self.block_spectra = block_spectra
+        self.attributes = attributes if attributes is not None else dict()
+        self.written = 0
+        self.waits = 0  # number of times add_spectrum had to wait for a free block
+        self.error: Exception = None
+
+        self._free_blocks = queue.Queue()
+        for ind in range(max_blocks):
+            self._free_blocks.put(np.zeros((block_spectra, spectrum_length), dtype=self.dtype))
+        self._full_blocks = queue.Queue()
+        self._lock = threading.Lock()
+        self._block: np.ndarray = None
+        self._block_count = 0
+        self._thread: threading.Thread = None
+        self._h5file: tables.File = None
+
+    def start(self):
+        self._h5file = tables.open_file(self.path, mode='w', title='Orsay SPIM')
+        array = self._h5file.create_earray('/', 'spim', atom=tables.Atom.from_dtype(self.dtype),
+                                           shape=(0, self.spectrum_length),
+                                           chunkshape=(self.block_spectra, self.spectrum_length),
+                                           expectedrows=self.nspectra)
+        if self.spim_shape is not None:
+            array.attrs['spim_shape'] = tuple(self.spim_shape)
+        for key, value in self.attributes.items():
+            array.attrs[key] = value
+        self._thread = threading.Thread(target=self._run, args=(array,), name='OrsaySpimWriter', daemon=True)
+        self._thread.start()
+
+    def add_spectrum(self, spectrum: np.ndarray):
+        """ Copy the spectrum in the current block, to be called from the spectrum unlocker """
+        with self._lock:
+            if self._block is None:
+                try:
+                    self._block = self._free_blocks.get_nowait()
+                except queue.Empty:
+                    self.waits += 1
+                    self._block = self._free_blocks.get()
+                self._block_count = 0
+            self._block[self._block_count, :] = spectrum[:self.spectrum_length]
+            self._block_count += 1
+            if self._block_count == self.block_spectra:
+                self._push_block()
+
+    def _push_block(self):
+        if self._block is not None and self._block_count > 0:
+            self._full_blocks.put((self._block, self._block_count))
+            self._block = None
+
+    def flush(self):
+        """ Hand the spectra of the current (partial) block to the writer thread """
+        with self._lock:
+            self._push_block()
+
+    def close(self):
+        """ Write the remaining spectra and close the file, returns the number of spectra written """
+        if self._thread is None:
+            return self.written
+        self.flush()
+        self._full_blocks.put(None)
+        self._thread.join()
+        self._thread = None
+        self._h5file.close()
+        return self.written
+
+    def _run(self, array):
+        while True:
+            item = self._full_blocks.get()
+            if item is None:
+                break
+            block, count = item
+            try:
+                if self.error is None:
+                    array.append(block[:count])
+                    self._h5file.flush()
+                    self.written += count
+            except Exception as e:  # keep consuming so that add_spectrum never waits forever
+                self.error = e
+            self._free_blocks.put(block)
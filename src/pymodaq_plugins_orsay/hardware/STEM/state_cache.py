@@ -0,0 +1,78 @@
+"""
+Shadow of the settings of a Scan.dll or Cameras.dll handle, to avoid the dll round trips of redundant calls.
+
+The getters of orsayScan and orsayCamera read a setting from the dll once and then return the cached value, unless
+called with refresh=True. The setters skip the dll call when the value is the one already set, and update the cache:
+with the value itself if the dll applies it as is (exact), else by forgetting the cached value, read again from the
+dll by the next getter call (e.g. a pixel time rounded to the clock period). A setter also forgets the settings
+depending on the one it changes (e.g. the image area when the image size changes).
+
+The cache only knows the changes made through its handle: invalidate() forgets everything, e.g. after the device has
+been used by another program.
+"""
+import threading
+
+
+class StateCache:
+    """ Cached settings of a handle, keys being tuples such as ('image_size', gene)
+
+    Parameters
+    ----------
+    lock: threading.RLock
+        held while reading or writing a setting, the lock serializing the dll calls of the handle if any so that the
+        cache is updated in the order of the calls
+    """
+
+    def __init__(self, lock=None):
+        self.lock = lock if lock is not None else threading.RLock()
+        self.reads = 0  # getter calls reading the dll
+        self.hits = 0  # getter calls answered by the cache
+        self.skipped = 0  # setter calls skipped
+        self._values = dict()  # key: value read from or written to the dll
+        self._requested = dict()  # key: last value given to a setter not applied as is
+
+    def get(self, key, read, refresh=False):
+        """ Cached value of key, read() if not cached or refresh """
+        with self.lock:
+            if not refresh and key in self._values:
+                self.hits += 1
+                return self._values[key]
+            value = read()
+            self.reads += 1
+            self._values[key] = value
+            return value
+
+    def set(self, key, value, write, exact=True, invalidates=(), skipped_result=True):
+        """ Call write() unless value is the one already set, returns its result or skipped_result
+
+        exact tells if the dll applies the value as is (it is then cached) or adjusts it (it is read again by the next
+        get). invalidates lists the keys whose cached values depend on this setting. write() returning False is a
+        failure: the cached value is forgotten.
+        """
+        with self.lock:
+            current = self._values.get(key, None) if exact else self._requested.get(key, None)
+            if current is not None and current == value:
+                self.skipped += 1
+                return skipped_result
+            self._values.pop(key, None)
+            self._requested.pop(key, None)
+            for dependent in invalidates:
+                self.invalidate(dependent)
+            result = write()
+            if result is not False:
+                if exact:
+                    self._values[key] = value
+                else:
+                    self._requested[key] = value
+            return result
+
+    def invalidate(self, *keys):
+        """ Forget the given keys (and the keys starting with them, e.g. ('inputs',) for ('inputs', 1)), all if none """
+        with self.lock:
+            if not keys:
+                self._values.clear()
+                self._requested.clear()
+                return
+            for cache in (self._values, self._requested):
+                for cached in [cached for cached in cache if any(cached[:len(key)] == key for key in keys)]:
+                    del cache[cached]
@@ -0,0 +1,116 @@
+"""
+Background polling of the camera status, shared by all the users of a camera handle.
+
+getTemperature and getCCDStatus are dll round trips. Instead of calling them from Qt timers or from the data callbacks
+of every frame, one StatusMonitor thread per camera polls them at a configurable period and publishes an immutable
+CameraStatus snapshot that any thread reads at no cost.
+"""
+from dataclasses import dataclass, field
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PERIOD = 1.  # s
+
+
+@dataclass(frozen=True)
+class CameraStatus:
+    """ Snapshot of the camera status at the time of the last poll """
+    temperature: float = 0.
+    locked: bool = False
+    ccd_status: dict = field(default_factory=dict)  # as returned by orsayCamera.getCCDStatus
+    timestamp: float = 0.  # time.perf_counter() of the poll, 0 if never polled
+
+    @property
+    def mode(self) -> str:
+        return self.ccd_status.get('mode', 'idle')
+
+
+class StatusMonitor:
+    """ Thread polling the temperature and acquisition status of an orsayCamera
+
+    Use StatusMonitor.acquire(camera) to get the monitor of a camera (created and started on first use) and release()
+    once done with it: the thread is stopped when its last user releases it, that must happen before the camera is
+    closed.
+    """
+    _monitors = dict()  # id of the camera object: monitor
+    _monitors_lock = threading.Lock()
+
+    def __init__(self, camera, period=DEFAULT_PERIOD):
+        self.camera = camera
+        self._period = period
+        self.status = CameraStatus()
+        self.polls = 0
+        self._users = 0
+        self._wake = threading.Event()
+        self._running = False
+        self._thread: threading.Thread = None
+
+    @classmethod
+    def acquire(cls, camera, period=None) -> 'StatusMonitor':
+        """ Monitor of the camera, period (s) if given replaces the polling period of the existing monitor """
+        with cls._monitors_lock:
+            monitor = cls._monitors.get(id(camera), None)
+            if monitor is None:
+                monitor = cls(camera, period if period is not None else DEFAULT_PERIOD)
+                cls._monitors[id(camera)] = monitor
+                monitor.poll()
+                monitor._start()
+            elif period is not None:
+                monitor.period = period
+            monitor._users += 1
+            return monitor
+
+    def release(self):
+        with self._monitors_lock:
+            self._users -= 1
+            if self._users > 0:
+                return
+            self._monitors.pop(id(self.camera), None)
+        self._running = False
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(2.)
+        self._thread = None
+
+    @property
+    def period(self):
+        return self._period
+
+    @period.setter
+    def period(self, period):
+        self._period = period
+        self._wake.set()
+
+    def poll(self) -> CameraStatus:
+        """ Read the status from the camera now and publish it, e.g. right after starting an acquisition """
+        temperature, locked = self.camera.getTemperature()
+        ccd_status = self.camera.getCCDStatus()
+        self.status = CameraStatus(temperature, locked, ccd_status, time.perf_counter())
+        self.polls += 1
+        return self.status
+
+    def refresh(self):
+        """ Have the monitor thread poll the status now, e.g. when a callback sees the end of an acquisition
+
+        Unlike poll, the dll is not called from the calling thread.
+        """
+        self._wake.set()
+
+    def _start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='OrsayCameraStatusMonitor', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self._period)
+            self._wake.clear()
+            if not self._running:
+                break
+            try:
+                self.poll()
+            except Exception:
+                logger.exception('Error while polling the camera status')